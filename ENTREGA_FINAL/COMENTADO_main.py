@@ -1,23 +1,27 @@
 # Paso 1: Cargar las bibliotecas necesarias
 import os
 
-import bson
 from colorama import Back, Fore, Style, init
 from dotenv import dotenv_values
-from joblib import Parallel, delayed
 from langchain_anthropic import ChatAnthropic
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.prompts import ChatPromptTemplate
-from pymongo import MongoClient
 
-from cryptography_utils import calculate_md5, create_env_file
-from extract_features import (
-    embed_certifications,
-    embed_education,
-    embed_works,
-    extract_resume_features,
-)
+from cryptography_utils import create_env_file
+from embedding_backends import load_embeddings
+from embedding_batcher import EmbeddingBatcher, LengthBucketedEmbeddings
+from embedding_cache import CachedEmbeddings
+from embedding_server import EmbeddingClient
 from extractClass import Extractor
+from extraction_cache import ExtractionCache
+from file_manifest import FileManifest
+from instrumentation import Metrics
+from llm_cache import CachedChain, LLMResponseCache
+from llm_client import AsyncExtractionClient
+from mongo_writer import BulkWriter, get_mongo_client
+from pipeline import CVPipeline, start_extract_pool
+from retry_scheduler import RetryPolicy
+from text_compaction import TextCompactor
+from work_scheduler import WorkScheduler
 
 # Paso 2: Aquí verificamos que las variables de entorno estén configuradas correctamente
 # para poder utilizar los servicios de terceros, en este caso, MongoDB, Anthropic y Azure.
@@ -51,10 +55,11 @@ directories = [
 ]
 
 print(Fore.CYAN + "ℹ️ Se han encontrado los siguientes directorios ℹ️")
-files = {}
+# Solo se cuentan las entradas, los archivos se descubren y se procesan por ventanas en el Paso 7
 for index, directory in enumerate(directories):
-    files[directories[index]] = os.listdir(f"resumes/{directory}")
-    print(f"  {index + 1}. {directory}\t ({len(files[directories[index]])} documentos)")
+    with os.scandir(f"resumes/{directory}") as entries:
+        count = sum(1 for entry in entries if entry.is_file())
+    print(f"  {index + 1}. {directory}\t ({count} documentos)")
 del index, directories
 
 
@@ -83,7 +88,47 @@ while True:
 print(Fore.CYAN + f"\n    ℹ️ Cargando configuración inicial ℹ️")
 print("⏳ Esto puede tardar un poco, por favor espere. ⌛")
 config = dotenv_values(".env")
-extract_client = Extractor(overwrite_env="prod")
+# Latencia de cada etapa (hash, extracción, OCR, LLM, parseo, embeddings, BSON, MongoDB), documentos en proceso,
+# tokens y bytes procesados. Se exportan como JSON lines y como archivo de texto de Prometheus.
+metrics = Metrics(
+    jsonl_path=config.get("METRICS_JSONL", "metrics.jsonl") or None,
+    prometheus_path=config.get("METRICS_PROMETHEUS", "metrics.prom") or None,
+)
+# Los procesos de extracción se crean antes que cualquier hilo (MongoDB, torch, embeddings),
+# puesto que se crean con fork y un fork solo copia el hilo que lo llama.
+extract_pool = start_extract_pool(
+    int(config.get("N_JOBS", 2)),
+    overwrite_env="prod",
+    cache_dir=config.get("EXTRACTION_CACHE_DIR", "extraction_cache"),
+    cache_max_bytes=int(config.get("EXTRACTION_CACHE_MAX_MB", 1024)) * 1024**2,
+    # Con PAGE_OCR_WORKERS > 0 los PDFs escaneados se procesan localmente con hi_res página por página
+    # en paralelo, en lugar de enviarlos a Azure.
+    page_options=(
+        {
+            "workers": int(config["PAGE_OCR_WORKERS"]),
+            "page_timeout": float(config.get("PAGE_OCR_TIMEOUT", 120)),
+            "min_chars": int(config.get("PAGE_OCR_MIN_CHARS", 0)),
+            "strategy": config.get("PAGE_OCR_STRATEGY", "hi_res"),
+        }
+        if int(config.get("PAGE_OCR_WORKERS", 0)) > 0
+        else None
+    ),
+    # Cada proceso mantiene sus propios workers de LibreOffice, cada uno con un soffice abierto y su perfil,
+    # para convertir los .doc y los .docx escaneados sin arrancar un soffice nuevo por archivo.
+    office_workers=int(config.get("LIBREOFFICE_WORKERS", 1)),
+)
+# Guardamos el texto extraído de cada archivo según su hash, así los reintentos y los CVs repetidos
+# en otras carpetas no vuelven a pasar por unstructured, LibreOffice ni el OCR de Azure.
+extract_client = Extractor(
+    overwrite_env="prod",
+    cache=ExtractionCache(
+        cache_dir=config.get("EXTRACTION_CACHE_DIR", "extraction_cache"),
+        max_bytes=int(config.get("EXTRACTION_CACHE_MAX_MB", 1024)) * 1024**2,
+    ),
+    # El OCR de Azure se envía por REST y todos los documentos pendientes se consultan desde un solo ciclo
+    ocr_max_in_flight=int(config.get("OCR_CONCURRENCY", 4)),
+    ocr_poll_interval=float(config.get("OCR_POLL_INTERVAL", 1)),
+)
 chat = ChatAnthropic(
     temperature=0,
     api_key=(
@@ -93,6 +138,10 @@ chat = ChatAnthropic(
     ),
     model_name="claude-3-haiku-20240307",
     max_tokens=4096,
+    # Con ANTHROPIC_API_URL se puede usar el servidor de prueba de anthropic_standin.py (ver benchmark_pipeline.py)
+    anthropic_api_url=config.get("ANTHROPIC_API_URL"),
+    # Los reintentos los maneja AsyncExtractionClient
+    max_retries=0,
 )
 system = """You are a bilingual virtual assistant who knows both English and Spanish. 
 Your task will be to extract information from resumes contained in the following user message. Once you have extracted 
@@ -109,13 +158,52 @@ Priorize parsing education. Do not skip any Work Experience or Education.
 """
 human = "{text}"
 prompt = ChatPromptTemplate.from_messages([("system", system), ("human", human)])
-chain = prompt | chat
-embeddings = HuggingFaceEmbeddings(
-    model_name="Alibaba-NLP/gte-base-en-v1.5",
-    model_kwargs={"device": "cpu", "trust_remote_code": True},
-    encode_kwargs={"normalize_embeddings": True},
+# Como temperature=0, la misma entrada siempre produce la misma respuesta, por lo que grabamos las respuestas
+# y las reutilizamos en ejecuciones posteriores. Con LLM_CACHE_MODE=replay no se hace ninguna llamada al LLM.
+# Las peticiones al LLM se limitan con token buckets alimentados con el uso real de tokens de cada respuesta,
+# y los errores por rate limit o sobrecarga se reintentan con backoff exponencial.
+llm_client = AsyncExtractionClient(
+    prompt | chat,
+    requests_per_minute=int(config.get("ANTHROPIC_RPM", 50)),
+    input_tokens_per_minute=int(config.get("ANTHROPIC_ITPM", 50000)),
+    output_tokens_per_minute=int(config.get("ANTHROPIC_OTPM", 10000)),
+    prompt_chars=len(system),
+)
+chain = CachedChain(
+    llm_client,
+    prompt,
+    chat.model,
+    LLMResponseCache(config.get("LLM_CACHE_PATH", "llm_cache.sqlite")),
+    mode=config.get("LLM_CACHE_MODE", "readwrite"),
+)
+# Si hay un servidor de embeddings en el nodo (python embedding_server.py), usamos su modelo ya cargado
+# en lugar de cargar otra copia del modelo en este proceso.
+if config.get("EMBEDDING_SOCKET"):
+    embeddings = EmbeddingClient(config["EMBEDDING_SOCKET"], connect_timeout=60)
+else:
+    # Con EMBEDDING_BACKEND=int8 el modelo se cuantiza a int8 (ver benchmark_embeddings.py antes de cambiarlo)
+    # Los textos de cada batch se agrupan por número de tokens para no rellenar los títulos cortos
+    # hasta la longitud de los briefs.
+    embeddings = LengthBucketedEmbeddings(
+        load_embeddings(config.get("EMBEDDING_BACKEND", "fp32")),
+        max_batch_tokens=int(config.get("EMBED_MAX_BATCH_TOKENS", 16384)),
+    )
+# Muchos textos se repiten entre CVs ("NA", puestos e instituciones comunes), por lo que
+# guardamos en disco los vectores ya calculados y solo se envían al modelo los textos nuevos.
+embedding_cache = CachedEmbeddings(
+    embeddings,
+    cache_dir=config.get("EMBEDDING_CACHE_DIR", "embedding_cache"),
+    max_memory_items=int(config.get("EMBEDDING_CACHE_MEMORY_ITEMS", 50000)),
+    max_disk_items=int(config.get("EMBEDDING_CACHE_DISK_ITEMS", 1000000)),
+)
+# Todos los hilos comparten el mismo modelo, por lo que agrupamos los textos de todos los CVs
+# en proceso en batches más grandes en lugar de hacer muchas llamadas pequeñas al modelo.
+embedder = EmbeddingBatcher(
+    embedding_cache,
+    max_batch_size=int(config.get("EMBED_BATCH_SIZE", 64)),
+    max_wait=int(config.get("EMBED_MAX_WAIT_MS", 50)) / 1000,
 )
-documentClient = MongoClient(config["MONGO_DOCS_URI"])
+documentClient = get_mongo_client(config["MONGO_DOCS_URI"])
 cE = documentClient["pisa"]["embedded"]
 # ------------------- End of General Configuration -------------------
 # Paso 5: Establecemos conexión con otra base de datos de MongoDB, en este caso, 
@@ -125,176 +213,190 @@ cE = documentClient["pisa"]["embedded"]
 # ------------------- Tracker Configuration -------------------
 print(Fore.CYAN + f"\n    ℹ️ Configurando tracker en MongoDB ℹ️")
 print("⏳ Esto puede tardar un poco, por favor espere. ⌛")
-tracker_client = MongoClient(config["MONGO_TRACKER_URI"])
+tracker_client = get_mongo_client(config["MONGO_TRACKER_URI"])
 tracker_db = tracker_client["pisa"]["tracker"]
+# Los archivos que fallaron con un error permanente o demasiadas veces se copian aquí para revisarlos
+dead_letter_db = tracker_client["pisa"]["dead_letter"]
+# Los errores temporales (rate limit, timeouts del OCR, red) se reintentan con backoff exponencial
+retry_policy = RetryPolicy(
+    max_attempts=int(config.get("RETRY_MAX_ATTEMPTS", 5)),
+    base_delay=float(config.get("RETRY_BASE_DELAY", 30)),
+    max_delay=float(config.get("RETRY_MAX_DELAY", 3600)),
+    requeue_max_delay=float(config.get("RETRY_REQUEUE_MAX_DELAY", 300)),
+)
 
 
-def process_file(directory, file):
-    current_hash = calculate_md5(f"resumes/{directory}/{file}")
-    if current_hash is False:
-        return None, None, None
-    existing_document = tracker_db.find_one({"hash": current_hash})
-    if existing_document is None:
-        return (
-            {
-                "hash": current_hash,
-                "directory": directory,
-                "filename": file,
-                "status": "pending",
-            },
-            file,
-            directory,
-        )
-    elif existing_document["status"] == "pending":
-        return None, file, directory
-    elif existing_document["status"] == "failed":
-        print(
-            Fore.RED
-            + "Ups 🙈, parece que se encontró un error previo,\n es necesario cambiar su estado fuera del flujo",
-            Fore.YELLOW + file,
-        )
-        return None, None, None
-    else:
-        return None, None, None
-
-
-unprocessed = {k: [] for k in files.keys()}
-results = Parallel(n_jobs=-1, prefer="threads")(
-    delayed(process_file)(directory, file)
-    for directory in files
-    for file in files[directory]
+# El manifiesto guarda tamaño, fecha de modificación, inodo y hash de cada archivo, así solo se vuelven a
+# calcular los hashes de los archivos nuevos o modificados. El hash se calcula una sola vez y viaja por todo el flujo.
+manifest = FileManifest(
+    config.get("FILE_MANIFEST_PATH", "file_manifest.sqlite"),
+    algorithm=config.get("HASH_ALGORITHM", "md5"),
+)
+# Los archivos se descubren con os.scandir en todos los directorios a la vez y se procesan por ventanas: cada
+# ventana se hashea, se consulta en el tracker con consultas $in y se planea con la política de reintentos
+# (pending, failed con su next_attempt_at, processed o dead), mientras el pipeline procesa la ventana anterior.
+# Cada vez que un archivo se programa se incrementa attempts, así los que interrumpen el flujo una y otra vez
+# también terminan en dead.
+scheduler = WorkScheduler(
+    manifest,
+    tracker_db,
+    dead_letter_db,
+    retry_policy,
+    window=int(config.get("DISCOVERY_WINDOW", 256)),
+    metrics=metrics,
 )
 
-documents_to_insert = [result[0] for result in results if result[0] is not None]
-for result in results:
-    if result[1] is not None:
-        unprocessed[result[2]].append(result[1])
-
-# Insert all documents in a single operation
-if documents_to_insert:
-    tracker_db.insert_many(documents_to_insert)
+# Las inserciones de documentos y las actualizaciones del tracker se acumulan y se envían en lotes con bulk_write,
+# el tracker siempre se escribe después de los documentos para no marcar como procesado un CV sin guardar.
+documents_writer = BulkWriter(
+    cE,
+    max_batch=int(config.get("MONGO_BATCH_SIZE", 500)),
+    max_wait=float(config.get("MONGO_MAX_WAIT", 2)),
+    metrics=metrics,
+    name="mongo_documents",
+)
+tracker_writer = BulkWriter(
+    tracker_db,
+    max_batch=int(config.get("MONGO_BATCH_SIZE", 500)),
+    max_wait=float(config.get("MONGO_MAX_WAIT", 2)),
+    flush_first=documents_writer,
+    metrics=metrics,
+    name="mongo_tracker",
+    # Las actualizaciones de un mismo CV se aplican en orden (p. ej. procesado y luego fallido si su documento
+    # no se pudo guardar)
+    ordered=True,
+)
+dead_letter_writer = BulkWriter(
+    dead_letter_db,
+    max_batch=int(config.get("MONGO_BATCH_SIZE", 500)),
+    max_wait=float(config.get("MONGO_MAX_WAIT", 2)),
+    flush_first=tracker_writer,
+    metrics=metrics,
+    name="mongo_dead_letter",
+)
 
-del documents_to_insert, results, process_file, files, directory
 # ------------------- End of Tracker Configuration -------------------
-# Paso 6: Procesar los documentos que no se han procesado previamente:
-# 6.1. Extraer el texto de los documentos: Para esto usamos diferentes técnicas de extracción de texto. 
-# Estas técnicas se pueden consultar a mayor detalle en el archivo extractClass.py. Pero en resumen, el flujo normal
-# será tratar de extraer el texto de manera ingenua de manera local, si no se puede, se intentará extraer el texto
-# utilizando el servicio de Azure.
-# 6.2. Procesar el texto extraído: Una vez que se tiene el texto extraído, se procede a categorizar la información
-# en diferentes categorías, como trabajo, educación, certificaciones, etc. Además, se extraen características como
-# años de experiencia, años de experiencia en gestión, tiempo promedio en un trabajo, etc.
-# Para el texto extraído se utiliza el modelo de lenguaje de Anthropic, en este caso, Claude-3-haiku-20240307.
+# Paso 6: Procesar los documentos que no se han procesado previamente. El procesamiento se divide en etapas,
+# cada una con su propio tipo de trabajador y conectadas por colas acotadas (ver pipeline.py):
+# 6.1. extract: Extraer el texto de los documentos en un pool de procesos. Para esto usamos diferentes técnicas de
+# extracción de texto. Estas técnicas se pueden consultar a mayor detalle en el archivo extractClass.py. Pero en resumen,
+# el flujo normal será tratar de extraer el texto de manera ingenua de manera local.
+# 6.2. ocr: Si no se puede, se extrae el texto utilizando el servicio de Azure con peticiones asíncronas.
+# 6.3. llm: Procesar el texto extraído: se categoriza la información en diferentes categorías, como trabajo, educación,
+# certificaciones, etc. Para el texto extraído se utiliza el modelo de lenguaje de Anthropic, en este caso,
+# Claude-3-haiku-20240307, también con peticiones asíncronas.
 # Procesar el texto así trae una ventajas significativas pues nos desaremos de características que pueden inducir
 # a sesgos en el futuro, puesto que el modelo del lenguaje ayuda a estandarizar el lenguaje volviendo todo el texto
-# al idioma inglés, quitando cualquier tipo de género, etc. Posteriormente, se calcula un embedding para todos los
-# datos de texto y se normalizan. Finalmente, se insertan los datos en la base de datos de MongoDB.
-# 6.3. Actualizar el estado de los documentos procesados: Una vez que se ha procesado un documento, se actualiza su
-# estado en la base de datos de MongoDB, indicando que ya ha sido procesado y si hubo algún error, se registra el error.
+# al idioma inglés, quitando cualquier tipo de género, etc.
+# 6.4. finish: Se extraen características como años de experiencia, años de experiencia en gestión, tiempo promedio
+# en un trabajo, etc. Posteriormente, se calcula un embedding para todos los datos de texto (agrupados en batches por
+# el EmbeddingBatcher) y se normalizan. Finalmente, se insertan los datos en la base de datos de MongoDB y se actualiza
+# el estado de los documentos procesados, si hubo algún error, se registra el error.
 # ------------------- Process Documents -------------------
-def process_cv(
-    path: str,
-    file: str,
-    verbose_tokens: bool = False,
-    upload_mongo: bool = True,
-):
-    try:
-        current_hash = calculate_md5(path + file)
-        if current_hash is False:
-            raise Exception("Failed to calculate MD5")
-
-        createdAt, allText = extract_client.extract(
-            path + file, azure=True, return_created_at=True
-        )
-
-        output = chain.invoke({"text": allText})
-        if verbose_tokens:
-            tokens = output.response_metadata["usage"]
-            lectura = 0.25 / 1000000 * 17.05 * tokens["input_tokens"]
-            escritura = 1.25 / 1000000 * 17.05 * tokens["output_tokens"]
-            print(
-                "Costo de lectura: ${} ({} tokens) \nCosto de escritura ${} ({} tokens)\nTotal ${}".format(
-                    lectura,
-                    tokens["input_tokens"],
-                    escritura,
-                    tokens["output_tokens"],
-                    lectura + escritura,
-                )
-            )
-
-        (
-            work,
-            education,
-            certification,
-            expYears,
-            expYearsManagement,
-            avgTimeInJob,
-        ) = extract_resume_features(output.content, createdAt)
-
-        embedded_work = embed_works(work, embeddings)
-        embedded_cert = embed_certifications(certification, embeddings)
-        embedded_edu = embed_education(education, embeddings)
-
-        datos = {
-            "file": f"{file}//{current_hash}",
-            "work": work,
-            "education": education,
-            "certification": certification,
-            "label": path,
-        }
-        datos_bson = bson.encode(datos)
-        # Escribir el BSON a un archivo
-        with open(f"bsons/{file}.bson", "wb") as archivo:
-            archivo.write(datos_bson)
-        del datos_bson
-
-        if upload_mongo:
-            cE.insert_one(
-                {
-                    "file": f"{file}//{current_hash}",
-                    "expYears": expYears,
-                    "expYearsManagement": expYearsManagement,
-                    "avgTimeInJob": avgTimeInJob,
-                    "highestEducation": embedded_edu["maxEducationLevel"],
-                    "work": embedded_work,
-                    "certification": embedded_cert,
-                    "bachelor": (
-                        embedded_edu["bachelor"] if "bachelor" in embedded_edu else None
-                    ),
-                    "maxEducation": (
-                        embedded_edu["maxEducation"]
-                        if "maxEducation" in embedded_edu
-                        else None
-                    ),
-                    "label": path,
-                }
-            )
-            tracker_db.update_one(
-                {"hash": current_hash},
-                {"$set": {"status": "processed"}},
-            )
-        print(Fore.GREEN + f"✅ {file} se procesó correctamente. ✅")
-        return output
-    except Exception as e:
-        if e == "Failed to calculate MD5":
-            print(Fore.YELLOW + f"⚠️ El archivo {file} ya no se encuentra disponible ⚠️")
-        else:
-            print(Fore.RED + f"❌ Error al procesar {file} ❌")
-            tracker_db.update_one(
-                {"hash": current_hash},
-                {"$set": {"status": "failed", "error": str(e)}},
-            )
+cv_pipeline = CVPipeline(
+    chain,
+    embedder,
+    extract_client,
+    extract_pool,
+    collection=documents_writer,
+    tracker=tracker_writer,
+    extract_workers=int(config.get("N_JOBS", 2)),
+    ocr_concurrency=int(config.get("OCR_CONCURRENCY", 4)),
+    llm_concurrency=int(config.get("LLM_CONCURRENCY", 64)),
+    finish_workers=int(config.get("FINISH_WORKERS", 4)),
+    verbose_tokens=False,
+    upload_mongo=True,
+    monitor_interval=float(config.get("MONITOR_INTERVAL", 60)),
+    # Con LLM_STREAM=1 la respuesta del LLM se recibe por partes y cada registro (Type: ... Brief: ...) se envía
+    # a los embeddings en cuanto está completo, mientras el modelo sigue generando el resto.
+    stream=config.get("LLM_STREAM", "1") == "1",
+    # Antes de enviar el texto al LLM se quitan encabezados, pies de página, números de página y ruido del OCR,
+    # y los CVs muy largos se dividen en secciones que se envían en paralelo para no agotar los tokens de salida.
+    compactor=(
+        TextCompactor(max_tokens=int(config.get("LLM_CHUNK_TOKENS", 4000)))
+        if config.get("LLM_COMPACT_TEXT", "1") == "1"
+        else None
+    ),
+    metrics=metrics,
+    retry_policy=retry_policy,
+    dead_letters=dead_letter_writer,
+)
+# Los CVs cuyo documento rechazó MongoDB se marcan como fallidos en el tracker en lugar de procesados
+documents_writer.on_failure = cv_pipeline.on_write_failure
 # ------------------- End of Process Documents -------------------
-# Paso 7: Creamos un loop para ejecutar el paso 6 en forma paralela, para poder procesar todos los documentos
-# de manera eficiente.
-for directory in unprocessed.keys():
-    print(f"\n📁 Empezando a procesar el Foldere{directory}  📁")
-    Parallel(n_jobs=config.get("N_JOBS", 2), prefer="threads")(
-        delayed(process_cv)(
-            f"resumes/{directory}/",
-            file,
-            verbose_tokens=False,
-            upload_mongo=True,
+# Paso 7: Procesamos los documentos de todos los directorios en una sola cola compartida, así los trabajadores
+# no se quedan sin trabajo mientras terminan los últimos archivos de un directorio. Los archivos nuevos van antes
+# que los reintentos, y dentro de cada ventana los más costosos (OCR, LibreOffice, los más grandes) van primero
+# para que no sean los últimos en terminar.
+cv_pipeline.run(scheduler)
+manifest.close()
+for directory, counts in scheduler.counts.items():
+    print(
+        f"📁 {directory}: {counts['scheduled']} procesados de {counts['found']} documentos, "
+        f"{counts['waiting']} esperan su siguiente reintento, {counts['dead']} a dead letters"
+    )
+print(Fore.CYAN + "\nℹ️ Uso de las etapas del pipeline:\n" + cv_pipeline.pipeline.format_stats())
+dead_letter_writer.close()
+tracker_writer.close()
+documents_writer.close()
+stats = documents_writer.stats()
+print(
+    Fore.CYAN
+    + "\nℹ️ MongoDB: {} documentos en {} lotes (latencia promedio {:.3f}s, máxima {:.3f}s), {} errores".format(
+        stats["written"],
+        stats["batches"],
+        stats["avg_latency"],
+        stats["max_latency"],
+        stats["errors"],
+    )
+)
+stats = extract_client.ocr_stats()
+if stats is not None:
+    print(
+        Fore.CYAN
+        + "ℹ️ OCR: {} documentos, {} fallidos, {} consultas de estado, latencia promedio {:.1f}s".format(
+            stats["completed"], stats["failed"], stats["polls"], stats["avg_latency"]
         )
-        for file in unprocessed[directory]
     )
+if cv_pipeline.compactor is not None:
+    stats = cv_pipeline.compactor.stats()
+    print(
+        Fore.CYAN
+        + "ℹ️ Texto para el LLM: {:.1%} menos caracteres, {} CVs divididos en secciones".format(
+            stats["reduction"], stats["chunked"]
+        )
+    )
+stats = llm_client.stats()
+print(
+    Fore.CYAN
+    + "ℹ️ LLM: {} peticiones, {} reintentos ({} por rate limit), {} tokens de entrada y {} de salida".format(
+        stats["completed"],
+        stats["retries"],
+        stats["rate_limited"],
+        stats["input_tokens"],
+        stats["output_tokens"],
+    )
+)
+embedder.close()
+stats = embedder.stats()
+print(
+    Fore.CYAN
+    + "\nℹ️ Embeddings: {} batches, {:.1f} textos por batch en promedio, latencia p50 {:.3f}s p95 {:.3f}s".format(
+        stats["batches"],
+        stats["avg_batch_size"],
+        stats["p50_latency"],
+        stats["p95_latency"],
+    )
+)
+embedding_cache.close()
+stats = embedding_cache.stats()
+print(
+    Fore.CYAN
+    + "ℹ️ Caché de embeddings: {:.1%} de aciertos ({} en memoria, {} en disco, {} nuevos)".format(
+        stats["hit_rate"], stats["hits_memory"], stats["hits_disk"], stats["misses"]
+    )
+)
+if isinstance(embeddings, EmbeddingClient):
+    embeddings.close()
+metrics.export()
+print(Fore.CYAN + "\nℹ️ Latencia por etapa:\n" + metrics.format_stats())
@@ -0,0 +1,258 @@
+"""
+Local stand-in of the Messages API of Anthropic, to run and benchmark the flow without spending credits.
+It answers every request with a canned response in the template of the extraction prompt (Type:, Management:,
+Title:, ...), generated from the hash of the request so the same CV always gets the same response, after a
+configurable latency. It supports streaming (server-sent events) and answers 429 when too many requests are running.
+
+Usage:
+    python anthropic_standin.py --port 8766 --latency 4
+    (and ANTHROPIC_API_URL=http://127.0.0.1:8766 in the .env)
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TITLES = ["Software Engineer", "Project Manager", "Sales Director", "Data Analyst", "Accountant", "Operations Manager", "HR Specialist", "Marketing Coordinator"]
+INSTITUTIONS = ["Grupo Industrial del Norte", "Banco Nacional", "Tecnologías Avanzadas SA", "Consultores Asociados", "Comercializadora del Bajío"]
+SCHOOLS = ["Universidad Nacional Autónoma de México", "Tecnológico de Monterrey", "Universidad de Guadalajara", "IPN"]
+DEGREES = ["Bachelors Degree in Engineering", "Bachelors Degree in Business", "Masters in Finance", "MBA", "High School"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+
+
+def template_response(rng: random.Random) -> str:
+    """
+    Returns a response in the template of the extraction prompt, with 1 to 5 jobs, 1 or 2 degrees
+    and sometimes a certification.
+    """
+    records = []
+    year = rng.randint(2000, 2012)
+    for job in range(rng.randint(1, 5)):
+        start = f"{rng.choice(MONTHS)}, {year}"
+        year += rng.randint(1, 4)
+        end = "Present" if job == 0 and rng.random() < 0.5 else f"{rng.choice(MONTHS)}, {year}"
+        records.append(
+            "\n".join(
+                [
+                    "Type: Work Experience",
+                    f"Management: {rng.choice(['Yes', 'No'])}",
+                    f"Title: {rng.choice(TITLES)}",
+                    f"Institution: {rng.choice(INSTITUTIONS)}",
+                    f"Start Date: {start}",
+                    f"End Date: {end}",
+                    f"Brief: The candidate was responsible for {rng.choice(['sales', 'operations', 'software', 'accounting', 'people'])} activities of the area.",
+                ]
+            )
+        )
+    for _ in range(rng.randint(1, 2)):
+        records.append(
+            "\n".join(
+                [
+                    "Type: Education",
+                    f"Title: {rng.choice(DEGREES)}",
+                    f"Institution: {rng.choice(SCHOOLS)}",
+                    f"Start Date: {rng.choice(MONTHS)}, {rng.randint(1990, 2005)}",
+                    f"End Date: {rng.choice(MONTHS)}, {rng.randint(2006, 2012)}",
+                    "Brief: NA",
+                ]
+            )
+        )
+    if rng.random() < 0.3:
+        records.append(
+            "\n".join(
+                [
+                    "Type: Certification",
+                    f"Title: {rng.choice(['PMP', 'Scrum Master', 'Six Sigma Green Belt'])}",
+                    f"Institution: {rng.choice(INSTITUTIONS)}",
+                    "Start Date: NA",
+                    "End Date: NA",
+                    "Brief: Certification of the candidate.",
+                ]
+            )
+        )
+    return "\n\n".join(records) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: dict, headers: dict = None) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _event(self, name: str, data: dict) -> None:
+        payload = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        standin = self.server.standin
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if not self.path.split("?")[0].endswith("/v1/messages"):
+            return self._reply(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+        if not standin.start():
+            return self._reply(
+                429,
+                {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limit"}},
+                {"retry-after": "1"},
+            )
+        try:
+            text = json.dumps(request.get("messages", []), ensure_ascii=False) + str(request.get("system", ""))
+            rng = random.Random(sha256(text.encode()).hexdigest())
+            content = template_response(rng)
+            latency = standin.latency * rng.uniform(1 - standin.jitter, 1 + standin.jitter)
+            usage = {"input_tokens": len(text) // 4, "output_tokens": len(content) // 4}
+            message = {
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": request.get("model", "stand-in"),
+                "stop_sequence": None,
+            }
+            if not request.get("stream", False):
+                time.sleep(latency)
+                return self._reply(
+                    200,
+                    {
+                        **message,
+                        "content": [{"type": "text", "text": content}],
+                        "stop_reason": "end_turn",
+                        "usage": usage,
+                    },
+                )
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = [content[i : i + 40] for i in range(0, len(content), 40)]
+            # A fifth of the latency before the first token, the rest spread over the pieces
+            time.sleep(latency / 5)
+            self._event(
+                "message_start",
+                {
+                    "type": "message_start",
+                    "message": {
+                        **message,
+                        "content": [],
+                        "stop_reason": None,
+                        "usage": {"input_tokens": usage["input_tokens"], "output_tokens": 1},
+                    },
+                },
+            )
+            self._event(
+                "content_block_start",
+                {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+            )
+            for piece in pieces:
+                time.sleep(latency * 4 / 5 / len(pieces))
+                self._event(
+                    "content_block_delta",
+                    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}},
+                )
+            self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self._event(
+                "message_delta",
+                {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": usage["output_tokens"]},
+                },
+            )
+            self._event("message_stop", {"type": "message_stop"})
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            standin.finish()
+
+
+class AnthropicStandIn:
+    """
+    HTTP server that behaves like the Messages API of Anthropic for the extraction chain.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 4.0,
+        jitter: float = 0.5,
+        max_running: int = 64,
+    ) -> None:
+        """
+        Initializes the AnthropicStandIn class and binds the port, the server runs after start is called.
+
+        Args:
+            port (int, optional): Port of the server, 0 picks a free one. Defaults to 0.
+            latency (float, optional): Average seconds of a response. Defaults to 4.0.
+            jitter (float, optional): Fraction of random variation of the latency. Defaults to 0.5.
+            max_running (int, optional): Requests running at the same time before answering 429. Defaults to 64.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.max_running = max_running
+        self._lock = threading.Lock()
+        self._running = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+        self.requests = 0
+        self.rejected = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> bool:
+        with self._lock:
+            if self._running >= self.max_running:
+                self.rejected += 1
+                return False
+            self._running += 1
+            self.requests += 1
+            return True
+
+    def finish(self) -> None:
+        with self._lock:
+            self._running -= 1
+
+    def start_background(self) -> "AnthropicStandIn":
+        """
+        Serves in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=4.0)
+    parser.add_argument("--max-running", type=int, default=64)
+    args = parser.parse_args()
+
+    standin = AnthropicStandIn(args.port, args.latency, max_running=args.max_running)
+    print(f"Anthropic de prueba escuchando en {standin.url}")
+    try:
+        standin._server.serve_forever()
+    except KeyboardInterrupt:
+        standin.close()
@@ -0,0 +1,191 @@
+from datetime import datetime
+
+import numpy as np
+
+DAY = np.timedelta64(1, "D")
+
+
+def work_columns(works: list) -> dict:
+    """
+    Converts the work experience of many CVs, as returned by apply_regex_template, to columnar arrays.
+
+    Args:
+        works (list): A list with the work experience list of each CV, each one sorted as apply_regex_template sorts it.
+
+    Returns:
+        dict: A dictionary with the following keys, with one element per job:
+            - "cv": The position of the CV of the job in works.
+            - "start": The start date, as datetime64[us] (naive, like the datetimes of the jobs).
+            - "end": The end date, as datetime64[us].
+            - "management": False if the job was not in a management position (management == "No").
+            - "fictional": True if the end date was assumed.
+            - "n_cvs": The number of CVs.
+    """
+    jobs = [(i, w) for i, work in enumerate(works) for w in work]
+
+    def date(value):
+        # Dates that could not be parsed are NaT, the features of their CV are not valid
+        return value if isinstance(value, datetime) else None
+
+    return {
+        "cv": np.array([i for i, _ in jobs], dtype=np.int64),
+        "start": np.array([date(w["start"]) for _, w in jobs], dtype="datetime64[us]"),
+        "end": np.array([date(w["end"]) for _, w in jobs], dtype="datetime64[us]"),
+        "management": np.array([w["management"] != "No" for _, w in jobs], dtype=bool),
+        "fictional": np.array([w.get("fictional", False) for _, w in jobs], dtype=bool),
+        "n_cvs": len(works),
+    }
+
+
+def _local_days(dates: np.ndarray) -> tuple:
+    """
+    Returns ceil(timestamp / 86400) of each date, with the timestamp in the local timezone as datetime.timestamp
+    computes it, and the dates that can't be converted. It's computed once per distinct date.
+    """
+    unique, inverse = np.unique(dates, return_inverse=True)
+    days = np.zeros(len(unique), dtype=np.int64)
+    timestamps = np.zeros(len(unique), dtype=np.float64)
+    broken = np.zeros(len(unique), dtype=bool)
+    for i, date in enumerate(unique.astype(object)):
+        try:
+            timestamps[i] = date.timestamp()
+            days[i] = np.ceil(timestamps[i] / 86400)
+        except (ValueError, OverflowError, OSError, AttributeError):
+            broken[i] = True
+    return days[inverse], timestamps[inverse], broken[inverse]
+
+
+def _union_days(cv: np.ndarray, begin: np.ndarray, end: np.ndarray, n_cvs: int) -> np.ndarray:
+    """Length of the union of the intervals [begin, end) of each CV, with a sort and sweep over all the CVs."""
+    total = np.zeros(n_cvs, dtype=np.int64)
+    if len(cv) == 0:
+        return total
+    # Each CV is moved to its own range, so a single sweep does not merge intervals of different CVs
+    low = min(begin.min(), end.min())
+    span = max(begin.max(), end.max()) - low + 1
+    begin = (begin - low) + cv * span
+    end = (end - low) + cv * span
+    order = np.lexsort((begin, cv))
+    begin, end, cv = begin[order], end[order], cv[order]
+    covered = np.maximum.accumulate(end)
+    previous = np.concatenate([[np.iinfo(np.int64).min], covered[:-1]])
+    lengths = np.maximum(end - np.maximum(begin, previous), 0)
+    np.add.at(total, cv, lengths)
+    return total
+
+
+def _aggregate(cv, start_days, end_days, start_ts, broken, considered, n_cvs) -> tuple:
+    """
+    Batch version of aggregate_work_experience over the considered jobs. Returns the years of each CV and
+    the CVs where it raises an error (a date without timestamp or an interval rejected by the IntervalTree).
+    """
+    cv, start_days, end_days, start_ts = (
+        cv[considered],
+        start_days[considered],
+        end_days[considered],
+        start_ts[considered],
+    )
+    start_broken, end_broken = broken[0][considered], broken[1][considered]
+    # aggregate_work_experience skips the jobs that start at timestamp 0 while the starting position
+    # (the day of the first start) is still 0, which it is until a job starts out of the day (-1, 0]
+    sets_start = start_days != 0
+    before = np.cumsum(sets_start) - sets_start
+    first = np.zeros(n_cvs, dtype=np.int64)
+    if len(cv) > 0:
+        starts = np.flatnonzero(np.concatenate([[True], cv[1:] != cv[:-1]]))
+        first[cv[starts]] = before[starts]
+    added = ~((start_ts == 0.0) & (before - first[cv] == 0))
+    # The intervals are relative to the starting position when they are added, 0 for the jobs added before
+    # it's set (they start in the day (-1, 0] without being exactly at timestamp 0)
+    position = np.zeros(n_cvs, dtype=np.int64)
+    setters = np.flatnonzero(sets_start & (before - first[cv] == 0))
+    position[cv[setters]] = start_days[setters]
+    offset = np.where(sets_start | (before - first[cv] > 0), position[cv], 0)
+
+    begin, end = (start_days - offset)[added], (end_days - offset)[added] + 1
+    null = np.zeros(n_cvs, dtype=bool)
+    # The timestamp of every start is computed, the one of the end only for the jobs added
+    null[cv[start_broken | (added & end_broken)]] = True
+    null[cv[added][begin >= end]] = True
+    return _union_days(cv[added], begin, end, n_cvs) / 365, null
+
+
+def experience_features(
+    cv: np.ndarray,
+    start: np.ndarray,
+    end: np.ndarray,
+    management: np.ndarray,
+    fictional: np.ndarray,
+    n_cvs: int,
+) -> dict:
+    """
+    Computes expYears, expYearsManagement and avgTimeInJob of many CVs at once, with the same results as
+    extract_resume_features. The jobs of each CV must be contiguous and in the order of apply_regex_template.
+
+    Args:
+        cv (np.ndarray): The position of the CV of each job.
+        start (np.ndarray): The start date of each job, as datetime64 (naive).
+        end (np.ndarray): The end date of each job, as datetime64 (naive).
+        management (np.ndarray): False for the jobs that were not in a management position.
+        fictional (np.ndarray): True for the jobs with an assumed end date.
+        n_cvs (int): The number of CVs.
+
+    Returns:
+        dict: A dictionary with the following keys, with one element per CV:
+            - "expYears": The aggregated work experience in years.
+            - "expYearsManagement": The aggregated work experience in years for management roles only.
+            - "avgTimeInJob": The average time spent in each job.
+            - "valid": False for the CVs where extract_resume_features raises an error, whose features are NaN.
+    """
+    cv = np.asarray(cv, dtype=np.int64)
+    start = np.asarray(start, dtype="datetime64[us]")
+    end = np.asarray(end, dtype="datetime64[us]")
+    management = np.asarray(management, dtype=bool)
+    fictional = np.asarray(fictional, dtype=bool)
+
+    start_days, start_ts, start_broken = _local_days(start)
+    end_days, _, end_broken = _local_days(end)
+    broken = (start_broken, end_broken)
+    everything = np.ones(len(cv), dtype=bool)
+    expYears, null = _aggregate(cv, start_days, end_days, start_ts, broken, everything, n_cvs)
+    expYearsManagement, null_management = _aggregate(
+        cv, start_days, end_days, start_ts, broken, management, n_cvs
+    )
+
+    # (end - start).days of the real jobs, with naive datetimes as avg_time_in_job
+    real = ~fictional
+    with np.errstate(divide="ignore", invalid="ignore"):
+        durations = (end[real] - start[real]) // DAY
+        count = np.bincount(cv[real], minlength=n_cvs)
+        total = np.bincount(cv[real], weights=durations, minlength=n_cvs)
+        jobs = np.bincount(cv, minlength=n_cvs)
+        avgTimeInJob = np.where(jobs > 0, total / count / 365, 0.0)
+
+    valid = ~(null | null_management | ((jobs > 0) & (count == 0)))
+    return {
+        "expYears": np.where(valid, expYears, np.nan),
+        "expYearsManagement": np.where(valid, expYearsManagement, np.nan),
+        "avgTimeInJob": np.where(valid, avgTimeInJob, np.nan),
+        "valid": valid,
+    }
+
+
+def batch_resume_features(works: list) -> dict:
+    """
+    Computes expYears, expYearsManagement and avgTimeInJob of the work experience of many CVs.
+
+    Args:
+        works (list): A list with the work experience list of each CV, as returned by apply_regex_template.
+
+    Returns:
+        dict: The arrays returned by experience_features, with one element per CV.
+    """
+    columns = work_columns(works)
+    return experience_features(
+        columns["cv"],
+        columns["start"],
+        columns["end"],
+        columns["management"],
+        columns["fictional"],
+        columns["n_cvs"],
+    )
@@ -0,0 +1,189 @@
+"""
+Benchmark of the embedding backends on a sample of real CV texts.
+
+It reports the documents per second of each backend and the cosine similarity between the vectors of each
+backend and the fp32 ones, both for the texts of the CVs (titles, institutions and briefs) and for the
+templated sentences of to_matrix, which together make the 15x768 inputs of the classifiers.
+
+With --buckets it also compares the plain model against LengthBucketedEmbeddings on the same texts, in the
+order they arrive from the CVs, and reports the real (unpadded) tokens per second of each one.
+
+Usage:
+    python benchmark_embeddings.py --llm-cache llm_cache.sqlite --limit 2000 --backends fp32 int8
+    python benchmark_embeddings.py --llm-cache llm_cache.sqlite --backends fp32 --buckets
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from embedding_backends import BACKENDS, load_embeddings
+from embedding_batcher import LengthBucketedEmbeddings
+from extract_features import apply_regex_template
+from feature_table import (
+    NA_JOB_SENTENCE,
+    NA_SENTENCE,
+    avg_time_in_job_sentence,
+    education_level_sentence,
+    exp_years_management_sentence,
+    exp_years_sentence,
+    management_sentence,
+)
+
+
+def sample_texts(llm_cache_path: str, limit: int) -> list:
+    """
+    Returns the texts embedded by main.py for the CVs recorded in the LLM response cache.
+
+    Args:
+        llm_cache_path (str): Path of the sqlite file of the LLMResponseCache.
+        limit (int): Maximum number of texts.
+
+    Returns:
+        list: The titles, institutions and briefs of the CVs.
+    """
+    db = sqlite3.connect(llm_cache_path)
+    texts = []
+    for (content,) in db.execute("SELECT content FROM responses"):
+        work, education, certification = apply_regex_template(content, time.time())
+        for w in work:
+            texts.extend([w["title"], w["institution"], w["brief"]])
+        for e in education:
+            texts.extend([e["title"], e["institution"]])
+        for c in certification:
+            texts.extend([c["title"], c["brief"]])
+        if len(texts) >= limit:
+            break
+    db.close()
+    return texts[:limit]
+
+
+def feature_sentences() -> list:
+    """
+    Returns a sample of the templated sentences of to_matrix.
+    """
+    sentences = []
+    for months in range(0, 241, 3):
+        sentences.append(exp_years_sentence(months, months >= 60))
+        sentences.append(exp_years_management_sentence(months, months >= 60))
+    sentences += [avg_time_in_job_sentence(years / 4) for years in range(1, 41)]
+    sentences += [management_sentence(True), management_sentence(False)]
+    sentences += [education_level_sentence(level) for level in range(-1, 4)]
+    sentences += [NA_JOB_SENTENCE, NA_SENTENCE]
+    return sentences
+
+
+def embed(embeddings, texts: list, batch_size: int) -> tuple:
+    """Returns the normalized vectors of the texts and the seconds it took to embed them."""
+    embeddings.embed_documents(texts[:batch_size])  # Warm up
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i : i + batch_size]))
+    elapsed = time.perf_counter() - start
+    vectors = np.asarray(vectors, dtype=np.float64)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, elapsed
+
+
+def drift(reference: np.ndarray, vectors: np.ndarray) -> dict:
+    """Returns the statistics of the cosine similarity between each pair of vectors."""
+    cosine = np.sum(reference * vectors, axis=1)
+    return {
+        "mean": float(cosine.mean()),
+        "p01": float(np.percentile(cosine, 1)),
+        "min": float(cosine.min()),
+    }
+
+
+def benchmark_buckets(embeddings, texts: list, batch_size: int, max_batch_tokens: int) -> dict:
+    """
+    Embeds the texts in batches of batch_size with the plain model and with LengthBucketedEmbeddings,
+    returning the real tokens per second of each one.
+    """
+    bucketed = LengthBucketedEmbeddings(
+        embeddings, max_batch_tokens=max_batch_tokens, max_batch_size=batch_size * 4
+    )
+    tokens = sum(bucketed.token_lengths(texts))
+    _, plain_elapsed = embed(embeddings, texts, batch_size)
+    # Same batches of texts as the plain model, each one is split in buckets of similar length
+    _, bucketed_elapsed = embed(bucketed, texts, batch_size)
+    stats = bucketed.stats()
+    return {
+        "tokens": tokens,
+        "plain_tokens_per_second": tokens / plain_elapsed,
+        "bucketed_tokens_per_second": tokens / bucketed_elapsed,
+        "padding_efficiency": stats["padding_efficiency"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--llm-cache", default="llm_cache.sqlite")
+    parser.add_argument("--texts", help="Text file with one text per line, used instead of the LLM cache")
+    parser.add_argument("--limit", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--buckets", action="store_true", help="Compare length-bucketed batches against the plain model")
+    parser.add_argument("--max-batch-tokens", type=int, default=16384)
+    parser.add_argument("--output", help="Path of a JSON file to save the results")
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()][: args.limit]
+    else:
+        texts = sample_texts(args.llm_cache, args.limit)
+    sentences = feature_sentences()
+    print(f"{len(texts)} textos de CVs y {len(sentences)} frases de to_matrix")
+
+    backends = ["fp32"] + [b for b in args.backends if b != "fp32"]
+    results, reference = {}, None
+    for backend in backends:
+        embeddings = load_embeddings(backend, threads=args.threads)
+        cv_vectors, elapsed = embed(embeddings, texts, args.batch_size)
+        feature_vectors, _ = embed(embeddings, sentences, args.batch_size)
+        results[backend] = {"docs_per_second": len(texts) / elapsed}
+        if reference is None:
+            reference = (cv_vectors, feature_vectors)
+        else:
+            results[backend]["cv_texts_cosine"] = drift(reference[0], cv_vectors)
+            results[backend]["feature_sentences_cosine"] = drift(
+                reference[1], feature_vectors
+            )
+        if args.buckets:
+            results[backend]["buckets"] = benchmark_buckets(
+                embeddings, texts + sentences, args.batch_size, args.max_batch_tokens
+            )
+        del embeddings
+
+    for backend, result in results.items():
+        line = f"{backend:>5}: {result['docs_per_second']:8.1f} docs/s"
+        line += f" ({result['docs_per_second'] / results['fp32']['docs_per_second']:.2f}x)"
+        for name in ["cv_texts_cosine", "feature_sentences_cosine"]:
+            if name in result:
+                line += "  {}: media {:.5f} p01 {:.5f} min {:.5f}".format(
+                    name, result[name]["mean"], result[name]["p01"], result[name]["min"]
+                )
+        print(line)
+        if "buckets" in result:
+            buckets = result["buckets"]
+            print(
+                "       buckets: {:.0f} tokens/s sin buckets, {:.0f} tokens/s con buckets ({:.2f}x), {:.1%} del padding son tokens reales".format(
+                    buckets["plain_tokens_per_second"],
+                    buckets["bucketed_tokens_per_second"],
+                    buckets["bucketed_tokens_per_second"] / buckets["plain_tokens_per_second"],
+                    buckets["padding_efficiency"],
+                )
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
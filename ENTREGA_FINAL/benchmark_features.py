@@ -0,0 +1,119 @@
+"""
+Benchmark and correctness check of the batch computation of the experience features, on the responses
+recorded in the LLM response cache.
+
+It computes expYears, expYearsManagement and avgTimeInJob of every recorded output with extract_resume_features,
+one CV at a time, and with batch_resume_features for all of them, and reports the CVs where they differ and the
+time of each one. It exits with status 1 if any CV differs.
+
+Usage:
+    python benchmark_features.py --llm-cache llm_cache.sqlite
+    python benchmark_features.py --llm-cache llm_cache.sqlite --copies 20
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from batch_features import batch_resume_features
+from benchmark_parser import CREATED_AT, recorded_outputs
+from extract_features import (
+    aggregate_work_experience,
+    apply_regex_template,
+    avg_time_in_job,
+    extract_resume_features,
+)
+
+
+def reference_features(outputs: list) -> list:
+    """
+    Returns (expYears, expYearsManagement, avgTimeInJob) of each output computed by extract_resume_features,
+    None for the outputs where it raises an error.
+    """
+    features = []
+    for outs in outputs:
+        try:
+            features.append(tuple(extract_resume_features(outs, CREATED_AT)[3:]))
+        except Exception:
+            features.append(None)
+    return features
+
+
+def check(outputs: list, works: list) -> list:
+    """
+    Returns the CVs where batch_resume_features and extract_resume_features give different results.
+    """
+    batch = batch_resume_features(works)
+    mismatches = []
+    for i, expected in enumerate(reference_features(outputs)):
+        if expected is None:
+            result = None if not batch["valid"][i] else "valid"
+        else:
+            result = (
+                batch["expYears"][i],
+                batch["expYearsManagement"][i],
+                batch["avgTimeInJob"][i],
+            )
+        if result != expected:
+            mismatches.append({"index": i, "expected": expected, "result": str(result)})
+    return mismatches
+
+
+def per_cv_seconds(works: list) -> float:
+    """Returns the seconds of computing the features one CV at a time, as extract_resume_features does."""
+    start = time.perf_counter()
+    for work in works:
+        try:
+            aggregate_work_experience(work)
+            aggregate_work_experience(work, only_management=True)
+            avg_time_in_job(work)
+        except Exception:
+            pass
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--llm-cache", default="llm_cache.sqlite")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument(
+        "--copies", type=int, default=1, help="Times the CVs are repeated for the timing, to time a larger corpus"
+    )
+    args = parser.parse_args()
+
+    outputs = recorded_outputs(args.llm_cache, args.limit)
+    if len(outputs) == 0:
+        print(f"No hay respuestas grabadas en {args.llm_cache}")
+        sys.exit(1)
+    # The outputs that apply_regex_template can't parse have no features in either case
+    parsed = []
+    for outs in outputs:
+        try:
+            parsed.append((outs, apply_regex_template(outs, CREATED_AT)[0]))
+        except Exception:
+            pass
+    outputs = [outs for outs, _ in parsed]
+    works = [work for _, work in parsed]
+
+    mismatches = check(outputs, works)
+    corpus = works * args.copies
+    per_cv = per_cv_seconds(corpus)
+    start = time.perf_counter()
+    batch = batch_resume_features(corpus)
+    vectorized = time.perf_counter() - start
+    report = {
+        "cvs": len(corpus),
+        "jobs": sum(len(work) for work in corpus),
+        "mismatches": len(mismatches),
+        "invalid_cvs": int(np.sum(~batch["valid"])),
+        "per_cv_seconds": per_cv,
+        "batch_seconds": vectorized,
+        "speedup": per_cv / vectorized,
+    }
+    print(json.dumps(report, indent=2))
+    for mismatch in mismatches[:10]:
+        print(json.dumps(mismatch, default=str))
+    sys.exit(1 if len(mismatches) > 0 else 0)
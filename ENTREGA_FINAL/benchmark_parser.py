@@ -0,0 +1,105 @@
+"""
+Micro-benchmark and correctness check of the parser of the LLM outputs, on the responses recorded in the
+LLM response cache.
+
+For every recorded output it compares apply_regex_template with fast=True (line parser and memoized dates)
+against fast=False (the regex and dateutil for every date) and reports the outputs that differ, then it
+times both on the same outputs. It exits with status 1 if any output differs.
+
+Usage:
+    python benchmark_parser.py --llm-cache llm_cache.sqlite
+    python benchmark_parser.py --llm-cache llm_cache.sqlite --limit 500 --repeat 5
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+
+from extract_features import apply_regex_template
+from record_parser import parse_date, parse_records
+
+# Fixed creation date, so both parsers resolve "Present" to the same date
+CREATED_AT = 1700000000.0
+
+
+def recorded_outputs(llm_cache_path: str, limit: int) -> list:
+    """
+    Returns the outputs of the LLM recorded in the LLM response cache.
+
+    Args:
+        llm_cache_path (str): Path of the sqlite file of the LLMResponseCache.
+        limit (int): Maximum number of outputs, 0 reads all of them.
+
+    Returns:
+        list: The outputs of the LLM.
+    """
+    db = sqlite3.connect(llm_cache_path)
+    query = "SELECT content FROM responses"
+    if limit > 0:
+        query += f" LIMIT {int(limit)}"
+    outputs = [content for (content,) in db.execute(query)]
+    db.close()
+    return outputs
+
+
+def check(outputs: list) -> list:
+    """
+    Returns the outputs where the fast parser and the regex give different results.
+    """
+    mismatches = []
+    for i, outs in enumerate(outputs):
+        expected = apply_regex_template(outs, CREATED_AT, fast=False)
+        result = apply_regex_template(outs, CREATED_AT, fast=True)
+        if result != expected:
+            mismatches.append({"index": i, "output": outs[:500]})
+    return mismatches
+
+
+def timing(outputs: list, fast: bool, repeat: int) -> float:
+    """Returns the best seconds of parsing all the outputs over the repetitions."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for outs in outputs:
+            apply_regex_template(outs, CREATED_AT, fast=fast)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--llm-cache", default="llm_cache.sqlite")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    outputs = recorded_outputs(args.llm_cache, args.limit)
+    if len(outputs) == 0:
+        print(f"No hay respuestas grabadas en {args.llm_cache}")
+        sys.exit(1)
+
+    # "Error while parsing" of the records the template can't read is printed by both parsers
+    mismatches = check(outputs)
+    regular = sum(parse_records(outs) is not None for outs in outputs)
+
+    parse_date.cache_clear()
+    cold = timing(outputs, True, 1)
+    regex = timing(outputs, False, args.repeat)
+    fast = timing(outputs, True, args.repeat)
+    report = {
+        "outputs": len(outputs),
+        "mismatches": len(mismatches),
+        "line_parser_outputs": regular,
+        "regex_fallback_outputs": len(outputs) - regular,
+        "regex_ms_per_output": 1000 * regex / len(outputs),
+        "fast_cold_ms_per_output": 1000 * cold / len(outputs),
+        "fast_ms_per_output": 1000 * fast / len(outputs),
+        "speedup": regex / fast,
+        "date_cache": parse_date.cache_info()._asdict(),
+    }
+    print(json.dumps(report, indent=2))
+    for mismatch in mismatches[:10]:
+        print(json.dumps(mismatch, ensure_ascii=False))
+    sys.exit(1 if len(mismatches) > 0 else 0)
@@ -0,0 +1,379 @@
+"""
+Offline end-to-end benchmark of COMENTADO_main.py.
+
+It generates a synthetic corpus of CVs (text PDFs, image-only PDFs, .docx and .doc) in the resumes/<label>/ layout
+of a temporary working directory, and runs the whole flow there against local stand-ins: anthropic_standin.py for
+the LLM, ocr_standin.py for Azure and mongomock for MongoDB. No credits are spent and no real database is touched;
+the embeddings model is the real one.
+
+The report has the files per second, the latency of each stage (from the metrics exported by the flow) and the
+peak RSS, together with the commit and the configuration, and is saved as JSON so runs of different commits can be
+compared with --compare.
+
+Usage:
+    python benchmark_pipeline.py --files 200
+    python benchmark_pipeline.py --files 200 --llm-latency 2 --env N_JOBS=4 --compare benchmarks/<previous>.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import psutil
+from docx import Document
+
+from anthropic_standin import AnthropicStandIn
+from ocr_standin import OCRStandIn
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+LABELS = ["Nivel Director", "Nivel Gerente", "Nivel Especialista"]
+KINDS = ["pdf", "scanned", "docx", "doc"]
+
+NAMES = ["Ana López", "Carlos Pérez", "María Hernández", "José García", "Lucía Martínez", "Jorge Ramírez"]
+POSITIONS = ["Gerente de Ventas", "Ingeniero de Software", "Director de Operaciones", "Analista de Datos", "Contador General", "Coordinador de Recursos Humanos"]
+COMPANIES = ["Grupo Industrial del Norte", "Banco Nacional", "Tecnologías Avanzadas SA", "Consultores Asociados", "Comercializadora del Bajío"]
+SCHOOLS = ["Universidad Nacional Autónoma de México", "Tecnológico de Monterrey", "Universidad de Guadalajara", "Instituto Politécnico Nacional"]
+DEGREES = ["Licenciatura en Administración", "Ingeniería Industrial", "Maestría en Finanzas", "Licenciatura en Contaduría"]
+MONTHS = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
+
+
+def cv_lines(rng: random.Random) -> list:
+    """
+    Returns the lines of a synthetic CV in Spanish.
+    """
+    lines = [rng.choice(NAMES), "Correo: candidato@example.com | Tel: 55 1234 5678", "", "EXPERIENCIA LABORAL"]
+    year = rng.randint(2000, 2012)
+    for _ in range(rng.randint(1, 5)):
+        start = f"{rng.choice(MONTHS)} {year}"
+        year += rng.randint(1, 4)
+        lines += [
+            rng.choice(POSITIONS),
+            f"{rng.choice(COMPANIES)}, {start} - {rng.choice(MONTHS)} {year}",
+            "Responsable de coordinar al equipo, dar seguimiento a los indicadores y reportar a la dirección.",
+            "",
+        ]
+    lines.append("EDUCACIÓN")
+    for _ in range(rng.randint(1, 2)):
+        lines += [rng.choice(DEGREES), f"{rng.choice(SCHOOLS)}, {rng.randint(1990, 2010)}", ""]
+    if rng.random() < 0.3:
+        lines += ["CERTIFICACIONES", rng.choice(["PMP", "Scrum Master", "Six Sigma Green Belt"])]
+    return lines
+
+
+def _pdf(objects: list) -> bytes:
+    """Builds a PDF from the bodies of its objects, the first one must be the catalog."""
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def _stream(data: bytes, extra: str = "") -> bytes:
+    return f"<< /Length {len(data)} {extra}>>\nstream\n".encode() + data + b"\nendstream"
+
+
+def text_pdf(lines: list) -> bytes:
+    """
+    Returns a single page PDF with the lines as text (Helvetica, WinAnsi encoding).
+    """
+    escaped = [
+        line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines
+    ]
+    content = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET"
+    return _pdf(
+        [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+            _stream(content.encode("cp1252", errors="replace")),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        ]
+    )
+
+
+def scanned_pdf(rng: random.Random, width: int = 620, height: int = 877) -> bytes:
+    """
+    Returns a single page PDF with only an image (gray blocks that look like lines of text), so it needs OCR.
+    """
+    rows = bytearray()
+    blocks = [(rng.randint(40, 120), rng.randint(200, 560)) for _ in range(height // 24 + 1)]
+    for y in range(height):
+        row = bytearray([255]) * width
+        start, end = blocks[y // 24]
+        if 6 <= y % 24 <= 16 and 40 <= y < height - 40:
+            row[start:end] = bytes([40]) * (end - start)
+        rows += row
+    image = zlib.compress(bytes(rows))
+    return _pdf(
+        [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R /Resources << /XObject << /Im1 5 0 R >> >> >>",
+            _stream(b"q 595 0 0 842 0 0 cm /Im1 Do Q"),
+            _stream(
+                image,
+                f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode ",
+            ),
+        ]
+    )
+
+
+def docx_file(lines: list, path: str) -> None:
+    document = Document()
+    for line in lines:
+        document.add_paragraph(line)
+    document.save(path)
+
+
+def generate_corpus(root: str, files: int, mix: dict, seed: int = 0) -> dict:
+    """
+    Generates the synthetic CVs in root/resumes/<label>/.
+
+    Args:
+        root (str): The working directory.
+        files (int): Number of CVs.
+        mix (dict): Fraction of each kind of file ("pdf", "scanned", "docx", "doc").
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        dict: The number of files of each kind, and the reason when the .doc files could not be generated.
+    """
+    rng = random.Random(seed)
+    counts = {kind: 0 for kind in KINDS}
+    pending_doc = []
+    for label in LABELS:
+        os.makedirs(os.path.join(root, "resumes", label), exist_ok=True)
+    for number in range(files):
+        kind = rng.choices(KINDS, weights=[mix.get(kind, 0) for kind in KINDS])[0]
+        folder = os.path.join(root, "resumes", rng.choice(LABELS))
+        lines = cv_lines(rng)
+        if kind == "pdf":
+            with open(os.path.join(folder, f"cv_{number:05d}.pdf"), "wb") as f:
+                f.write(text_pdf(lines))
+        elif kind == "scanned":
+            with open(os.path.join(folder, f"cv_{number:05d}.pdf"), "wb") as f:
+                f.write(scanned_pdf(rng))
+        elif kind == "docx":
+            docx_file(lines, os.path.join(folder, f"cv_{number:05d}.docx"))
+        else:
+            staging = os.path.join(root, "doc_staging")
+            os.makedirs(staging, exist_ok=True)
+            docx_file(lines, os.path.join(staging, f"cv_{number:05d}.docx"))
+            pending_doc.append((os.path.join(staging, f"cv_{number:05d}.docx"), folder))
+        counts[kind] += 1
+
+    if len(pending_doc) > 0:
+        # The .doc files are converted from .docx with LibreOffice, in a single call
+        if shutil.which("soffice") is None:
+            counts["doc_skipped"] = "soffice no está instalado, los .doc se generaron como .docx"
+            for path, folder in pending_doc:
+                shutil.move(path, os.path.join(folder, os.path.basename(path)))
+            counts["docx"] += counts["doc"]
+            counts["doc"] = 0
+        else:
+            staging = os.path.dirname(pending_doc[0][0])
+            subprocess.run(
+                ["soffice", "--headless", "--convert-to", "doc", "--outdir", staging]
+                + [path for path, _ in pending_doc],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            )
+            for path, folder in pending_doc:
+                converted = os.path.splitext(path)[0] + ".doc"
+                if os.path.exists(converted):
+                    shutil.move(converted, os.path.join(folder, os.path.basename(converted)))
+                else:
+                    shutil.move(path, os.path.join(folder, os.path.basename(path)))
+                    counts["doc"] -= 1
+                    counts["docx"] += 1
+        shutil.rmtree(os.path.join(root, "doc_staging"), ignore_errors=True)
+    return counts
+
+
+def write_env(root: str, llm_url: str, ocr_endpoint: str, overrides: dict) -> dict:
+    """
+    Writes the .env of the working directory, pointing every service to the stand-ins.
+    """
+    env = {
+        "CURRENT_ENV": "prod",
+        "ANTHROPIC_API_KEY": "stand-in",
+        "ANTHROPIC_TEST_API_KEY": "stand-in",
+        "ANTHROPIC_API_URL": llm_url,
+        "AZURE_OCR_KEY": "stand-in",
+        "AZURE_OCR_ENDPOINT": ocr_endpoint,
+        "AZURE_TEST_OCR_KEY": "stand-in",
+        "AZURE_TEST_OCR_ENDPOINT": ocr_endpoint,
+        "MONGO_DOCS_URI": "mongomock://",
+        "MONGO_TRACKER_URI": "mongomock://",
+        "LLM_CACHE_MODE": "off",
+        "MONITOR_INTERVAL": "5",
+        "METRICS_JSONL": "metrics.jsonl",
+        "METRICS_PROMETHEUS": "metrics.prom",
+        # High enough for the stand-in, the limits of the real account are not part of the benchmark
+        "ANTHROPIC_RPM": "100000",
+        "ANTHROPIC_ITPM": "100000000",
+        "ANTHROPIC_OTPM": "100000000",
+    }
+    env.update(overrides)
+    with open(os.path.join(root, ".env"), "w") as f:
+        for key, value in env.items():
+            f.write(f"{key}={value}\n")
+    return env
+
+
+def run_flow(root: str, timeout: float) -> dict:
+    """
+    Runs COMENTADO_main.py in the working directory, sampling the memory of its process tree.
+
+    Returns:
+        dict: The exit code, the seconds it took, the peak RSS of the tree and the output of the flow.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO, "COMENTADO_main.py")],
+        cwd=root,
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=open(os.path.join(root, "output.log"), "w"),
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    process.stdin.write("y\n")
+    process.stdin.close()
+    parent = psutil.Process(process.pid)
+    peak = 0
+    while process.poll() is None:
+        if time.perf_counter() - start > timeout:
+            process.kill()
+            break
+        try:
+            tree = [parent] + parent.children(recursive=True)
+            peak = max(peak, sum(p.memory_info().rss for p in tree if p.is_running()))
+        except psutil.Error:
+            pass
+        time.sleep(0.2)
+    process.wait()
+    with open(os.path.join(root, "output.log")) as f:
+        output = f.read()
+    return {
+        "exit_code": process.returncode,
+        "wall_seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak / 1024**2,
+        "output_tail": output[-2000:],
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(report: dict, previous: dict) -> str:
+    """
+    Returns the differences of the main numbers of two reports as text.
+    """
+    lines = [f"Comparación {previous['commit']} -> {report['commit']}"]
+
+    def line(name, old, new):
+        change = (new - old) / old if old else 0.0
+        lines.append(f"  {name:<28} {old:>10.3f} -> {new:>10.3f} ({change:+.1%})")
+
+    line("files_per_second", previous["files_per_second"], report["files_per_second"])
+    line("peak_rss_mb", previous["peak_rss_mb"], report["peak_rss_mb"])
+    for stage, stats in report["stages"].items():
+        if stage in previous["stages"]:
+            line(f"{stage} avg", previous["stages"][stage]["avg"], stats["avg"])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--mix", default="pdf=0.5,scanned=0.2,docx=0.2,doc=0.1", help="Fraction of each kind of file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=4.0)
+    parser.add_argument("--ocr-latency", type=float, default=3.0)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE added to the .env of the run")
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--workdir", default=None, help="Working directory, a temporary one by default")
+    parser.add_argument("--output", default=os.path.join(REPO, "benchmarks"))
+    parser.add_argument("--compare", default=None, help="Previous report to compare with")
+    args = parser.parse_args()
+
+    mix = {kind: float(value) for kind, value in (item.split("=") for item in args.mix.split(","))}
+    overrides = dict(item.split("=", 1) for item in args.env)
+    root = args.workdir or tempfile.mkdtemp(prefix="pisa-benchmark-")
+    os.makedirs(os.path.join(root, "bsons"), exist_ok=True)
+
+    print(f"Generando {args.files} CVs en {root}")
+    corpus = generate_corpus(root, args.files, mix, args.seed)
+    llm = AnthropicStandIn(latency=args.llm_latency).start_background()
+    ocr = OCRStandIn(latency=args.ocr_latency).start_background()
+    env = write_env(root, llm.url, ocr.endpoint, overrides)
+    print("Ejecutando COMENTADO_main.py con los servicios de prueba")
+    run = run_flow(root, args.timeout)
+    llm.close()
+    ocr.close()
+
+    snapshot = {"stages": {}, "counters": {}}
+    if os.path.exists(os.path.join(root, "metrics.jsonl")):
+        with open(os.path.join(root, "metrics.jsonl")) as f:
+            lines = f.read().splitlines()
+        if len(lines) > 0:
+            snapshot = json.loads(lines[-1])
+    processed = len(os.listdir(os.path.join(root, "bsons")))
+    pipeline_seconds = snapshot["stages"].get("pipeline", {}).get("sum", run["wall_seconds"])
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpus": os.cpu_count(),
+        "corpus": corpus,
+        "env": {key: value for key, value in env.items() if "KEY" not in key},
+        "llm_latency": args.llm_latency,
+        "ocr_latency": args.ocr_latency,
+        "llm_requests": llm.requests,
+        "exit_code": run["exit_code"],
+        "processed": processed,
+        "wall_seconds": run["wall_seconds"],
+        "pipeline_seconds": pipeline_seconds,
+        "files_per_second": processed / pipeline_seconds if pipeline_seconds > 0 else 0.0,
+        "peak_rss_mb": run["peak_rss_mb"],
+        "stages": {
+            stage: {key: stats[key] for key in ["count", "avg", "p50", "p95"]}
+            for stage, stats in snapshot["stages"].items()
+        },
+        "counters": snapshot["counters"],
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps({key: report[key] for key in ["processed", "files_per_second", "peak_rss_mb", "exit_code"]}, indent=2))
+    print(f"Reporte guardado en {path}")
+    if run["exit_code"] != 0:
+        print(run["output_tail"])
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(report, json.load(f)))
+    if args.workdir is None:
+        shutil.rmtree(root, ignore_errors=True)
@@ -1,36 +1,70 @@
+import mmap
+import os
 from os.path import exists
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
-from hashlib import md5
+from hashlib import blake2b, md5
 from colorama import Fore, Back
 from getpass import getpass
 
-def calculate_md5(file_path):
+def _new_digest(algorithm: str):
+    """Returns a new hash object, xxh3 requires the optional xxhash package."""
+    if algorithm == "md5":
+        return md5()
+    if algorithm == "blake2b":
+        return blake2b(digest_size=16)
+    if algorithm == "xxh3":
+        import xxhash
+
+        return xxhash.xxh3_128()
+    raise ValueError(f"Algoritmo de hash no soportado: {algorithm}")
+
+
+def calculate_digest(file_path, algorithm: str = "md5"):
     """
-    Calculate the MD5 hash of a file.
+    Calculate the hash of a file. The file is mapped in memory, so the whole file is hashed
+    in a single call that releases the GIL and several files can be hashed in parallel threads.
 
     Args:
         file_path (str): The path to the file.
+        algorithm (str, optional): One of "md5", "blake2b" or "xxh3". Defaults to "md5".
 
     Returns:
-        str: The MD5 hash of the file.
+        str: The hash of the file.
         False: If there was an error calculating the hash.
 
     """
     try:
-        hash_md5 = md5()
+        digest = _new_digest(algorithm)
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+            # Empty files can't be mapped
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    digest.update(m)
+        return digest.hexdigest()
     except Exception as e:
         print(f"Error: {e}")
         return False
 
 
+def calculate_md5(file_path):
+    """
+    Calculate the MD5 hash of a file.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The MD5 hash of the file.
+        False: If there was an error calculating the hash.
+
+    """
+    return calculate_digest(file_path, "md5")
+
+
 def generate_key(password: str, salt: bytes) -> bytes:
     """Generate a key from the given password and salt."""
     kdf = PBKDF2HMAC(
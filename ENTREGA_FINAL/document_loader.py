@@ -0,0 +1,92 @@
+import datetime as dt
+import io
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from magic import from_buffer
+
+PDF_MIME = "application/pdf"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+DOC_MIME = "application/msword"
+
+_CORE_NAMESPACES = {
+    "cp": "http://schemas.openxmlformats.org/package/2006/metadata/core-properties",
+    "dcterms": "http://purl.org/dc/terms/",
+}
+_OFFSET = re.compile(r"([+-])(\d\d):(\d\d)")
+
+
+def _parse_w3cdtf(value: str) -> dt.datetime:
+    """Parses a W3CDTF date the same way as python-docx, returning it in UTC."""
+    parsed = None
+    for template in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            parsed = dt.datetime.strptime(value[:19], template)
+        except ValueError:
+            continue
+    if parsed is None:
+        raise ValueError(f"could not parse W3CDTF datetime string '{value}'")
+    offset = _OFFSET.match(value[19:]) if len(value[19:]) == 6 else None
+    if offset is not None:
+        sign, hours, minutes = offset.groups()
+        factor = -1 if sign == "+" else 1
+        parsed += dt.timedelta(hours=int(hours) * factor, minutes=int(minutes) * factor)
+    return parsed.replace(tzinfo=dt.timezone.utc)
+
+
+def docx_modified(data: bytes) -> float:
+    """
+    Returns the modification date stored in the core properties of a .docx, read from docProps/core.xml
+    without parsing the rest of the document. It's the same value as Docx(path).core_properties.modified.
+
+    Args:
+        data (bytes): The content of the .docx file.
+
+    Returns:
+        float: The Unix timestamp of the modification date, None if the date is not valid.
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        try:
+            core = archive.read("docProps/core.xml")
+        except KeyError:
+            # python-docx creates default core properties, modified when they are created
+            return dt.datetime.now(dt.timezone.utc).timestamp()
+    element = ElementTree.fromstring(core).find("dcterms:modified", _CORE_NAMESPACES)
+    if element is None or element.text is None:
+        return None
+    try:
+        return _parse_w3cdtf(element.text.strip()).timestamp()
+    except ValueError:
+        return None
+
+
+def load_document(path: str) -> dict:
+    """
+    Reads a file once and returns everything the extraction needs from it: its content, the MIME type
+    detected from the bytes in memory and its date (creation date of the file for PDFs, modification date
+    of the core properties for .docx and modification date of the file for .doc).
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        dict: A dictionary with the following keys:
+            - "path": The path to the file.
+            - "data": The content of the file.
+            - "mime_type": The MIME type of the content.
+            - "created_at": The Unix timestamp of the date of the document.
+    """
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    mime_type = from_buffer(data, mime=True)
+    if mime_type == DOCX_MIME:
+        created_at = docx_modified(data)
+    elif mime_type == DOC_MIME:
+        # partition_doc reports the modification date of the file with a precision of seconds
+        created_at = float(int(stat.st_mtime))
+    else:
+        created_at = stat.st_ctime
+    return {"path": path, "data": data, "mime_type": mime_type, "created_at": created_at}
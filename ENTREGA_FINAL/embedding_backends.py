@@ -0,0 +1,65 @@
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+MODEL_NAME = "Alibaba-NLP/gte-base-en-v1.5"
+BACKENDS = ["fp32", "int8"]
+
+
+class QuantizedEmbeddings:
+    """
+    HuggingFaceEmbeddings whose linear layers were converted to int8 with torch dynamic quantization, which
+    runs the forward pass with int8 matrix multiplications on CPU. The vectors are close but not equal to the
+    fp32 ones, so model_name gets the suffix "+int8" and the embedding caches keep both apart.
+    """
+
+    embeddings: HuggingFaceEmbeddings
+    model_name: str
+
+    def __init__(self, embeddings: HuggingFaceEmbeddings) -> None:
+        """
+        Initializes the QuantizedEmbeddings class and quantizes the model in place.
+
+        Args:
+            embeddings (HuggingFaceEmbeddings): The fp32 model, loaded on CPU.
+        """
+        import torch
+
+        self.embeddings = embeddings
+        self.model_name = f"{embeddings.model_name}+int8"
+        torch.quantization.quantize_dynamic(
+            embeddings.client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+
+    def embed_documents(self, texts: list) -> list:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+
+def load_embeddings(backend: str = "fp32", threads: int = None):
+    """
+    Loads the gte-base-en-v1.5 embeddings model on CPU with the selected backend.
+
+    Args:
+        backend (str, optional): "fp32" for the original model or "int8" for the dynamically quantized one. Defaults to "fp32".
+        threads (int, optional): Number of threads used by torch, None keeps the default of torch. Defaults to None.
+
+    Returns:
+        The embeddings model, it exposes embed_documents, embed_query and model_name.
+    """
+    if backend not in BACKENDS:
+        raise Exception(
+            "El backend de embeddings no es válido. Por favor, especifique 'fp32' o 'int8'"
+        )
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=MODEL_NAME,
+        model_kwargs={"device": "cpu", "trust_remote_code": True},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+    if backend == "int8":
+        return QuantizedEmbeddings(embeddings)
+    return embeddings
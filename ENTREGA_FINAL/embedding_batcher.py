@@ -0,0 +1,383 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+
+class EmbeddingBatcher:
+    """
+    Shares one embeddings model between every CV in flight. The texts sent by each caller are
+    queued and grouped with the texts of other callers into a single batch, which is bounded both
+    by size and by the time the oldest request has been waiting.
+    """
+
+    embeddings: object
+    max_batch_size: int
+    max_wait: float
+
+    def __init__(
+        self, embeddings, max_batch_size: int = 64, max_wait: float = 0.05
+    ) -> None:
+        """
+        Initializes the EmbeddingBatcher class and starts its worker thread.
+
+        Args:
+            embeddings: The model used to embed the batches, it must expose embed_documents.
+            max_batch_size (int, optional): Maximum number of texts per batch. Defaults to 64.
+            max_wait (float, optional): Maximum seconds a request waits for the batch to fill. Defaults to 0.05.
+        """
+        if max_batch_size < 1:
+            raise Exception("El tamaño máximo del batch debe ser mayor a 0")
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = Queue()
+        self._carry = None  # Request that did not fit in the previous batch
+        self._closed = False
+        self._lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=10000)
+        self._latencies = deque(maxlen=10000)
+        self._model_times = deque(maxlen=10000)
+        self._requests = 0
+        self._texts = 0
+        self._thread = threading.Thread(
+            target=self._run, name="embedding-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, texts: list) -> Future:
+        """
+        Queues the texts to be embedded in the next batch.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            Future: A future that resolves to the list of vectors, in the same order as the texts.
+        """
+        future = Future()
+        if len(texts) == 0:
+            future.set_result([])
+            return future
+        if self._closed:
+            raise Exception("El EmbeddingBatcher ya fue cerrado")
+        self._queue.put((list(texts), future, time.perf_counter()))
+        return future
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embeds the texts, blocking until the batch they were grouped in is processed.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The list of vectors, in the same order as the texts.
+        """
+        return self.submit(texts).result()
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embeds a single query, queries are not batched since they are rarely used in the flow.
+        """
+        return self.embeddings.embed_query(text)
+
+    def _next_request(self, timeout: float):
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self) -> list:
+        """Waits for the first request and fills the batch until it's full or the time is up."""
+        while True:
+            try:
+                first = self._next_request(timeout=0.5)
+                break
+            except Empty:
+                if self._closed:
+                    return []
+        if first is None:
+            return []
+
+        batch, size = [first], len(first[0])
+        deadline = first[2] + self.max_wait
+        while size < self.max_batch_size:
+            # Once the time is up we still take the requests that are already queued
+            remaining = max(deadline - time.perf_counter(), 0)
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except Empty:
+                break
+            if request is None:
+                # Put the sentinel back so the loop finishes after this batch
+                self._queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if len(batch) == 0:
+                return
+            self._process(batch)
+
+    def _process(self, batch: list) -> None:
+        # Repeated texts (e.g. "NA") are only embedded once per batch
+        unique = list(dict.fromkeys(text for texts, _, _ in batch for text in texts))
+        start = time.perf_counter()
+        try:
+            vectors = self.embeddings.embed_documents(unique)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        end = time.perf_counter()
+
+        lookup = dict(zip(unique, vectors))
+        for texts, future, _ in batch:
+            future.set_result([lookup[text] for text in texts])
+
+        with self._lock:
+            self._batch_sizes.append(len(unique))
+            self._model_times.append(end - start)
+            self._latencies.extend(end - enqueued for _, _, enqueued in batch)
+            self._requests += len(batch)
+            self._texts += sum(len(texts) for texts, _, _ in batch)
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the batches processed so far, useful to tune max_batch_size and max_wait.
+
+        Returns:
+            dict: A dictionary with the following keys:
+                - "batches": Number of batches sent to the model.
+                - "requests": Number of embed_documents calls served.
+                - "texts": Number of texts requested, before removing duplicates.
+                - "avg_batch_size": Average number of unique texts per batch.
+                - "max_batch_size": Largest batch sent to the model.
+                - "avg_model_time": Average seconds spent by the model per batch.
+                - "p50_latency" / "p95_latency": Seconds from submit to result per request.
+        """
+        with self._lock:
+            sizes = list(self._batch_sizes)
+            latencies = sorted(self._latencies)
+            model_times = list(self._model_times)
+            requests, texts = self._requests, self._texts
+
+        def percentile(values, q):
+            if len(values) == 0:
+                return 0.0
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        return {
+            "batches": len(sizes),
+            "requests": requests,
+            "texts": texts,
+            "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "max_batch_size": max(sizes) if sizes else 0,
+            "avg_model_time": (
+                sum(model_times) / len(model_times) if model_times else 0.0
+            ),
+            "p50_latency": percentile(latencies, 0.5),
+            "p95_latency": percentile(latencies, 0.95),
+        }
+
+    def close(self) -> None:
+        """
+        Processes the requests already queued and stops the worker thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+
+class PrefetchedEmbeddings:
+    """
+    Embeddings of a single CV, whose texts can be sent to the EmbeddingBatcher before they are needed
+    (e.g. as each record of a streamed response arrives). embed_documents then waits for the vectors
+    already requested and only submits the texts that were not prefetched.
+    """
+
+    def __init__(self, batcher: EmbeddingBatcher) -> None:
+        """
+        Initializes the PrefetchedEmbeddings class.
+
+        Args:
+            batcher (EmbeddingBatcher): The batcher shared by every CV.
+        """
+        self.batcher = batcher
+        self._futures = {}  # text -> (future of its request, position in the request)
+
+    def _failed(self, text: str) -> bool:
+        future = self._futures[text][0]
+        return future.done() and (future.cancelled() or future.exception() is not None)
+
+    def prefetch(self, texts: list) -> None:
+        """
+        Submits the texts that were not requested yet, or whose request failed, without waiting for them.
+        A failed request is sent again so a retry of the CV does not get the same error.
+        """
+        new = [
+            text
+            for text in dict.fromkeys(texts)
+            if text not in self._futures or self._failed(text)
+        ]
+        if len(new) == 0:
+            return
+        future = self.batcher.submit(new)
+        for position, text in enumerate(new):
+            self._futures[text] = (future, position)
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Returns the vectors of the texts, in the same order as the texts.
+        """
+        self.prefetch(texts)
+        return [
+            self._futures[text][0].result()[self._futures[text][1]] for text in texts
+        ]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def _huggingface_embeddings(embeddings):
+    """Returns the HuggingFaceEmbeddings behind a model (or a wrapper of one, e.g. QuantizedEmbeddings), or None."""
+    while embeddings is not None:
+        client = getattr(embeddings, "client", None)
+        if client is not None and hasattr(client, "tokenizer"):
+            return embeddings
+        embeddings = getattr(embeddings, "embeddings", None)
+    return None
+
+
+class LengthBucketedEmbeddings:
+    """
+    Sorts the texts of each call by their number of tokens and splits them in buckets whose padded size
+    (texts times the longest text) stays under max_batch_tokens, so short titles and "NA" are not padded to the
+    length of a 40 word brief or a templated sentence. Each bucket is a single forward pass of the model, and the
+    vectors are returned in the original order. Models without a tokenizer (e.g. EmbeddingClient) are
+    measured with an estimate of 4 characters per token.
+    """
+
+    embeddings: object
+    max_batch_tokens: int
+    max_batch_size: int
+
+    def __init__(
+        self, embeddings, max_batch_tokens: int = 16384, max_batch_size: int = 256
+    ) -> None:
+        """
+        Initializes the LengthBucketedEmbeddings class.
+
+        Args:
+            embeddings: The embeddings model, it must expose embed_documents.
+            max_batch_tokens (int, optional): Maximum padded tokens (texts x longest text) per forward pass. Defaults to 16384.
+            max_batch_size (int, optional): Maximum number of texts per forward pass. Defaults to 256.
+        """
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", "")
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        huggingface = _huggingface_embeddings(embeddings)
+        self._client = huggingface.client if huggingface is not None else None
+        self._encode_kwargs = dict(getattr(huggingface, "encode_kwargs", {}))
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+
+    def token_lengths(self, texts: list) -> list:
+        """
+        Returns the number of tokens of each text, with the special tokens and the truncation of the model.
+        """
+        if self._client is None:
+            return [len(text) // 4 + 2 for text in texts]
+        encoded = self._client.tokenizer(
+            [text.replace("\n", " ") for text in texts],
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self._client.max_seq_length,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def buckets(self, lengths: list) -> list:
+        """
+        Groups the positions of the texts, sorted by length, in buckets bounded by max_batch_tokens and max_batch_size.
+        """
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        buckets, current = [], []
+        for i in order:
+            # The texts are sorted, so the new text is the longest of the bucket
+            if len(current) > 0 and (
+                len(current) == self.max_batch_size
+                or (len(current) + 1) * lengths[i] > self.max_batch_tokens
+            ):
+                buckets.append(current)
+                current = []
+            current.append(i)
+        if len(current) > 0:
+            buckets.append(current)
+        return buckets
+
+    def _encode(self, texts: list) -> list:
+        if self._client is None:
+            return self.embeddings.embed_documents(texts)
+        # Same as HuggingFaceEmbeddings.embed_documents, but the whole bucket in one forward pass
+        return self._client.encode(
+            [text.replace("\n", " ") for text in texts],
+            **{**self._encode_kwargs, "batch_size": len(texts)},
+        ).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embeds the texts in buckets of similar length.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The list of vectors, in the same order as the texts.
+        """
+        if len(texts) == 0:
+            return []
+        lengths = self.token_lengths(texts)
+        vectors = [None] * len(texts)
+        for bucket in self.buckets(lengths):
+            for i, vector in zip(bucket, self._encode([texts[i] for i in bucket])):
+                vectors[i] = vector
+            with self._lock:
+                self.batches += 1
+                self.tokens += sum(lengths[i] for i in bucket)
+                self.padded_tokens += len(bucket) * max(lengths[i] for i in bucket)
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        """
+        Returns the forward passes made and the share of the padded tokens that were real tokens.
+        """
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "tokens": self.tokens,
+                "padded_tokens": self.padded_tokens,
+                "padding_efficiency": (
+                    self.tokens / self.padded_tokens if self.padded_tokens else 1.0
+                ),
+            }
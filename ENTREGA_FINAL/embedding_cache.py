@@ -0,0 +1,315 @@
+import fcntl
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha1
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text before using it as a cache key, collapsing every run of whitespace into a single space.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+    return " ".join(text.split())
+
+
+class CachedEmbeddings:
+    """
+    Content-addressed cache in front of an embeddings model. Vectors are keyed by the normalized text
+    and the model name, kept in an in-process LRU tier and persisted on disk as a float32 file read
+    through np.memmap with a sqlite index, so re-runs only embed the texts that were never seen.
+    Several processes can share the same directory: the file and the index are guarded by a file lock, and a
+    process maps the file again when another one compacted it.
+    """
+
+    embeddings: object
+    model_name: str
+    cache_dir: str
+
+    def __init__(
+        self,
+        embeddings,
+        model_name: str = None,
+        cache_dir: str = "embedding_cache",
+        max_memory_items: int = 50000,
+        max_disk_items: int = 1000000,
+        touch_batch: int = 1000,
+    ) -> None:
+        """
+        Initializes the CachedEmbeddings class and opens (or creates) the cache stored in cache_dir.
+
+        Args:
+            embeddings: The model used on cache misses, it must expose embed_documents.
+            model_name (str, optional): Name of the model, part of the key. Defaults to embeddings.model_name.
+            cache_dir (str, optional): Directory where the vectors and the index are stored. Defaults to "embedding_cache".
+            max_memory_items (int, optional): Maximum number of vectors in the in-process LRU tier. Defaults to 50000.
+            max_disk_items (int, optional): Maximum number of vectors on disk, the least recently used are evicted. Defaults to 1000000.
+            touch_batch (int, optional): Cache hits whose last use is held in memory before it's written to the index. Defaults to 1000.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model_name", "")
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.touch_batch = touch_batch
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()
+        self._vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self._db = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite"), check_same_thread=False, timeout=60
+        )
+        self._lock_file = open(os.path.join(cache_dir, "index.lock"), "a")
+        with self._disk_lock(fcntl.LOCK_EX):
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER, last_used INTEGER)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self._db.commit()
+        self._dim = self._get_meta("dim")
+        self._clock = self._get_meta("clock") or 0
+        # Number of compactions of the file, the memmap is only valid for the one it was opened in
+        self._generation = self._get_meta("generation") or 0
+        self._mmap = None
+        self._touched = {}  # key -> clock of its last hit, not written to the index yet
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _get_meta(self, name: str):
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, name: str, value: int) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    @contextmanager
+    def _disk_lock(self, operation: int):
+        """
+        Locks the file and the index between processes, LOCK_SH to read them and LOCK_EX to change them. Every
+        write of the index is done with LOCK_EX, so two processes never wait for each other inside sqlite.
+        """
+        fcntl.flock(self._lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def key(self, text: str) -> str:
+        """
+        Returns the key of a text, the sha1 of the model name and the normalized text.
+        """
+        return sha1(f"{self.model_name}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        """Returns the row on disk of every key found in the index."""
+        index = {}
+        # sqlite limits the number of parameters per query
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            index.update(
+                self._db.execute(
+                    "SELECT key, row FROM vectors WHERE key IN ({})".format(
+                        ",".join("?" * len(chunk))
+                    ),
+                    chunk,
+                ).fetchall()
+            )
+        return index
+
+    def _disk_rows(self) -> int:
+        if self._dim is None or not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (4 * self._dim)
+
+    def _read_rows(self, rows: list) -> np.ndarray:
+        # The memmap is only reopened when the file grew or was compacted since it was last mapped
+        generation = self._get_meta("generation") or 0
+        total = self._disk_rows()
+        if self._mmap is None or self._generation != generation or self._mmap.shape[0] < total:
+            self._generation = generation
+            self._mmap = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(total, self._dim)
+            )
+        return np.asarray(self._mmap[rows])
+
+    def _remember(self, key: str, vector: list) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embeds the texts, only the ones that are not cached are sent to the model.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The list of vectors, in the same order as the texts.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            self._clock += 1
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._touched[key] = self._clock
+            self.hits_memory += sum(1 for key in keys if key in found)
+
+            pending = [key for key in dict.fromkeys(keys) if key not in found]
+            if len(pending) > 0:
+                with self._disk_lock(fcntl.LOCK_SH):
+                    if self._dim is None:
+                        self._dim = self._get_meta("dim")
+                    index = self._lookup(pending) if self._dim is not None else {}
+                    if len(index) > 0:
+                        on_disk = list(index)
+                        rows = self._read_rows([index[key] for key in on_disk])
+                        for key, vector in zip(on_disk, rows.tolist()):
+                            found[key] = vector
+                            self._remember(key, vector)
+                            self._touched[key] = self._clock
+                        self.hits_disk += sum(1 for key in keys if key in index)
+            # The most used texts are hit in memory, their last use is written in batches so they are not evicted
+            if len(self._touched) >= self.touch_batch:
+                with self._disk_lock(fcntl.LOCK_EX):
+                    self._flush_touched()
+                    self._db.commit()
+
+        # The model is called outside of the lock so other threads can keep reading the cache
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if len(missing) > 0:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            with self._lock:
+                self.misses += sum(1 for key in keys if key in missing)
+                self._store(list(missing), vectors)
+                for key, vector in zip(missing, vectors):
+                    found[key] = vector
+                    self._remember(key, vector)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embeds a single query through the cache.
+        """
+        return self.embed_documents([text])[0]
+
+    def _flush_touched(self) -> None:
+        """Writes the last use of the hits held in memory, the caller commits."""
+        self._db.executemany(
+            "UPDATE vectors SET last_used = MAX(last_used, ?) WHERE key = ?",
+            [(clock, key) for key, clock in self._touched.items()],
+        )
+        self._touched = {}
+
+    def _sync_clock(self) -> None:
+        # Every process keeps its own clock, the index keeps the highest one
+        self._clock = max(self._clock, self._get_meta("clock") or 0)
+        self._set_meta("clock", self._clock)
+
+    def _store(self, keys: list, vectors: list) -> None:
+        """Appends the new vectors to the file on disk and registers them in the index."""
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._disk_lock(fcntl.LOCK_EX):
+            if self._dim is None:
+                self._dim = self._get_meta("dim") or array.shape[1]
+                self._set_meta("dim", self._dim)
+            # Another thread or process may have stored the same texts while the model was running
+            known = self._lookup(keys)
+            new = [idx for idx, key in enumerate(keys) if key not in known]
+            self._flush_touched()
+            if len(new) == 0:
+                self._db.commit()
+                return
+            self._sync_clock()
+            first_row = self._disk_rows()
+            # Written at the end of the last whole row, over the part left by a process that died while writing
+            with open(self._vectors_path, "r+b" if os.path.exists(self._vectors_path) else "wb") as f:
+                f.seek(first_row * 4 * self._dim)
+                f.write(array[new].tobytes())
+                f.truncate()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO vectors (key, row, last_used) VALUES (?, ?, ?)",
+                [(keys[idx], first_row + pos, self._clock) for pos, idx in enumerate(new)],
+            )
+            self._db.commit()
+            if first_row + len(new) > self.max_disk_items:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        Rewrites the file on disk keeping only the most recently used 80% of max_disk_items,
+        so the compaction does not run again on every new vector. It runs with the exclusive lock.
+        """
+        keep = int(self.max_disk_items * 0.8)
+        survivors = self._db.execute(
+            "SELECT key, row, last_used FROM vectors ORDER BY last_used DESC LIMIT ?",
+            (keep,),
+        ).fetchall()
+        rows = self._read_rows([row for _, row, _ in survivors])
+        temp_path = self._vectors_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(rows.astype(np.float32).tobytes())
+        self._mmap = None
+        os.replace(temp_path, self._vectors_path)
+        # The other processes map the file again before their next read
+        self._generation = (self._get_meta("generation") or 0) + 1
+        self._set_meta("generation", self._generation)
+        self._db.execute("DELETE FROM vectors")
+        self._db.executemany(
+            "INSERT INTO vectors (key, row, last_used) VALUES (?, ?, ?)",
+            [(key, pos, last_used) for pos, (key, _, last_used) in enumerate(survivors)],
+        )
+        self._db.commit()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: A dictionary with the keys "hits_memory", "hits_disk", "misses", "hit_rate", "memory_items" and "disk_items".
+        """
+        with self._lock:
+            total = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / total if total else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0],
+            }
+
+    def close(self) -> None:
+        """
+        Persists the index and closes the cache.
+        """
+        with self._lock:
+            with self._disk_lock(fcntl.LOCK_EX):
+                self._flush_touched()
+                self._sync_clock()
+                self._db.commit()
+            self._db.close()
+            self._lock_file.close()
+            self._mmap = None
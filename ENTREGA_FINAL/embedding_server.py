@@ -0,0 +1,310 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from embedding_batcher import EmbeddingBatcher, LengthBucketedEmbeddings
+
+DEFAULT_SOCKET = "/tmp/pisa-embeddings.sock"
+
+
+class EmbeddingServerError(Exception):
+    """
+    Raised when the embeddings server is not reachable or fails a request, a later attempt may succeed.
+    """
+
+
+# Every message is a 4 byte big-endian length followed by the payload
+_LENGTH = struct.Struct(">I")
+
+
+def _send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks, remaining = [], size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError("La conexión con el servidor de embeddings se cerró")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, size)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection until it's closed."""
+
+    def handle(self) -> None:
+        while True:
+            try:
+                request = json.loads(_recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+            try:
+                self.server.owner._answer(self.request, request)
+            except (ConnectionError, OSError):
+                return
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class EmbeddingServer:
+    """
+    Long-lived process that keeps the embeddings model loaded and serves it over a Unix socket, so several
+    ingestion processes and notebooks on the same node share one warm model. The texts of every connection
+    go through an EmbeddingBatcher, so requests of different clients are grouped into the same batches.
+    """
+
+    embeddings: object
+    socket_path: str
+
+    def __init__(
+        self,
+        embeddings,
+        socket_path: str = DEFAULT_SOCKET,
+        max_batch_size: int = 64,
+        max_wait: float = 0.05,
+    ) -> None:
+        """
+        Initializes the EmbeddingServer class and binds the socket.
+
+        Args:
+            embeddings: The embeddings model, it must expose embed_documents.
+            socket_path (str, optional): Path of the Unix socket. Defaults to DEFAULT_SOCKET.
+            max_batch_size (int, optional): Maximum number of texts per batch. Defaults to 64.
+            max_wait (float, optional): Maximum seconds a request waits for the batch to fill. Defaults to 0.05.
+        """
+        self.embeddings = embeddings
+        self.socket_path = socket_path
+        self.model_name = getattr(embeddings, "model_name", "")
+        self.batcher = EmbeddingBatcher(embeddings, max_batch_size, max_wait)
+        self._remove_stale_socket()
+        self._server = _Server(socket_path, _Handler)
+        self._server.owner = self
+        self._started = time.time()
+
+    def _remove_stale_socket(self) -> None:
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except ConnectionRefusedError:
+            # Left behind by a server that did not shut down cleanly
+            os.unlink(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise Exception(
+            f"Ya hay un servidor de embeddings escuchando en {self.socket_path}"
+        )
+
+    def _answer(self, sock: socket.socket, request: dict) -> None:
+        operation = request.get("op")
+        if operation == "embed":
+            try:
+                vectors = np.asarray(
+                    self.batcher.embed_documents(request["texts"]), dtype=np.float32
+                )
+            except Exception as e:
+                _send_frame(sock, json.dumps({"ok": False, "error": str(e)}).encode())
+                return
+            rows = len(request["texts"])
+            dim = vectors.shape[1] if rows > 0 else 0
+            _send_frame(sock, json.dumps({"ok": True, "rows": rows, "dim": dim}).encode())
+            _send_frame(sock, vectors.tobytes())
+        elif operation == "info":
+            _send_frame(
+                sock,
+                json.dumps(
+                    {"ok": True, "model_name": self.model_name, "pid": os.getpid()}
+                ).encode(),
+            )
+        elif operation == "stats":
+            stats = self.batcher.stats()
+            stats["uptime"] = time.time() - self._started
+            _send_frame(sock, json.dumps({"ok": True, "stats": stats}).encode())
+        else:
+            _send_frame(
+                sock,
+                json.dumps({"ok": False, "error": f"Operación desconocida: {operation}"}).encode(),
+            )
+
+    def serve_forever(self) -> None:
+        """
+        Serves requests until close is called.
+        """
+        self._server.serve_forever()
+
+    def close(self) -> None:
+        """
+        Stops the server, waits for the queued texts and removes the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self.batcher.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class EmbeddingClient:
+    """
+    Drop-in replacement for the embeddings model that sends the texts to an EmbeddingServer. It exposes
+    embed_documents, embed_query and model_name, so it can be wrapped by CachedEmbeddings and EmbeddingBatcher.
+    Each thread keeps its own connection.
+    """
+
+    socket_path: str
+
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET,
+        connect_timeout: float = 0,
+    ) -> None:
+        """
+        Initializes the EmbeddingClient class and asks the server for the name of its model.
+
+        Args:
+            socket_path (str, optional): Path of the Unix socket of the server. Defaults to DEFAULT_SOCKET.
+            connect_timeout (float, optional): Seconds to keep retrying while the server is starting. Defaults to 0.
+        """
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+        self._sockets = []
+        self._lock = threading.Lock()
+        self.model_name = self._request({"op": "info"})["model_name"]
+
+    def _connect(self) -> socket.socket:
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise EmbeddingServerError(
+                        f"No hay un servidor de embeddings escuchando en {self.socket_path}"
+                    )
+                time.sleep(0.5)
+        with self._lock:
+            self._sockets.append(sock)
+        return sock
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = self._connect()
+        return sock
+
+    def _discard(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            with self._lock:
+                if sock in self._sockets:
+                    self._sockets.remove(sock)
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, request: dict, payload: bool = False):
+        # A connection closed by a restarted server is retried once with a new connection
+        for attempt in range(2):
+            sock = self._socket()
+            try:
+                _send_frame(sock, json.dumps(request).encode())
+                header = json.loads(_recv_frame(sock))
+                data = _recv_frame(sock) if payload and header.get("ok") else None
+                break
+            except (ConnectionError, OSError):
+                self._discard()
+                if attempt == 1:
+                    raise
+        if not header["ok"]:
+            raise EmbeddingServerError(f"Error del servidor de embeddings: {header['error']}")
+        if payload:
+            return header, data
+        return header
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embeds the texts in the server.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The list of vectors, in the same order as the texts.
+        """
+        if len(texts) == 0:
+            return []
+        header, data = self._request({"op": "embed", "texts": list(texts)}, payload=True)
+        vectors = np.frombuffer(data, dtype=np.float32).reshape(header["rows"], header["dim"])
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embeds a single query in the server.
+        """
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the batches of the server, shared by all its clients.
+        """
+        return self._request({"op": "stats"})["stats"]
+
+    def close(self) -> None:
+        """
+        Closes the connections of every thread.
+        """
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            sock.close()
+
+
+if __name__ == "__main__":
+    import signal
+
+    from dotenv import dotenv_values
+
+    from embedding_backends import load_embeddings
+
+    config = dotenv_values(".env")
+    server = EmbeddingServer(
+        LengthBucketedEmbeddings(
+            load_embeddings(config.get("EMBEDDING_BACKEND", "fp32")),
+            max_batch_tokens=int(config.get("EMBED_MAX_BATCH_TOKENS", 16384)),
+        ),
+        socket_path=config.get("EMBEDDING_SOCKET", DEFAULT_SOCKET),
+        max_batch_size=int(config.get("EMBED_BATCH_SIZE", 64)),
+        max_wait=int(config.get("EMBED_MAX_WAIT_MS", 50)) / 1000,
+    )
+    # serve_forever runs in the main thread, so SIGTERM is turned into a clean shutdown from another thread
+    signal.signal(
+        signal.SIGTERM,
+        lambda *_: threading.Thread(target=server._server.shutdown).start(),
+    )
+    print(f"Servidor de embeddings escuchando en {server.socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
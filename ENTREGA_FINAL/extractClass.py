@@ -1,3 +1,4 @@
+import io
 import os.path
 import subprocess
 import tempfile
@@ -6,30 +7,72 @@ from re import sub
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 from dateutil.parser import parse as dateParse
-from docx import Document as Docx
 from dotenv import dotenv_values
-from magic import from_file
+
+from document_loader import DOC_MIME, DOCX_MIME, PDF_MIME, load_document
+from extraction_cache import ExtractionCache
+from libreoffice_pool import LibreOfficePool
+from ocr_dispatcher import OCRDispatcher
+from page_extraction import PageParallelExtractor, join_pages
 
 # sudo apt install libreoffice
+from unstructured.partition.common import get_last_modified_date
 from unstructured.partition.doc import partition_doc
 from unstructured.partition.docx import partition_docx
 from unstructured.partition.pdf import partition_pdf
 
 
+class NeedsOCR(Exception):
+    """
+    Raised instead of calling Azure when the OCR is deferred, so it can be done by another stage of the pipeline.
+    """
+
+    def __init__(self, path: str, created_at: float = None) -> None:
+        super().__init__(f"{path} necesita OCR")
+        self.path = path
+        self.created_at = created_at
+
+
 class Extractor:
     CURRENT_ENV: str
     doc_client: DocumentAnalysisClient
-
-    def __init__(self, overwrite_env: str = None) -> None:
+    cache: ExtractionCache
+    defer_ocr: bool
+    page_extractor: PageParallelExtractor
+    office_pool: LibreOfficePool
+
+    def __init__(
+        self,
+        overwrite_env: str = None,
+        cache: ExtractionCache = None,
+        defer_ocr: bool = False,
+        page_extractor: PageParallelExtractor = None,
+        office_pool: LibreOfficePool = None,
+        ocr_max_in_flight: int = 16,
+        ocr_poll_interval: float = 1.0,
+    ) -> None:
         """
         Initializes the Extractor class.
 
         Args:
             overwrite_env (str): The environment to use. If provided, it will overwrite the environment specified in the .env file.
+            cache (ExtractionCache, optional): Store of previous extractions, used when the hash of the file is provided. Defaults to None.
+            defer_ocr (bool, optional): Flag indicating whether to raise NeedsOCR instead of calling Azure. Defaults to False.
+            page_extractor (PageParallelExtractor, optional): Used instead of hi_res on the whole file when Azure is not used. Defaults to None.
+            office_pool (LibreOfficePool, optional): Converts the .doc and image-only .docx files instead of starting a new soffice each time. Defaults to None.
+            ocr_max_in_flight (int, optional): Maximum number of documents in Azure at the same time with aazure_ocr. Defaults to 16.
+            ocr_poll_interval (float, optional): Seconds between the polls of each document with aazure_ocr. Defaults to 1.0.
         Raises:
             Exception: If the .env file is not configured properly.
         """
         config = dotenv_values(".env")
+        self.cache = cache
+        self.defer_ocr = defer_ocr
+        self.page_extractor = page_extractor
+        self.office_pool = office_pool
+        self._ocr_dispatcher = None
+        self._ocr_max_in_flight = ocr_max_in_flight
+        self._ocr_poll_interval = ocr_poll_interval
 
         # If the environment is overwritten, use the environment provided
         if overwrite_env:
@@ -44,22 +87,107 @@ class Extractor:
         # Get the proper Azure credentials
         try:
             if self.CURRENT_ENV == "dev":
-                self.doc_client = DocumentAnalysisClient(
-                    endpoint=config["AZURE_TEST_OCR_ENDPOINT"],
-                    credential=AzureKeyCredential(config["AZURE_TEST_OCR_KEY"]),
-                )
+                self._azure_endpoint = config["AZURE_TEST_OCR_ENDPOINT"]
+                self._azure_key = config["AZURE_TEST_OCR_KEY"]
 
             elif self.CURRENT_ENV == "prod":
-                self.doc_client = DocumentAnalysisClient(
-                    endpoint=config["AZURE_OCR_ENDPOINT"],
-                    credential=AzureKeyCredential(config["AZURE_OCR_KEY"]),
-                )
+                self._azure_endpoint = config["AZURE_OCR_ENDPOINT"]
+                self._azure_key = config["AZURE_OCR_KEY"]
+
+            self.doc_client = DocumentAnalysisClient(
+                endpoint=self._azure_endpoint,
+                credential=AzureKeyCredential(self._azure_key),
+            )
 
         except KeyError:
             raise Exception("Por favor, configura el archivo .env")
 
+    def azure_ocr(self, path: str) -> str:
+        """
+        Extracts the text of a file with the prebuilt-read model of Azure Document Intelligence.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The extracted text from the file.
+        Raises:
+            NeedsOCR: If the OCR is deferred.
+        """
+        if self.defer_ocr:
+            raise NeedsOCR(path)
+        print("Using Azure OCR.")
+        with open(path, "rb") as document:
+            poller = self.doc_client.begin_analyze_document(
+                "prebuilt-read", document, locale="es"
+            )
+            result = poller.result()
+            return result.content
+
+    async def aazure_ocr(self, path: str) -> str:
+        """
+        Async version of azure_ocr, it's never deferred. The documents are sent through an OCRDispatcher,
+        which limits the documents in flight and polls all of them from a single task. It's created on the
+        first call, so it's bound to the event loop that runs the OCR.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The extracted text from the file.
+        """
+        if self._ocr_dispatcher is None:
+            self._ocr_dispatcher = OCRDispatcher(
+                self._azure_endpoint,
+                self._azure_key,
+                max_in_flight=self._ocr_max_in_flight,
+                poll_interval=self._ocr_poll_interval,
+            )
+        print("Using Azure OCR.")
+        return await self._ocr_dispatcher.analyze_path(path)
+
+    async def aclose(self) -> None:
+        """
+        Closes the OCRDispatcher of aazure_ocr, it must be called from the same event loop.
+        """
+        if self._ocr_dispatcher is not None:
+            await self._ocr_dispatcher.close()
+
+    def ocr_stats(self) -> dict:
+        """
+        Returns the stats of the OCRDispatcher of aazure_ocr, None if it was never used.
+        """
+        if self._ocr_dispatcher is None:
+            return None
+        return self._ocr_dispatcher.stats()
+
+    async def aextract_ocr(
+        self, path: str, file_hash: str = None, created_at: float = None
+    ):
+        """
+        Extracts with Azure a file whose extraction raised NeedsOCR and stores the result in the cache.
+
+        Args:
+            path (str): The path to the file.
+            file_hash (str, optional): The MD5 hash of the file. Defaults to None.
+            created_at (float, optional): The date obtained before the OCR was needed. Defaults to None.
+
+        Returns:
+            tuple: The creation date of the file and the extracted text.
+        """
+        allText = await self.aazure_ocr(path)
+        if self.cache is not None and file_hash is not None:
+            self.cache.put(file_hash, self.strategy(True, path), allText, created_at)
+        if created_at is None:
+            created_at = os.path.getctime(path)
+        return created_at, allText
+
     def extract_pdf(
-        self, path: str, azure: bool = True, dont_use_other_strategies: bool = False
+        self,
+        path: str,
+        azure: bool = True,
+        dont_use_other_strategies: bool = False,
+        data: bytes = None,
     ) -> str:
         """
         Extracts the text from a PDF file. It tries to extract the text contained in the PDF naively,
@@ -67,26 +195,30 @@ class Extractor:
 
         Args:
             path (str): The path to the PDF file.
-            azure (bool, optional): Flag indicating whether to use Azure Document Intelligence service. Defaults to True.
+            azure (bool, optional): Flag indicating whether to use Azure Document Intelligence service, ignored when
+                the Extractor has a page extractor. Defaults to True.
             dont_use_other_strategies (bool, optional): Flag indicating whether to use other strategies to extract the text. Defaults to False.
+            data (bytes, optional): The content of the file if it was already read. Defaults to None.
 
         Returns:
             str: The extracted text from the PDF file.
         """
-        elements = partition_pdf(path, strategy="fast", languages=["eng", "spa"])
+        if data is not None:
+            elements = partition_pdf(
+                file=io.BytesIO(data), strategy="fast", languages=["eng", "spa"]
+            )
+        else:
+            elements = partition_pdf(path, strategy="fast", languages=["eng", "spa"])
 
         if len(elements) <= 3:  # If the text is not found, use OCR
             if dont_use_other_strategies:
                 return "Not enough elements found"
 
+            elif self.page_extractor is not None:
+                # Scanned PDFs are split in pages that are extracted in parallel, Azure is left for the Word files
+                return self.page_extractor.extract(path)
             elif azure:
-                print("Using Azure OCR.")
-                with open(path, "rb") as pdf:
-                    poller = self.doc_client.begin_analyze_document(
-                        "prebuilt-read", pdf, locale="es"
-                    )
-                    result = poller.result()
-                    return result.content
+                return self.azure_ocr(path)
             else:
                 elements = partition_pdf(
                     path,
@@ -95,7 +227,7 @@ class Extractor:
                     pdf_infer_table_structure=True,
                 )
 
-        allText = "\n".join([element.text for element in elements])
+        allText = join_pages(elements)
         return sub(r"\n+", "\n", allText)
 
     def extract_word_doc(
@@ -112,19 +244,26 @@ class Extractor:
         Returns:
             str: The extracted text from the .doc file.
         """
-        elements = partition_doc(
-            path, languages=["eng", "spa"], include_metadata=include_metadata
-        )
+        if self.office_pool is not None:
+            # Same as partition_doc, but the conversion to .docx is done by the pool
+            with tempfile.TemporaryDirectory() as temp_dir:
+                docx_file = self.office_pool.convert(
+                    path, "docx:MS Word 2007 XML", temp_dir
+                )
+                elements = partition_docx(
+                    docx_file,
+                    languages=["eng", "spa"],
+                    include_metadata=include_metadata,
+                    metadata_last_modified=get_last_modified_date(path),
+                )
+        else:
+            elements = partition_doc(
+                path, languages=["eng", "spa"], include_metadata=include_metadata
+            )
 
         if len(elements) <= 3:  # If the text is not found, use OCR
             if azure:
-                print("Using Azure OCR.")
-                with open(path, "rb") as doc:
-                    poller = self.doc_client.begin_analyze_document(
-                        "prebuilt-read", doc, locale="es"
-                    )
-                    result = poller.result()
-                    return result.content
+                return self.azure_ocr(path)
 
         allText = "\n".join([element.text for element in elements])
         if include_metadata:
@@ -136,6 +275,15 @@ class Extractor:
         return sub(r"\n+", "\n", allText)
 
     def convert_docx_to_pdf_and_extract_text(self, input_file, azure=True):
+        if self.office_pool is not None:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                try:
+                    pdf_file = self.office_pool.convert(input_file, "pdf", temp_dir)
+                except Exception as e:
+                    print(f"An error occurred while converting {input_file} to PDF: {str(e)}")
+                    return "Not enough elements found"
+                return self.extract_pdf(pdf_file, azure, dont_use_other_strategies=True)
+
         # Ensure LibreOffice is installed and accessible from the command line
         try:
             subprocess.run(["libreoffice", "--version"], check=True)
@@ -176,70 +324,137 @@ class Extractor:
                 )
                 return "Not enough elements found"
 
-    def extract_word_docx(self, path: str, azure: bool = True) -> str:
+    def extract_word_docx(
+        self, path: str, azure: bool = True, data: bytes = None
+    ) -> str:
         """
         Extracts the text from a .docx file, if no text is found, it uses the OCR to extract the text.
 
         Args:
             path (str): The path to the .docx file.
             azure (bool, optional): Flag indicating whether to use Azure Document Intelligence service. Defaults to True.
+            data (bytes, optional): The content of the file if it was already read. Defaults to None.
 
         Returns:
             str: The extracted text from the .docx file.
         """
-        elements = partition_docx(path, languages=["eng", "spa"])
+        if data is not None:
+            elements = partition_docx(file=io.BytesIO(data), languages=["eng", "spa"])
+        else:
+            elements = partition_docx(path, languages=["eng", "spa"])
 
         if len(elements) <= 3:  # If the text is not found, use OCR
             allText = self.convert_docx_to_pdf_and_extract_text(path, azure)
             if azure and allText == "Not enough elements found":
-                print("Using Azure OCR.")
-                with open(path, "rb") as docx:
-                    poller = self.doc_client.begin_analyze_document(
-                        "prebuilt-read", docx, locale="es"
-                    )
-                    result = poller.result()
-                    return result.content
+                return self.azure_ocr(path)
             return allText
 
         allText = "\n".join([element.text for element in elements])
         return sub(r"\n+", "\n", allText)
 
+    def _page_failures(self) -> int:
+        if self.page_extractor is None:
+            return 0
+        return self.page_extractor.errors + self.page_extractor.timeouts
+
+    def strategy(self, azure: bool = True, path: str = None) -> str:
+        """
+        Returns the name of the extraction strategy, used to key the cache as its output depends on it.
+        The PDFs go through the page extractor when there is one, the other files keep using Azure.
+        """
+        if self.page_extractor is not None and (path is None or path.lower().endswith(".pdf")):
+            return f"local-{self.page_extractor.name}"
+        if azure:
+            return "azure"
+        return "local"
+
     def extract(
-        self, path: str, azure: bool = True, return_created_at: bool = False
+        self,
+        path: str,
+        azure: bool = True,
+        return_created_at: bool = False,
+        file_hash: str = None,
     ) -> str:
         """
         Extracts the text from a file based on the mimetype of the file.
+        If the hash of the file is provided and a cache is configured, a previous extraction of
+        the same file with the same strategy is reused.
 
         Args:
             path (str): The path to the file.
             azure (bool, optional): Flag indicating whether to use Azure Document Intelligence service. Defaults to True.
             return_created_at (bool, optional): Flag indicating whether to return the creation date of the file. Defaults to False.
+            file_hash (str, optional): The MD5 hash of the file. Defaults to None.
 
         Returns:
             str: The extracted text from the file.
         """
-        file_type = from_file(path, mime=True)
+        if self.cache is None or file_hash is None:
+            return self._extract(path, azure, return_created_at)
+
+        strategy = self.strategy(azure, path)
+        entry = self.cache.get(file_hash, strategy)
+        if entry is None:
+            failures = self._page_failures()
+            result = self._extract(path, azure, return_created_at=True)
+            if result is None:  # Unsupported file type
+                return None
+            createdAt, allText = result
+            # A text with pages left out by an error or a timeout is used but not stored, so a retry extracts it again
+            if allText != "Not enough elements found" and self._page_failures() == failures:
+                # PDFs take their date from the file system, so it's not stored
+                self.cache.put(
+                    file_hash,
+                    strategy,
+                    allText,
+                    None if path.lower().endswith(".pdf") else createdAt,
+                )
+            entry = {"text": allText, "created_at": createdAt}
+
+        if not return_created_at:
+            return entry["text"]
+        if entry["created_at"] is None:
+            return os.path.getctime(path), entry["text"]
+        return entry["created_at"], entry["text"]
+
+    def _extract(
+        self, path: str, azure: bool = True, return_created_at: bool = False
+    ) -> str:
+        # The file is read once, its type and date come from the bytes in memory
+        document = load_document(path)
+        file_type = document["mime_type"]
         # PDF files
-        if file_type == "application/pdf" and path.lower().endswith(".pdf"):
+        if file_type == PDF_MIME and path.lower().endswith(".pdf"):
+            allText = self.extract_pdf(path, azure, data=document["data"])
             if return_created_at:
-                return os.path.getctime(path), self.extract_pdf(path, azure)
-            return self.extract_pdf(path, azure)
+                return document["created_at"], allText
+            return allText
 
         # Word .docx files
-        elif (
-            file_type
-            == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        ) and path.lower().endswith(".docx"):
+        elif file_type == DOCX_MIME and path.lower().endswith(".docx"):
             if return_created_at:
-                modified = Docx(path).core_properties.modified.timestamp()
-                return modified, self.extract_word_docx(path, azure)
-            return self.extract_word_docx(path, azure)
+                modified = document["created_at"]
+                try:
+                    return modified, self.extract_word_docx(
+                        path, azure, data=document["data"]
+                    )
+                except NeedsOCR as e:
+                    # Keep the date so the OCR stage does not need to open the file again
+                    e.created_at = modified
+                    raise
+            return self.extract_word_docx(path, azure, data=document["data"])
 
         # Word .doc files
-        elif file_type == "application/msword" and path.lower().endswith(".doc"):
+        elif file_type == DOC_MIME and path.lower().endswith(".doc"):
             if return_created_at:
-                allText, modified = self.extract_word_doc(
-                    path, azure, include_metadata=True
-                )
-                return modified, allText
+                try:
+                    result = self.extract_word_doc(path, azure, include_metadata=True)
+                except NeedsOCR as e:
+                    e.created_at = document["created_at"]
+                    raise
+                # Without the date in the metadata (or after the OCR) only the text is returned
+                if isinstance(result, tuple):
+                    allText, modified = result
+                    return modified, allText
+                return document["created_at"], result
             return self.extract_word_doc(path, azure)
@@ -2,10 +2,11 @@ from datetime import datetime, timedelta
 from math import ceil
 from re import compile
 
-from dateutil.parser import parse as dateParse
 from intervaltree import Interval, IntervalTree
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
+from record_parser import dateutil_date, parse_date, parse_records
+
 regexPattern = compile(
     r"Type:\W*(?P<type>.*)(\WManagement:\W*(?P<management>.*))?\WTitle:\W*(?P<title>.*)\WInstitution:\W*(?P<institution>.*)\WStart Date:\W*(?P<start>.*)(\WEnd Date:\W*(?P<end>.*))?\W(Brief:\W*(?P<brief>.*))?"
 )
@@ -68,16 +69,19 @@ def education_labeler(education: str) -> int:
     return -1
 
 
-def apply_regex_template(outs: str, createdAt: float):
+def apply_regex_template(outs: str, createdAt: float, fast: bool = True):
     """
     Applies the regex template to the extracted text and categorizes the matches into work experience, education, and certification.
 
     This function iterates over the matches found in 'outs', processes each match,
     and categorizes them into work experience, education, and certification.
+    With fast=True, the outputs that follow the template line by line are read by parse_records instead of
+    the regex and the dates are parsed by the memoized parse_date, with the same results.
 
     Parameters:
     outs (str): The string to find matches in.
     createdAt (float): The Unix timestamp representing the creation time.
+    fast (bool, optional): Use the line parser and the date cache. Defaults to True.
 
     Returns:
     list: A sorted list of dictionaries representing the work experience.
@@ -85,9 +89,12 @@ def apply_regex_template(outs: str, createdAt: float):
     list: A list of dictionaries representing the certification.
     """
     work, education, certification = [], [], []
-    for match in regexPattern.finditer(outs):
+    records = parse_records(outs) if fast else None
+    if records is None:
+        records = [match.groupdict() for match in regexPattern.finditer(outs)]
+    date_parser = parse_date if fast else dateutil_date
+    for match in records:
         try:
-            match = match.groupdict()
             # We check the presence of End Date inside of Start as it's a problematic field
             # As commonly the LLM does not add an \n after the start date
             if "End Date:" in match["start"]:
@@ -95,22 +102,14 @@ def apply_regex_template(outs: str, createdAt: float):
 
             match = {k: strip_and_NA(v) for k, v in match.items()}
             if (match["start"] != "NA") and (match["start"] != "Present"):
-                match["start"] = dateParse(
-                    match["start"],
-                    default=datetime(1, 1, 1),
-                    fuzzy=True,
-                    fuzzy_with_tokens=True,
-                )
+                match["start"], present = date_parser(match["start"])
                 # We check the presence of the word "present" in the start date
                 # as often the LLM confuses and omits the end date in the case of present
-                if any("present" in token.lower() for token in match["start"][1]):
+                if present:
                     match["end"] = "Present"
-                match["start"] = match["start"][0]
 
             if (match["end"] != "NA") and (match["end"] != "Present"):
-                match["end"] = dateParse(
-                    match["end"], default=datetime(1, 1, 1), fuzzy=True
-                )
+                match["end"] = date_parser(match["end"])[0]
 
             if "work experience" in match["type"].lower():
                 if (match["end"] == "NA") and (match["start"] == "NA"):
@@ -235,6 +234,33 @@ def extract_resume_features(outs, createdAt):
     return work, education, certification, expYears, expYearsManagement, avgTimeInJob
 
 
+def record_texts(outs: str) -> list:
+    """
+    Returns the texts that embed_works, embed_education and embed_certifications embed for the records of a
+    piece of the output of the LLM, without parsing their dates. Used to embed the records while the rest of
+    the response is being generated.
+
+    Args:
+        outs (str): The text of one or more records.
+
+    Returns:
+        list: The texts of the records.
+    """
+    records = parse_records(outs)
+    if records is None:
+        records = [match.groupdict() for match in regexPattern.finditer(outs)]
+    texts = []
+    for record in records:
+        record = {k: strip_and_NA(v) for k, v in record.items()}
+        if "work experience" in record["type"].lower():
+            texts.extend([record["title"], record["institution"], record["brief"]])
+        elif "education" in record["type"].lower():
+            texts.extend([record["title"], record["institution"]])
+        elif "certification" in record["type"].lower():
+            texts.extend([record["title"], record["brief"]])
+    return texts
+
+
 def embed_works(works: list, embeddings: HuggingFaceEmbeddings) -> list:
     """
     Embeds the works using the provided HuggingFaceEmbeddings model.
@@ -254,17 +280,20 @@ def embed_works(works: list, embeddings: HuggingFaceEmbeddings) -> list:
 
     if len(works) == 0:
         return []
+    # We embed all the works of the CV in the same batch
+    vectors = embeddings.embed_documents(
+        [text for w in works for text in (w["title"], w["institution"], w["brief"])]
+    )
     embedded_work = []
     work_counter = -1
-    for w in works:
+    for idx, w in enumerate(works):
         if w["start"] != datetime(1969, 12, 31, 18):
             work_counter += 1
-        vectors = embeddings.embed_documents([w["title"], w["institution"], w["brief"]])
         embedded_work.append(
             {
-                "title": vectors[0],
-                "institution": vectors[1],
-                "brief": vectors[2],
+                "title": vectors[3 * idx],
+                "institution": vectors[3 * idx + 1],
+                "brief": vectors[3 * idx + 2],
                 "management": 0 if w["management"] == "No" else 1,
                 "work_counter": work_counter,
             }
@@ -287,11 +316,14 @@ def embed_certifications(
     """
     if len(certifications) == 0:
         return []
-    embedded_certification = []
-    for w in certifications:
-        vectors = embeddings.embed_documents([w["title"], w["brief"]])
-        embedded_certification.append({"title": vectors[0], "brief": vectors[1]})
-    return embedded_certification
+    # We embed all the certifications of the CV in the same batch
+    vectors = embeddings.embed_documents(
+        [text for w in certifications for text in (w["title"], w["brief"])]
+    )
+    return [
+        {"title": vectors[2 * idx], "brief": vectors[2 * idx + 1]}
+        for idx in range(len(certifications))
+    ]
 
 
 def embed_education(education: list, embeddings: HuggingFaceEmbeddings) -> dict:
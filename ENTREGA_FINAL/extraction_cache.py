@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import threading
+
+
+class ExtractionCache:
+    """
+    On-disk store of the text extracted from each file, keyed by the MD5 of the file and the
+    extraction strategy used. Retried or re-labeled files skip the parsing, LibreOffice and OCR
+    steps. When the store grows over max_bytes, the least recently used entries are deleted.
+    """
+
+    cache_dir: str
+    max_bytes: int
+
+    def __init__(
+        self, cache_dir: str = "extraction_cache", max_bytes: int = 1024**3
+    ) -> None:
+        """
+        Initializes the ExtractionCache class.
+
+        Args:
+            cache_dir (str, optional): Directory where the entries are stored. Defaults to "extraction_cache".
+            max_bytes (int, optional): Maximum size of the store in bytes. Defaults to 1 GiB.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, _, size in self._entries())
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, file_hash: str, strategy: str) -> str:
+        return os.path.join(self.cache_dir, f"{file_hash}-{strategy}.json")
+
+    def _entries(self) -> list:
+        """Returns (mtime, path, size) for every entry in the store."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def get(self, file_hash: str, strategy: str):
+        """
+        Returns the cached extraction of a file.
+
+        Args:
+            file_hash (str): The MD5 hash of the file.
+            strategy (str): The extraction strategy used.
+
+        Returns:
+            dict: A dictionary with the keys "text" and "created_at".
+            None: If the file has not been extracted with that strategy.
+        """
+        path = self._path(file_hash, strategy)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # The modification time is used as the last access for the eviction
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, file_hash: str, strategy: str, text: str, created_at: float = None):
+        """
+        Stores the extraction of a file.
+
+        Args:
+            file_hash (str): The MD5 hash of the file.
+            strategy (str): The extraction strategy used.
+            text (str): The extracted text.
+            created_at (float, optional): The creation timestamp obtained from the file contents. Defaults to None.
+        """
+        data = json.dumps(
+            {"text": text, "created_at": created_at}, ensure_ascii=False
+        ).encode("utf-8")
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._path(file_hash, strategy))
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Deletes the least recently used entries until the store is under 90% of max_bytes."""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except FileNotFoundError:
+                pass
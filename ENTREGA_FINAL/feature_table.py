@@ -0,0 +1,184 @@
+import threading
+
+import numpy as np
+from num2words import num2words
+
+NA_JOB_SENTENCE = "No more jobs where found for this candidare"
+NA_SENTENCE = "Not available information"
+
+
+def months_of_experience_sentence(months: int) -> str:
+    return f"The candidate has {num2words(months)} months of labor experience"
+
+
+def exp_years_sentence(months: int, enough: bool) -> str:
+    if enough:
+        return months_of_experience_sentence(months) + ", so he has enough experience to be a manager"
+    return months_of_experience_sentence(months) + ", so he is not qualified to be a manager"
+
+
+def exp_years_management_sentence(months: int, enough: bool) -> str:
+    if enough:
+        return months_of_experience_sentence(months) + ", so he has enough experience to have an executive position"
+    return months_of_experience_sentence(months) + ", so he is not qualified to have an executive position"
+
+
+def avg_time_in_job_sentence(avgTimeInJob: float) -> str:
+    return f"The candidate has an average of {num2words(avgTimeInJob)} months in each job"
+
+
+def management_sentence(management_position) -> str:
+    if management_position:
+        return "One of the recent jobs of the candidate was in a management position"
+    elif management_position == False:
+        return "One of the recent jobs of the candidate did not involve management activities"
+    return "The candidate didn't provide information about his recent jobs"
+
+
+def education_level_sentence(education_level: int) -> str:
+    if education_level < 0:
+        return "The candidate didn't provide information about his education level"
+    elif education_level == 0:
+        return "The candidate has a high school education level"
+    elif education_level == 1:
+        return "The candidate has a college education level"
+    elif education_level == 2:
+        return "The candidate has a postgraduate education level"
+    return "The candidate has a doctorate education level"
+
+
+class FeatureSentenceTable:
+    """
+    Embeddings of the templated sentences used by to_matrix, computed once for every possible input:
+    whole months of experience (with and without management), the management flag and the education level.
+    Building the matrices then only needs vectorized lookups in the table. The average time in job is written
+    with num2words of a float, so it's not a finite set; those sentences are embedded on demand in a single call
+    per batch and memoized.
+    """
+
+    def __init__(self, embeddings, max_months: int = 720) -> None:
+        """
+        Initializes the FeatureSentenceTable class and embeds every sentence of the table.
+
+        Args:
+            embeddings: The embeddings model, it must expose embed_documents.
+            max_months (int, optional): Largest number of months precomputed, larger values are embedded on demand. Defaults to 720.
+        """
+        self.embeddings = embeddings
+        self.max_months = max_months
+        months = range(max_months + 1)
+        # A CV has 5 years or more of experience exactly when it has 60 months or more
+        sentences = (
+            [exp_years_sentence(m, m >= 60) for m in months]
+            + [exp_years_management_sentence(m, m >= 60) for m in months]
+            + [management_sentence(True), management_sentence(False)]
+            + [education_level_sentence(level) for level in range(-1, 4)]
+            + [NA_JOB_SENTENCE, NA_SENTENCE]
+        )
+        self.vectors = np.array(embeddings.embed_documents(sentences))
+        self._exp_offset = 0
+        self._management_exp_offset = max_months + 1
+        self._management_offset = 2 * (max_months + 1)
+        self._education_offset = self._management_offset + 2
+        self.na_job = self.vectors[self._education_offset + 5]
+        self.na = self.vectors[self._education_offset + 6]
+        self._lock = threading.Lock()
+        self._on_demand = {}
+
+    def _lookup_sentences(self, sentences: list) -> np.ndarray:
+        """Embeds the sentences that are not in the table, all the missing ones in a single call."""
+        with self._lock:
+            missing = [s for s in dict.fromkeys(sentences) if s not in self._on_demand]
+        if len(missing) > 0:
+            vectors = self.embeddings.embed_documents(missing)
+            with self._lock:
+                for sentence, vector in zip(missing, vectors):
+                    self._on_demand[sentence] = np.array(vector)
+        return np.stack([self._on_demand[s] for s in sentences])
+
+    def _experience(self, values, offset: int, sentence) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        months = (values * 12).astype(np.int64)
+        result = self.vectors[offset + np.clip(months, 0, self.max_months)]
+        # Values out of the table (or whose threshold does not match the months) are embedded on demand
+        outside = (months < 0) | (months > self.max_months) | ((values >= 5) != (months >= 60))
+        if outside.any():
+            positions = np.flatnonzero(outside)
+            result[positions] = self._lookup_sentences(
+                [sentence(int(months[p]), bool(values[p] >= 5)) for p in positions]
+            )
+        return result
+
+    def exp_years(self, expYears) -> np.ndarray:
+        """
+        Returns the embeddings of the years of experience of many CVs.
+        """
+        return self._experience(expYears, self._exp_offset, exp_years_sentence)
+
+    def exp_years_management(self, expYearsManagement) -> np.ndarray:
+        """
+        Returns the embeddings of the years of experience in management of many CVs.
+        """
+        return self._experience(
+            expYearsManagement, self._management_exp_offset, exp_years_management_sentence
+        )
+
+    def avg_time_in_job(self, avgTimeInJob) -> np.ndarray:
+        """
+        Returns the embeddings of the average time in job of many CVs.
+        """
+        return self._lookup_sentences(
+            [avg_time_in_job_sentence(value) for value in avgTimeInJob]
+        )
+
+    def management(self, management) -> np.ndarray:
+        """
+        Returns the embeddings of the management flag (1 or 0) of many jobs.
+        """
+        management = np.asarray(management)
+        return self.vectors[self._management_offset + (management == 0).astype(np.int64)]
+
+    def education_level(self, levels) -> np.ndarray:
+        """
+        Returns the embeddings of the highest education level of many CVs.
+        """
+        levels = np.clip(np.asarray(levels, dtype=np.int64), -1, 3)
+        return self.vectors[self._education_offset + levels + 1]
+
+    def build_matrices(self, documents: list) -> np.ndarray:
+        """
+        Builds the 15x768 matrices of many CVs at once, with the same rows as to_matrix.
+
+        Args:
+            documents (list): The embedded documents stored by main.py.
+
+        Returns:
+            np.ndarray: Array of shape (number of CVs, 15, 768).
+        """
+        n = len(documents)
+        dim = self.vectors.shape[1]
+        matrices = np.empty((n, 15, dim), dtype=self.vectors.dtype)
+        matrices[:, 0] = self.exp_years([d["expYears"] for d in documents])
+        matrices[:, 1] = self.exp_years_management(
+            [d["expYearsManagement"] for d in documents]
+        )
+        matrices[:, 2] = self.avg_time_in_job([d["avgTimeInJob"] for d in documents])
+        matrices[:, 3] = self.education_level(
+            [d["highestEducation"] for d in documents]
+        )
+        for i, d in enumerate(documents):
+            matrices[i, 4] = d["bachelor"]["title"] if d["bachelor"] is not None else self.na
+            matrices[i, 5] = (
+                d["maxEducation"]["title"] if d["maxEducation"] is not None else self.na
+            )
+            # The last three jobs, from the most recent one
+            for j in range(3):
+                row = 6 + 3 * j
+                if len(d["work"]) - 1 - j < 0:
+                    matrices[i, row : row + 3] = self.na_job
+                else:
+                    work = d["work"][len(d["work"]) - 1 - j]
+                    matrices[i, row] = work["title"]
+                    matrices[i, row + 1] = work["brief"]
+                    matrices[i, row + 2] = self.management([work["management"]])[0]
+        return matrices
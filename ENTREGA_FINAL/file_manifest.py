@@ -0,0 +1,97 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography_utils import calculate_digest
+
+
+class FileManifest:
+    """
+    Local record of the size, modification time, inode and hash of every file seen, so each run
+    only hashes the files that are new or changed since the previous one.
+    """
+
+    path: str
+    algorithm: str
+
+    def __init__(
+        self, path: str = "file_manifest.sqlite", algorithm: str = "md5", workers: int = 8
+    ) -> None:
+        """
+        Initializes the FileManifest class and opens (or creates) the sqlite file.
+
+        Args:
+            path (str, optional): Path of the sqlite file. Defaults to "file_manifest.sqlite".
+            algorithm (str, optional): Hash algorithm, "md5", "blake2b" or "xxh3". The tracker and the caches are keyed
+                by these hashes, so only change it for a new tracker. Defaults to "md5".
+            workers (int, optional): Number of threads used to hash. Defaults to 8.
+        """
+        if algorithm not in ["md5", "blake2b", "xxh3"]:
+            raise Exception(
+                "El algoritmo de hash no es válido. Por favor, especifique 'md5', 'blake2b' o 'xxh3'"
+            )
+        self.path = path
+        self.algorithm = algorithm
+        self.workers = workers
+        # Used by the discovery thread of the WorkScheduler while the main thread waits
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, algorithm TEXT, hash TEXT)"
+        )
+        self._db.commit()
+        self.reused = 0
+        self.hashed = 0
+
+    def hashes(self, paths: list) -> dict:
+        """
+        Returns the hash of every file, only the files whose stat changed are hashed again.
+
+        Args:
+            paths (list): The paths of the files.
+
+        Returns:
+            dict: The hash of every path, False for the files that could not be read.
+        """
+        # Only the rows of these paths, in chunks under the limit of variables of sqlite
+        known = {}
+        for start in range(0, len(paths), 500):
+            chunk = paths[start : start + 500]
+            for row in self._db.execute(
+                "SELECT path, size, mtime_ns, inode, algorithm, hash FROM files WHERE path IN ({})".format(
+                    ",".join("?" * len(chunk))
+                ),
+                chunk,
+            ):
+                known[row[0]] = row[1:]
+        result, stats, changed = {}, {}, []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                result[path] = False
+                continue
+            stats[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino, self.algorithm)
+            row = known.get(path)
+            if row is not None and tuple(row[:4]) == stats[path]:
+                result[path] = row[4]
+                self.reused += 1
+            else:
+                changed.append(path)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            digests = pool.map(
+                lambda path: calculate_digest(path, self.algorithm), changed
+            )
+            for path, digest in zip(changed, digests):
+                result[path] = digest
+                self.hashed += 1
+
+        self._db.executemany(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, algorithm, hash) VALUES (?, ?, ?, ?, ?, ?)",
+            [(path, *stats[path], result[path]) for path in changed if result[path]],
+        )
+        self._db.commit()
+        return result
+
+    def close(self) -> None:
+        self._db.close()
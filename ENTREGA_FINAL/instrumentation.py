@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, like the histograms of Prometheus.
+    """
+
+    def __init__(self, buckets: list = None) -> None:
+        self.buckets = buckets or LATENCY_BUCKETS
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket where the quantile falls.
+        """
+        if self.count == 0:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Metrics of the stages of the flow: a latency histogram and the number of items in flight of each stage,
+    and counters (tokens, bytes, files). They can be written as JSON lines (one snapshot per line) and as a
+    Prometheus text file, which the node exporter of a node can read with its textfile collector.
+    Every method is thread safe.
+    """
+
+    def __init__(
+        self, jsonl_path: str = None, prometheus_path: str = None, prefix: str = "pisa"
+    ) -> None:
+        """
+        Initializes the Metrics class.
+
+        Args:
+            jsonl_path (str, optional): File where the snapshots are appended, None disables it. Defaults to None.
+            prometheus_path (str, optional): File rewritten with the metrics in the Prometheus text format, None disables it. Defaults to None.
+            prefix (str, optional): Prefix of the names of the Prometheus metrics. Defaults to "pisa".
+        """
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._in_flight = {}
+        self._counters = {}
+        self._start = time.time()
+
+    def observe(self, stage: str, seconds: float, trace: dict = None) -> None:
+        """
+        Records the latency of a stage, and adds it to the trace of the file when given.
+        """
+        with self._lock:
+            if stage not in self._histograms:
+                self._histograms[stage] = Histogram()
+            self._histograms[stage].observe(seconds)
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + seconds
+
+    def add(self, counter: str, amount: float = 1) -> None:
+        """
+        Adds an amount to a counter, e.g. "llm_input_tokens" or "extract_bytes".
+        """
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    @contextmanager
+    def track(self, stage: str, trace: dict = None):
+        """
+        Context manager that counts the block as in flight in the stage and records its latency,
+        even when it raises an error.
+
+        Args:
+            stage (str): The name of the stage.
+            trace (dict, optional): The trace of the file, where the seconds of the stage are added. Defaults to None.
+        """
+        with self._lock:
+            self._in_flight[stage] = self._in_flight.get(stage, 0) + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, trace)
+            with self._lock:
+                self._in_flight[stage] -= 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current value of every metric.
+        """
+        with self._lock:
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self._start,
+                "stages": {
+                    stage: {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "avg": histogram.sum / histogram.count if histogram.count else 0.0,
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "in_flight": self._in_flight.get(stage, 0),
+                        "buckets": dict(
+                            zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts)
+                        ),
+                    }
+                    for stage, histogram in self._histograms.items()
+                },
+                "counters": dict(self._counters),
+            }
+
+    def prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        name = self.prefix
+        lines = [
+            f"# HELP {name}_stage_seconds Latency of each stage of the flow.",
+            f"# TYPE {name}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{name}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{name}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines += [
+                f"# HELP {name}_stage_in_flight Items being processed by each stage.",
+                f"# TYPE {name}_stage_in_flight gauge",
+            ]
+            for stage, in_flight in sorted(self._in_flight.items()):
+                lines.append(f'{name}_stage_in_flight{{stage="{stage}"}} {in_flight}')
+            for counter, value in sorted(self._counters.items()):
+                lines += [
+                    f"# TYPE {name}_{counter}_total counter",
+                    f"{name}_{counter}_total {value}",
+                ]
+        return "\n".join(lines) + "\n"
+
+    def export(self) -> None:
+        """
+        Appends a snapshot to the JSON lines file and rewrites the Prometheus file.
+        """
+        if self.jsonl_path:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+        if self.prometheus_path:
+            # Written to a temporary file and renamed, so the file is never read half written
+            temporary = self.prometheus_path + ".tmp"
+            with open(temporary, "w") as f:
+                f.write(self.prometheus())
+            os.replace(temporary, self.prometheus_path)
+
+    def format_stats(self) -> str:
+        """
+        Returns the latency of every stage as a human readable text.
+        """
+        return "\n".join(
+            "  {:<14} {:>6} veces | promedio {:.3f}s, p95 <= {}s, {} activos".format(
+                stage, stats["count"], stats["avg"], stats["p95"], stats["in_flight"]
+            )
+            for stage, stats in self.snapshot()["stages"].items()
+        )
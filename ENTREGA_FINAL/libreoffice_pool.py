@@ -0,0 +1,332 @@
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Empty, Queue
+from xmlrpc.client import ServerProxy, Transport
+
+from unoserver.client import UnoClient
+
+
+class _TimeoutTransport(Transport):
+    """Transport of xmlrpc with a socket timeout, a server that is still starting accepts but does not answer."""
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self._timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self._timeout
+        return connection
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LibreOfficePool:
+    """
+    Pool of long-lived headless LibreOffice workers for the conversions of the extraction (image-only .docx to PDF
+    and .doc to .docx). Each worker keeps one soffice running with its own user profile, listening on a UNO socket
+    through unoserver, and sends every conversion to it, so the start-up of soffice is only paid when the worker
+    starts. The workers are supervised: a soffice that died or hangs on a file is killed and started again, and the
+    file is retried once on the new process.
+
+    unoserver must be installed in the Python of LibreOffice (the one that can import uno, e.g. /usr/bin/python3
+    with python3-uno), the client only needs the unoserver package.
+    """
+
+    workers: int
+    timeout: float
+    start_timeout: float
+
+    def __init__(
+        self,
+        workers: int = 2,
+        timeout: float = 120,
+        start_timeout: float = 60,
+        binary: str = "soffice",
+        python: str = "/usr/bin/python3",
+    ) -> None:
+        """
+        Initializes the LibreOfficePool class and starts its workers.
+
+        Args:
+            workers (int, optional): Number of soffice processes running at the same time. Defaults to 2.
+            timeout (float, optional): Maximum seconds per file before soffice is considered hung and restarted. Defaults to 120.
+            start_timeout (float, optional): Maximum seconds for a soffice to start accepting conversions. Defaults to 60.
+            binary (str, optional): The LibreOffice executable. Defaults to "soffice".
+            python (str, optional): Python with uno and unoserver that runs the server of each worker. Defaults to "/usr/bin/python3".
+        """
+        if shutil.which(binary) is None:
+            raise Exception(
+                f"No se encontró {binary}, LibreOffice no está instalado o no está en el PATH"
+            )
+        if shutil.which(python) is None or subprocess.run(
+            [python, "-c", "import uno, unoserver.server"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode != 0:
+            raise Exception(
+                f"{python} no puede importar uno y unoserver, instale python3-uno y unoserver en ese Python"
+            )
+        self.workers = workers
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.binary = binary
+        self.python = python
+        self._queue = Queue()
+        self._processes = [None] * workers
+        self._clients = [None] * workers
+        self._proxies = [None] * workers
+        self._hung = [False] * workers
+        self._lock = threading.Lock()
+        self._closed = False
+        self._root = tempfile.mkdtemp(prefix="libreoffice-pool-")
+        self.converted = 0
+        self.failed = 0
+        self.restarts = 0
+        self._threads = [
+            threading.Thread(
+                target=self._run, args=(number,), name=f"libreoffice-{number}", daemon=True
+            )
+            for number in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _profile(self, number: int) -> str:
+        return os.path.join(self._root, f"profile-{number}")
+
+    def _command(self, number: int, port: int, uno_port: int) -> list:
+        return [
+            self.python,
+            "-m",
+            "unoserver.server",
+            "--interface",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--uno-port",
+            str(uno_port),
+            "--executable",
+            shutil.which(self.binary),
+            "--user-installation",
+            self._profile(number),
+            "--quiet",
+        ]
+
+    def _start(self, number: int) -> None:
+        """Starts the soffice of a worker and waits until it accepts conversions."""
+        self._stop(number)
+        # A killed soffice leaves the lock of its profile behind
+        Path(self._profile(number), ".lock").unlink(missing_ok=True)
+        port, uno_port = _free_port(), _free_port()
+        # In its own session, so the server and its soffice can be killed together
+        process = subprocess.Popen(
+            self._command(number, port, uno_port),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self._processes[number] = process
+        self._hung[number] = False
+        self._proxies[number] = ServerProxy(f"http://127.0.0.1:{port}", transport=_TimeoutTransport(5))
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            if process.poll() is not None:
+                raise Exception(f"soffice terminó al arrancar con el código {process.returncode}")
+            try:
+                self._proxies[number].info()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    self._stop(number)
+                    raise Exception(f"soffice no arrancó en {self.start_timeout}s")
+                time.sleep(0.5)
+        self._clients[number] = UnoClient("127.0.0.1", str(port))
+
+    def _stop(self, number: int, grace: float = 0) -> None:
+        """Stops the soffice of a worker, killing it if it's still running after the grace seconds."""
+        process, self._processes[number] = self._processes[number], None
+        if process is None:
+            return
+        if grace > 0 and process.poll() is None:
+            # unoserver passes the signal on to its soffice
+            process.terminate()
+            try:
+                process.wait(grace)
+            except subprocess.TimeoutExpired:
+                pass
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+    def _kill(self, number: int, process: subprocess.Popen) -> None:
+        """Watchdog of a conversion, kills the soffice that exceeded the timeout so the conversion returns."""
+        if self._processes[number] is process:
+            self._hung[number] = True
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _alive(self, number: int) -> bool:
+        process = self._processes[number]
+        return process is not None and process.poll() is None and not self._hung[number]
+
+    def _healthy(self, number: int) -> bool:
+        """Checks after a failed conversion that the soffice still answers, the process may not have exited yet."""
+        if not self._alive(number):
+            return False
+        try:
+            # info goes through UNO, so it also fails when only the soffice behind unoserver died
+            self._proxies[number].info()
+            return True
+        except Exception:
+            return False
+
+    def submit(self, path: str, target: str, outdir: str) -> Future:
+        """
+        Queues the conversion of a file.
+
+        Args:
+            path (str): The path to the file.
+            target (str): The extension of the converted file and optionally its export filter, e.g. "pdf" or "docx:MS Word 2007 XML".
+            outdir (str): Directory where the converted file is written.
+
+        Returns:
+            Future: A future that resolves to the path of the converted file.
+        """
+        if self._closed:
+            raise Exception("El LibreOfficePool ya fue cerrado")
+        future = Future()
+        self._queue.put((os.path.abspath(path), target, outdir, future))
+        return future
+
+    def convert(self, path: str, target: str, outdir: str) -> str:
+        """
+        Converts a file, blocking until it's done.
+
+        Args:
+            path (str): The path to the file.
+            target (str): The extension of the converted file and optionally its export filter, e.g. "pdf" or "docx:MS Word 2007 XML".
+            outdir (str): Directory where the converted file is written.
+
+        Returns:
+            str: The path of the converted file.
+        """
+        return self.submit(path, target, outdir).result()
+
+    def queue_depth(self) -> int:
+        """
+        Returns the number of conversions waiting for a worker.
+        """
+        return self._queue.qsize()
+
+    def _next(self):
+        """Waits for a job, returns None once the pool is closing."""
+        while True:
+            try:
+                job = self._queue.get(timeout=0.5)
+            except Empty:
+                if self._closed:
+                    return None
+                continue
+            if job is False:
+                # Put the sentinel back for the other workers
+                self._queue.put(False)
+                return None
+            return job
+
+    def _convert(self, number: int, path: str, target: str, outdir: str) -> str:
+        """Converts a file with the soffice of the worker, a watchdog kills it if it exceeds the timeout."""
+        extension, _, filtername = target.partition(":")
+        os.makedirs(outdir, exist_ok=True)
+        output = os.path.join(outdir, Path(path).stem + "." + extension)
+        watchdog = threading.Timer(self.timeout, self._kill, args=(number, self._processes[number]))
+        watchdog.start()
+        try:
+            self._clients[number].convert(
+                inpath=path, outpath=output, convert_to=extension, filtername=filtername or None
+            )
+        finally:
+            watchdog.cancel()
+        if not os.path.exists(output):
+            raise Exception(f"LibreOffice no pudo convertir {path} a {extension}")
+        return output
+
+    def _run(self, number: int) -> None:
+        # Started before the first job, otherwise the first conversion pays the start-up
+        try:
+            self._start(number)
+        except Exception as e:
+            print(f"LibreOffice worker {number} could not start, it will retry on its first job: {e}")
+        while True:
+            job = self._next()
+            if job is None:
+                break
+            path, target, outdir, future = job
+            error = None
+            # A second attempt only when the soffice died or hung, the file may not be the cause
+            for _ in range(2):
+                try:
+                    if not self._alive(number):
+                        self._start(number)
+                    result = self._convert(number, path, target, outdir)
+                except Exception as e:
+                    error = e
+                    if self._hung[number]:
+                        error = TimeoutError(f"LibreOffice superó {self.timeout}s convirtiendo {path}")
+                    if self._healthy(number):
+                        break
+                    # Killed here, so the next attempt starts a new one
+                    self._stop(number)
+                    with self._lock:
+                        self.restarts += 1
+                    continue
+                future.set_result(result)
+                with self._lock:
+                    self.converted += 1
+                error = None
+                break
+            if error is not None:
+                future.set_exception(error)
+                with self._lock:
+                    self.failed += 1
+        self._stop(number, grace=10)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the pool and its queue depth.
+        """
+        with self._lock:
+            return {
+                "converted": self.converted,
+                "failed": self.failed,
+                "restarts": self.restarts,
+                "queue_depth": self.queue_depth(),
+            }
+
+    def close(self) -> None:
+        """
+        Converts the jobs already queued, stops the workers and their soffice and removes their profiles.
+        """
+        if self._closed:
+            return
+        self._queue.put(False)
+        for thread in self._threads:
+            thread.join()
+        self._closed = True
+        shutil.rmtree(self._root, ignore_errors=True)
@@ -0,0 +1,209 @@
+import json
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+
+from langchain_core.messages import AIMessage
+
+from llm_client import merge_chunks
+
+
+class LLMReplayMiss(Exception):
+    """Raised in replay mode when a response was never recorded."""
+
+
+def prompt_fingerprint(prompt) -> str:
+    """
+    Returns a stable text representation of a ChatPromptTemplate, built from the role and template of each message.
+
+    Args:
+        prompt (ChatPromptTemplate): The prompt of the chain.
+
+    Returns:
+        str: The representation of the prompt.
+    """
+    parts = []
+    for message in prompt.messages:
+        template = getattr(getattr(message, "prompt", None), "template", None)
+        parts.append([message.__class__.__name__, template or str(message)])
+    return json.dumps(parts, ensure_ascii=False)
+
+
+class LLMResponseCache:
+    """
+    Store of the responses of the LLM, keyed by the hash of the prompt template, the model name and the input text.
+    As the chain runs with temperature=0, a recorded response can be reused instead of calling the model again.
+    """
+
+    path: str
+
+    def __init__(self, path: str = "llm_cache.sqlite") -> None:
+        """
+        Initializes the LLMResponseCache class and opens (or creates) the sqlite file.
+
+        Args:
+            path (str, optional): Path of the sqlite file. Defaults to "llm_cache.sqlite".
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, content TEXT, response_metadata TEXT, created_at REAL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(prompt: str, model_name: str, text: str) -> str:
+        """
+        Returns the key of a request, the sha256 of the prompt, the model name and the input text.
+        """
+        return sha256(f"{prompt}\0{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the recorded response for a key.
+
+        Returns:
+            AIMessage: The recorded response.
+            None: If there is no response recorded for the key.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content, response_metadata FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return AIMessage(content=row[0], response_metadata=json.loads(row[1]))
+
+    def put(self, key: str, model_name: str, output) -> None:
+        """
+        Records the response of the model.
+
+        Args:
+            key (str): The key of the request.
+            model_name (str): The name of the model that generated the response.
+            output (AIMessage): The response of the model.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, response_metadata, created_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    model_name,
+                    output.content,
+                    json.dumps(output.response_metadata, default=str),
+                    time.time(),
+                ),
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CachedChain:
+    """
+    Wraps the extraction chain (prompt | chat) so responses are recorded and replayed from an LLMResponseCache.
+
+    The available modes are:
+        - "readwrite": Recorded responses are reused, new ones are requested to the model and recorded.
+        - "replay": Only recorded responses are used, a missing one raises LLMReplayMiss. No network is needed.
+        - "off": The cache is not used.
+    """
+
+    MODES = ["readwrite", "replay", "off"]
+
+    def __init__(
+        self, chain, prompt, model_name: str, cache: LLMResponseCache, mode: str = "readwrite"
+    ) -> None:
+        """
+        Initializes the CachedChain class.
+
+        Args:
+            chain: The chain to invoke on cache misses.
+            prompt (ChatPromptTemplate): The prompt of the chain, part of the key.
+            model_name (str): The name of the model of the chain, part of the key.
+            cache (LLMResponseCache): The store of the responses.
+            mode (str, optional): One of "readwrite", "replay" or "off". Defaults to "readwrite".
+        """
+        if mode not in self.MODES:
+            raise Exception(
+                "El modo de la caché del LLM no es válido. Por favor, especifique 'readwrite', 'replay' u 'off'"
+            )
+        self.chain = chain
+        self.model_name = model_name
+        self.cache = cache
+        self.mode = mode
+        self._prompt = prompt_fingerprint(prompt)
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, inputs: dict):
+        key = self.cache.key(self._prompt, self.model_name, inputs["text"])
+        output = self.cache.get(key)
+        if output is not None:
+            self.hits += 1
+            return key, output
+        self.misses += 1
+        if self.mode == "replay":
+            raise LLMReplayMiss(
+                "No se encontró una respuesta grabada para el texto (modo replay)"
+            )
+        return key, None
+
+    def invoke(self, inputs: dict):
+        """
+        Invokes the chain, reusing the recorded response when available.
+
+        Args:
+            inputs (dict): The inputs of the chain, the key "text" is the text of the CV.
+
+        Returns:
+            AIMessage: The response of the model.
+        """
+        if self.mode == "off":
+            return self.chain.invoke(inputs)
+        key, output = self._lookup(inputs)
+        if output is None:
+            output = self.chain.invoke(inputs)
+            self.cache.put(key, self.model_name, output)
+        return output
+
+    async def ainvoke(self, inputs: dict):
+        """
+        Async version of invoke.
+        """
+        if self.mode == "off":
+            return await self.chain.ainvoke(inputs)
+        key, output = self._lookup(inputs)
+        if output is None:
+            output = await self.chain.ainvoke(inputs)
+            self.cache.put(key, self.model_name, output)
+        return output
+
+    async def astream(self, inputs: dict):
+        """
+        Streams the response of the chain. A recorded response is emitted as a single chunk, and a new
+        one is recorded once it's complete.
+
+        Args:
+            inputs (dict): The inputs of the chain, the key "text" is the text of the CV.
+
+        Yields:
+            AIMessageChunk: The chunks of the response.
+        """
+        if self.mode == "off":
+            async for chunk in self.chain.astream(inputs):
+                yield chunk
+            return
+        key, output = self._lookup(inputs)
+        if output is not None:
+            yield output
+            return
+        chunks = []
+        async for chunk in self.chain.astream(inputs):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.put(key, self.model_name, merge_chunks(chunks))
@@ -0,0 +1,308 @@
+import asyncio
+import random
+import time
+from math import ceil
+
+import anthropic
+from langchain_core.messages import AIMessage
+
+# Status codes worth retrying: rate limit, server errors and overloaded (529)
+RETRYABLE_STATUS = [429, 500, 502, 503, 504, 529]
+
+
+def chunk_text(chunk) -> str:
+    """
+    Returns the text of a message or a streamed chunk, whose content can be a string or a list of content blocks.
+    """
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in chunk.content
+    )
+
+
+def merge_chunks(chunks: list) -> AIMessage:
+    """
+    Joins the chunks of a streamed response into a single message, like the one returned by ainvoke.
+    The usage reported in the chunks is stored in response_metadata["usage"].
+
+    Args:
+        chunks (list): The chunks of the response, in order.
+
+    Returns:
+        AIMessage: The complete response.
+    """
+    if len(chunks) == 0:
+        return AIMessage(content="", response_metadata={"usage": {}})
+    full = chunks[0]
+    for chunk in chunks[1:]:
+        full = full + chunk
+    usage = dict(full.response_metadata.get("usage") or {})
+    usage_metadata = getattr(full, "usage_metadata", None)
+    if len(usage) == 0 and usage_metadata:
+        usage = {
+            "input_tokens": usage_metadata["input_tokens"],
+            "output_tokens": usage_metadata["output_tokens"],
+        }
+    return AIMessage(
+        content=chunk_text(full), response_metadata={**full.response_metadata, "usage": usage}
+    )
+
+
+class TokenBucket:
+    """
+    Async token bucket. It refills continuously at rate_per_minute and allows going into debt,
+    so the real usage reported after a request can be charged even if it exceeded the estimate.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None) -> None:
+        """
+        Initializes the TokenBucket class.
+
+        Args:
+            per_minute (float): Tokens added per minute.
+            capacity (float, optional): Maximum tokens stored, i.e. the burst allowed. Defaults to per_minute.
+        """
+        self.max_rate = per_minute / 60
+        self.rate = self.max_rate
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self, amount: float) -> None:
+        """
+        Waits until the amount of tokens is available and takes it. Callers are served in order.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """
+        Charges (positive) or returns (negative) tokens without waiting.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def scale(self, factor: float, min_fraction: float = 0.1) -> None:
+        """
+        Multiplies the refill rate by factor, keeping it between min_fraction and the configured rate.
+        """
+        self._refill()
+        self.rate = min(self.max_rate, max(self.max_rate * min_fraction, self.rate * factor))
+
+
+class AsyncExtractionClient:
+    """
+    Async client around the extraction chain (prompt | chat) that limits the requests, input tokens and
+    output tokens per minute with token buckets. The estimates used before each request are corrected with
+    the usage reported in response_metadata["usage"], and rate limits or overloaded errors are retried with
+    exponential backoff while the rates are reduced (and slowly recovered after successful requests).
+    """
+
+    def __init__(
+        self,
+        chain,
+        requests_per_minute: int = 50,
+        input_tokens_per_minute: int = 50000,
+        output_tokens_per_minute: int = 10000,
+        prompt_chars: int = 1500,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        """
+        Initializes the AsyncExtractionClient class.
+
+        Args:
+            chain: The extraction chain, it must expose ainvoke and return an AIMessage.
+            requests_per_minute (int, optional): Requests allowed per minute. Defaults to 50.
+            input_tokens_per_minute (int, optional): Input tokens allowed per minute. Defaults to 50000.
+            output_tokens_per_minute (int, optional): Output tokens allowed per minute. Defaults to 10000.
+            prompt_chars (int, optional): Characters of the prompt added to each text, used for the first estimates. Defaults to 1500.
+            max_retries (int, optional): Maximum number of retries per request. Defaults to 6.
+            base_delay (float, optional): Seconds of the first backoff. Defaults to 1.0.
+            max_delay (float, optional): Maximum seconds of a backoff. Defaults to 60.0.
+        """
+        self.chain = chain
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.output_tokens = TokenBucket(output_tokens_per_minute)
+        self.prompt_chars = prompt_chars
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # Estimates learned from the usage of previous responses
+        self._tokens_per_char = 0.3
+        self._avg_output = 1000.0
+        self.in_flight = 0
+        self.completed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.used_input_tokens = 0
+        self.used_output_tokens = 0
+
+    def _buckets(self) -> list:
+        return [self.requests, self.input_tokens, self.output_tokens]
+
+    def estimate_input_tokens(self, text: str) -> int:
+        """
+        Estimates the input tokens of a request from the length of the text.
+        """
+        return ceil((len(text) + self.prompt_chars) * self._tokens_per_char)
+
+    def _retry_delay(self, e: Exception, attempt: int):
+        """Returns the seconds to wait before retrying, or None if the error is not transient."""
+        status = getattr(e, "status_code", None)
+        if status not in RETRYABLE_STATUS and not isinstance(
+            e, (anthropic.APIConnectionError, anthropic.APITimeoutError)
+        ):
+            return None
+        if status == 429:
+            self.rate_limited += 1
+            for bucket in self._buckets():
+                bucket.scale(0.75)
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        delay *= random.uniform(0.5, 1.5)
+        response = getattr(e, "response", None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        return delay
+
+    def _observe(self, text: str, estimated_in: int, estimated_out: float, usage: dict):
+        """Charges the real usage to the buckets and updates the estimates."""
+        used_in = usage.get("input_tokens", estimated_in)
+        used_out = usage.get("output_tokens", estimated_out)
+        self.input_tokens.adjust(used_in - estimated_in)
+        self.output_tokens.adjust(used_out - estimated_out)
+        self.used_input_tokens += used_in
+        self.used_output_tokens += used_out
+        self._tokens_per_char = 0.9 * self._tokens_per_char + 0.1 * (
+            used_in / (len(text) + self.prompt_chars)
+        )
+        self._avg_output = 0.9 * self._avg_output + 0.1 * used_out
+        # Slow recovery of the rates reduced by a rate limit
+        for bucket in self._buckets():
+            bucket.scale(1.02)
+
+    async def ainvoke(self, inputs: dict):
+        """
+        Invokes the chain once the rate limits allow it, retrying transient errors.
+
+        Args:
+            inputs (dict): The inputs of the chain, the key "text" is the text of the CV.
+
+        Returns:
+            AIMessage: The response of the model.
+        """
+        text = inputs["text"]
+        attempt = 0
+        while True:
+            estimated_in = self.estimate_input_tokens(text)
+            estimated_out = self._avg_output
+            await self.requests.acquire(1)
+            await self.input_tokens.acquire(estimated_in)
+            await self.output_tokens.acquire(estimated_out)
+            self.in_flight += 1
+            try:
+                output = await self.chain.ainvoke(inputs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self.in_flight -= 1
+            self._observe(
+                text,
+                estimated_in,
+                estimated_out,
+                output.response_metadata.get("usage", {}),
+            )
+            self.completed += 1
+            return output
+
+    async def astream(self, inputs: dict):
+        """
+        Streams the response of the chain once the rate limits allow it. Transient errors are retried
+        only before the first chunk, afterwards the error is raised as part of the response was already emitted.
+
+        Args:
+            inputs (dict): The inputs of the chain, the key "text" is the text of the CV.
+
+        Yields:
+            AIMessageChunk: The chunks of the response of the model.
+        """
+        text = inputs["text"]
+        attempt = 0
+        while True:
+            estimated_in = self.estimate_input_tokens(text)
+            estimated_out = self._avg_output
+            await self.requests.acquire(1)
+            await self.input_tokens.acquire(estimated_in)
+            await self.output_tokens.acquire(estimated_out)
+            self.in_flight += 1
+            chunks = []
+            try:
+                async for chunk in self.chain.astream(inputs):
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if len(chunks) > 0 or delay is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self.in_flight -= 1
+            self._observe(
+                text,
+                estimated_in,
+                estimated_out,
+                merge_chunks(chunks).response_metadata["usage"],
+            )
+            self.completed += 1
+            return
+
+    def invoke(self, inputs: dict):
+        """
+        Sync version of ainvoke, it's not rate limited as it's only meant for single calls outside of the pipeline.
+        """
+        return self.chain.invoke(inputs)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the client and the current rates per minute.
+        """
+        return {
+            "completed": self.completed,
+            "in_flight": self.in_flight,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "input_tokens": self.used_input_tokens,
+            "output_tokens": self.used_output_tokens,
+            "requests_per_minute": self.requests.rate * 60,
+            "input_tokens_per_minute": self.input_tokens.rate * 60,
+            "output_tokens_per_minute": self.output_tokens.rate * 60,
+        }
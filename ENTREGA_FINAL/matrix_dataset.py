@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# File where as_array merges the shards of a dataset with more than one
+MERGED_FILE = "all.bin"
+
+
+class MatrixDatasetWriter:
+    """
+    Writes the matrices produced by to_matrix as a binary dataset: fixed size shards of raw float32 (or float16)
+    rows, plus a manifest.json with the shape and the shards, and an index.json that maps the hash of every
+    CV to its shard, row and label. Matrices of a hash already written are skipped.
+    """
+
+    directory: str
+    shape: tuple
+    dtype: str
+    shard_size: int
+
+    def __init__(
+        self,
+        directory: str,
+        shape: tuple = (15, 768),
+        dtype: str = "float32",
+        shard_size: int = 8192,
+    ) -> None:
+        """
+        Initializes the MatrixDatasetWriter class.
+
+        Args:
+            directory (str): Directory of the dataset, it's created if it does not exist.
+            shape (tuple, optional): Shape of each matrix. Defaults to (15, 768).
+            dtype (str, optional): "float32" or "float16". Defaults to "float32".
+            shard_size (int, optional): Number of matrices per shard. Defaults to 8192.
+        """
+        if dtype not in ["float32", "float16"]:
+            raise Exception(
+                "El tipo de dato no es válido. Por favor, especifique 'float32' o 'float16'"
+            )
+        self.directory = directory
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._shards = []
+        self._index = {}
+        self._file = None
+        self.duplicates = 0
+
+    def _shard_name(self, number: int) -> str:
+        return f"shard-{number:05d}.bin"
+
+    def add(self, matrix, label: int, file_hash: str) -> bool:
+        """
+        Appends a matrix to the dataset, it's safe to call from several threads.
+
+        Args:
+            matrix: The matrix of the CV, with the shape of the dataset.
+            label (int): The label of the CV.
+            file_hash (str): The hash of the CV file.
+
+        Returns:
+            bool: False if the hash was already in the dataset and the matrix was skipped.
+        """
+        data = np.ascontiguousarray(matrix, dtype=self.dtype)
+        if data.shape != self.shape:
+            raise Exception(
+                f"La matriz tiene forma {data.shape}, se esperaba {self.shape}"
+            )
+        with self._lock:
+            if file_hash in self._index:
+                self.duplicates += 1
+                return False
+            if len(self._shards) == 0 or self._shards[-1]["rows"] == self.shard_size:
+                if self._file is not None:
+                    self._file.close()
+                self._shards.append({"file": self._shard_name(len(self._shards)), "rows": 0})
+                self._file = open(
+                    os.path.join(self.directory, self._shards[-1]["file"]), "wb"
+                )
+            shard = self._shards[-1]
+            self._file.write(data.tobytes())
+            self._index[file_hash] = {
+                "label": int(label),
+                "shard": len(self._shards) - 1,
+                "row": shard["rows"],
+            }
+            shard["rows"] += 1
+        return True
+
+    def close(self) -> None:
+        """
+        Closes the last shard and writes the manifest and the index.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            with open(os.path.join(self.directory, "index.json"), "w") as f:
+                json.dump(self._index, f)
+            # The merged file of a previous version of the dataset no longer matches the shards
+            if os.path.exists(os.path.join(self.directory, MERGED_FILE)):
+                os.remove(os.path.join(self.directory, MERGED_FILE))
+            with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+                json.dump(
+                    {
+                        "shape": list(self.shape),
+                        "dtype": self.dtype,
+                        "shard_size": self.shard_size,
+                        "count": len(self._index),
+                        "shards": self._shards,
+                    },
+                    f,
+                    indent=2,
+                )
+
+
+class MatrixDataset:
+    """
+    Reads a dataset written by MatrixDatasetWriter. Every shard is opened with np.memmap, so the matrices are
+    only read from disk when they are accessed and the memory used does not grow with the size of the corpus.
+    """
+
+    directory: str
+
+    def __init__(self, directory: str) -> None:
+        """
+        Initializes the MatrixDataset class.
+
+        Args:
+            directory (str): Directory of the dataset.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        self.shape = tuple(self.manifest["shape"])
+        self.shards = [
+            np.memmap(
+                os.path.join(directory, shard["file"]),
+                dtype=self.manifest["dtype"],
+                mode="r",
+                shape=(shard["rows"], *self.shape),
+            )
+            for shard in self.manifest["shards"]
+        ]
+        offsets = np.cumsum([0] + [shard["rows"] for shard in self.manifest["shards"]])
+        self._offsets = offsets
+        self.hashes = [None] * len(index)
+        self.labels = np.empty(len(index), dtype=np.int64)
+        self._rows = {}
+        for file_hash, entry in index.items():
+            position = int(offsets[entry["shard"]] + entry["row"])
+            self.hashes[position] = file_hash
+            self.labels[position] = entry["label"]
+            self._rows[file_hash] = position
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __getitem__(self, position: int) -> np.ndarray:
+        """
+        Returns the matrix at a position, as a view of the memmap (no copy).
+        """
+        if position < 0:
+            position += len(self)
+        shard = int(np.searchsorted(self._offsets, position, side="right")) - 1
+        return self.shards[shard][position - self._offsets[shard]]
+
+    def row_of(self, file_hash: str) -> int:
+        """
+        Returns the position of the matrix of a CV.
+        """
+        return self._rows[file_hash]
+
+    def get(self, file_hash: str) -> tuple:
+        """
+        Returns the matrix and the label of a CV.
+        """
+        position = self._rows[file_hash]
+        return self[position], int(self.labels[position])
+
+    def iter_batches(self, batch_size: int = 256):
+        """
+        Yields (X, y) batches in order, each batch is a view of a single shard.
+        """
+        for number, shard in enumerate(self.shards):
+            start = self._offsets[number]
+            for row in range(0, shard.shape[0], batch_size):
+                end = min(row + batch_size, shard.shape[0])
+                yield shard[row:end], self.labels[start + row : start + end]
+
+    def as_array(self) -> np.ndarray:
+        """
+        Returns all the matrices as one read-only memmap. With a single shard it's the shard itself, with several
+        shards they are copied once, a block at a time, into a preallocated memmap (all.bin) that the next calls
+        reuse, so the memory used still does not grow with the size of the corpus.
+        """
+        dtype = self.manifest["dtype"]
+        if len(self.shards) == 0:
+            return np.empty((0, *self.shape), dtype=dtype)
+        if len(self.shards) == 1:
+            return self.shards[0]
+        shape = (len(self), *self.shape)
+        path = os.path.join(self.directory, MERGED_FILE)
+        size = len(self) * int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            merged = np.memmap(path + ".tmp", dtype=dtype, mode="w+", shape=shape)
+            for number, shard in enumerate(self.shards):
+                start = self._offsets[number]
+                for row in range(0, shard.shape[0], 1024):
+                    end = min(row + 1024, shard.shape[0])
+                    merged[start + row : start + end] = shard[row:end]
+            merged.flush()
+            del merged
+            os.replace(path + ".tmp", path)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
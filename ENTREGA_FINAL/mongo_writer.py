@@ -0,0 +1,243 @@
+import atexit
+import threading
+import time
+from collections import deque
+
+from colorama import Fore
+from pymongo import InsertOne, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+def get_mongo_client(uri: str):
+    """
+    Returns a MongoDB client for the uri. The uri "mongomock://" returns an in-memory
+    stand-in (requires the mongomock package), useful to run the flow without a server.
+
+    Args:
+        uri (str): The MongoDB connection string.
+
+    Returns:
+        MongoClient: The client.
+    """
+    if uri.startswith("mongomock://"):
+        import mongomock
+
+        return mongomock.MongoClient()
+    return MongoClient(uri)
+
+
+def find_known_hashes(collection, hashes: list, chunk_size: int = 1000) -> dict:
+    """
+    Looks up many hashes in the tracker with one $in query per chunk instead of one query per file.
+
+    Args:
+        collection: The MongoDB collection of the tracker.
+        hashes (list): The hashes to look up.
+        chunk_size (int, optional): Number of hashes per query. Defaults to 1000.
+
+    Returns:
+        dict: The tracker document of every hash found, keyed by hash.
+    """
+    known = {}
+    hashes = list(set(hashes))
+    for start in range(0, len(hashes), chunk_size):
+        cursor = collection.find(
+            {"hash": {"$in": hashes[start : start + chunk_size]}}, {"_id": 0}
+        )
+        for document in cursor:
+            known[document["hash"]] = document
+    return known
+
+
+class BulkWriter:
+    """
+    Write-behind buffer for a MongoDB collection. insert_one and update_one are queued and sent as
+    unordered bulk_write batches when max_batch operations are buffered or max_wait seconds have passed.
+    The buffer is flushed on close and when the interpreter exits. A failed flush puts the operations back in the
+    buffer and only raises to an explicit flush or close, the flushing thread keeps retrying them. The operations
+    rejected by MongoDB (e.g. a document too large) are not retried, they are reported to on_failure.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_batch: int = 500,
+        max_wait: float = 2.0,
+        flush_first=None,
+        metrics=None,
+        name: str = "mongo",
+        ordered: bool = False,
+        on_failure=None,
+    ) -> None:
+        """
+        Initializes the BulkWriter class and starts the thread that flushes by time.
+
+        Args:
+            collection: The MongoDB collection.
+            max_batch (int, optional): Number of buffered operations that triggers a flush. Defaults to 500.
+            max_wait (float, optional): Maximum seconds an operation stays in the buffer. Defaults to 2.0.
+            flush_first (BulkWriter, optional): Writer flushed before each flush of this one, so the tracker is not
+                marked as processed before the embedded documents are stored. Defaults to None.
+            metrics (Metrics, optional): Where the latency of each bulk_write is recorded as the stage "{name}_bulk_write". Defaults to None.
+            name (str, optional): Name of the writer in the metrics. Defaults to "mongo".
+            ordered (bool, optional): Sends ordered bulk writes, for operations on the same document that must be applied
+                in order. The operations after a rejected one are retried in the next flush. Defaults to False.
+            on_failure (callable, optional): Called with a list of (document, error) for the operations rejected by MongoDB,
+                document is the inserted document or the filter of the update. Defaults to None.
+        """
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.flush_first = flush_first
+        self.metrics = metrics
+        self.name = name
+        self.ordered = ordered
+        self.on_failure = on_failure
+        self._buffer = []  # (operation, document or filter)
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._latencies = deque(maxlen=10000)
+        self.written = 0
+        self.errors = 0
+        self._thread = threading.Thread(
+            target=self._run, name="mongo-bulk-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _add(self, operation, document: dict) -> None:
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._buffer.append((operation, document))
+            full = len(self._buffer) >= self.max_batch
+        # Skipped when a flush is running (e.g. on_failure of the writer flushed first adds to this one from inside
+        # our flush), the operations wait for the next one
+        if full and self._flush_lock.acquire(blocking=False):
+            failures = []
+            try:
+                failures = self._flush()
+            except Exception:
+                # The operations are back in the buffer and the flushing thread retries them, the caller
+                # (e.g. the finish stage of another CV) did nothing wrong and must not see this error
+                pass
+            finally:
+                self._flush_lock.release()
+            self._report(failures)
+
+    def insert_one(self, document: dict) -> None:
+        """
+        Buffers the insertion of a document.
+        """
+        self._add(InsertOne(document), document)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> None:
+        """
+        Buffers the update of a document.
+        """
+        self._add(UpdateOne(filter, update, upsert=upsert), filter)
+
+    def flush(self) -> None:
+        """
+        Sends the buffered operations in a single bulk_write.
+        """
+        with self._flush_lock:
+            failures = self._flush()
+        self._report(failures)
+
+    def _report(self, failures: list) -> None:
+        # Outside of the flush lock, so on_failure can write through another BulkWriter
+        if len(failures) == 0 or self.on_failure is None:
+            return
+        try:
+            self.on_failure(failures)
+        except Exception as e:
+            print(Fore.RED + f"❌ Error al reportar las escrituras fallidas: {e} ❌")
+
+    def _flush(self) -> list:
+        """Runs with the flush lock, returns the (document, error) of the operations rejected by MongoDB."""
+        with self._lock:
+            buffered, self._buffer = self._buffer, []
+            self._oldest = None
+        if len(buffered) == 0:
+            return []
+        # Flushed after taking our operations, so every operation they depend on is already written
+        if self.flush_first is not None:
+            try:
+                self.flush_first.flush()
+            except Exception:
+                with self._lock:
+                    self._buffer = buffered + self._buffer
+                    self._oldest = self._oldest or time.monotonic()
+                raise
+        operations = [operation for operation, _ in buffered]
+        failures = []
+        start = time.perf_counter()
+        try:
+            self.collection.bulk_write(operations, ordered=self.ordered)
+            self.written += len(operations)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            failures = [(buffered[error["index"]][1], error) for error in errors]
+            retried = []
+            if self.ordered and len(errors) > 0:
+                # An ordered write stops at the first error, the operations after it were not attempted
+                retried = buffered[max(error["index"] for error in errors) + 1 :]
+                with self._lock:
+                    self._buffer = retried + self._buffer
+                    self._oldest = self._oldest or time.monotonic()
+            self.errors += len(failures)
+            self.written += len(operations) - len(failures) - len(retried)
+            print(Fore.RED + f"❌ {len(failures)} escrituras fallaron en MongoDB ❌")
+        except Exception as e:
+            # Put the operations back so they are retried in the next flush
+            with self._lock:
+                self._buffer = buffered + self._buffer
+                self._oldest = self._oldest or time.monotonic()
+            print(Fore.RED + f"❌ Error al escribir en MongoDB: {e} ❌")
+            raise
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+            if self.metrics is not None:
+                self.metrics.observe(f"{self.name}_bulk_write", time.perf_counter() - start)
+                self.metrics.add(f"{self.name}_operations", len(operations))
+        return failures
+
+    def _run(self) -> None:
+        while not self._closed.wait(min(self.max_wait, 0.5)):
+            with self._lock:
+                expired = (
+                    self._oldest is not None
+                    and time.monotonic() - self._oldest >= self.max_wait
+                )
+            if expired:
+                try:
+                    self.flush()
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the writer and the latency of its batches.
+        """
+        latencies = sorted(self._latencies)
+        return {
+            "batches": len(latencies),
+            "written": self.written,
+            "errors": self.errors,
+            "pending": len(self._buffer),
+            "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "max_latency": latencies[-1] if latencies else 0.0,
+        }
+
+    def close(self) -> None:
+        """
+        Stops the flushing thread and writes everything left in the buffer.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,274 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import httpx
+
+API_VERSION = "2023-07-31"
+# Error codes of a failed analysis that may succeed if the document is sent again
+TRANSIENT_ANALYSIS_ERRORS = ["InternalServerError", "ServiceUnavailable", "Timeout"]
+
+
+class OCRError(Exception):
+    """
+    Error of Azure for a document, status_code is the HTTP status of the rejection (or 500 when the analysis
+    failed with an internal error of the service), so the retry scheduler can tell transient errors apart.
+    """
+
+    def __init__(self, message: str, status_code: int = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class OCRDispatcher:
+    """
+    Sends documents to the prebuilt-read model of Azure Document Intelligence through its REST API.
+    Documents are submitted as soon as there is room under the in-flight limit, and all the pending
+    operations are polled by a single task with jittered intervals, instead of one blocking poller per
+    document. Works with the service and with the local stand-in of ocr_standin.py.
+    """
+
+    endpoint: str
+    max_in_flight: int
+    poll_interval: float
+
+    def __init__(
+        self,
+        endpoint: str,
+        key: str,
+        max_in_flight: int = 16,
+        poll_interval: float = 1.0,
+        jitter: float = 0.3,
+        timeout: float = 300,
+        max_retries: int = 5,
+        locale: str = "es",
+    ) -> None:
+        """
+        Initializes the OCRDispatcher class, the HTTP client is created on the first request,
+        so it's bound to the event loop that runs the OCR.
+
+        Args:
+            endpoint (str): The endpoint of the Document Intelligence resource.
+            key (str): The key of the resource.
+            max_in_flight (int, optional): Maximum number of documents submitted and not finished. Defaults to 16.
+            poll_interval (float, optional): Seconds between polls of an operation. Defaults to 1.0.
+            jitter (float, optional): Fraction of random variation of the interval, so the polls do not synchronize. Defaults to 0.3.
+            timeout (float, optional): Maximum seconds per document. Defaults to 300.
+            max_retries (int, optional): Retries of a submission rejected by rate limit or a server error. Defaults to 5.
+            locale (str, optional): Locale hint of the documents. Defaults to "es".
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.key = key
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.locale = locale
+        self._client = None
+        self._slots = None
+        self._pending = {}  # operation url -> [future, next poll time, deadline]
+        self._wakeup = None
+        self._poller = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.polls = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=10000)
+
+    def _start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={"Ocp-Apim-Subscription-Key": self.key}, timeout=60
+            )
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._wakeup = asyncio.Event()
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+
+    def _next_poll(self, retry_after: str = None) -> float:
+        interval = self.poll_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if retry_after is not None:
+            try:
+                interval = max(interval, float(retry_after))
+            except ValueError:
+                pass
+        return time.monotonic() + interval
+
+    async def _submit(self, data: bytes) -> str:
+        """Starts the analysis of a document and returns the url of its operation."""
+        url = f"{self.endpoint}/formrecognizer/documentModels/prebuilt-read:analyze"
+        for attempt in range(self.max_retries + 1):
+            response = await self._client.post(
+                url,
+                params={"api-version": API_VERSION, "locale": self.locale},
+                content=data,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            if response.status_code == 202:
+                return response.headers["Operation-Location"]
+            if response.status_code not in [429, 500, 502, 503, 504] or attempt == self.max_retries:
+                raise OCRError(
+                    f"Azure rechazó el documento ({response.status_code}): {response.text[:200]}",
+                    response.status_code,
+                )
+            self.retries += 1
+            delay = min(60, 2**attempt) * random.uniform(0.5, 1.5)
+            try:
+                delay = max(delay, float(response.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+            await asyncio.sleep(delay)
+
+    async def _poll(self, url: str) -> None:
+        entry = self._pending.get(url)
+        if entry is None:
+            return
+        deadline = entry[2]
+        self.polls += 1
+        retry_after = None
+        try:
+            response = await self._client.get(url)
+            retry_after = response.headers.get("Retry-After")
+            if response.status_code in [429, 500, 502, 503, 504]:
+                body = {"status": "running"}
+            else:
+                response.raise_for_status()
+                body = response.json()
+        except Exception as e:
+            # Transient network errors are polled again until the deadline
+            if time.monotonic() >= deadline:
+                self._finish(url, error=e)
+                return
+            body = {"status": "running"}
+        try:
+            status = body.get("status")
+            result = body["analyzeResult"]["content"] if status == "succeeded" else None
+        except (AttributeError, KeyError, TypeError):
+            self._finish(
+                url,
+                error=OCRError(f"Azure devolvió una respuesta inválida: {str(body)[:200]}", 500),
+            )
+            return
+        if status == "succeeded":
+            self._finish(url, result=result)
+        elif status == "failed":
+            error = body.get("error") or {}
+            self._finish(
+                url,
+                error=OCRError(
+                    f"Azure no pudo analizar el documento: {error}",
+                    500 if error.get("code") in TRANSIENT_ANALYSIS_ERRORS else None,
+                ),
+            )
+        elif time.monotonic() >= deadline:
+            self._finish(url, error=TimeoutError(f"El OCR tardó más de {self.timeout}s"))
+        else:
+            entry[1] = self._next_poll(retry_after)
+
+    def _finish(self, url: str, result: str = None, error: Exception = None) -> None:
+        future = self._pending.pop(url)[0]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _poll_loop(self) -> None:
+        """Polls every operation that is due, all of them from this single task."""
+        while True:
+            if len(self._pending) == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            due = [url for url, entry in self._pending.items() if entry[1] <= now]
+            if len(due) > 0:
+                results = await asyncio.gather(
+                    *[self._poll(url) for url in due], return_exceptions=True
+                )
+                # An unexpected error fails its document, the task keeps polling the others
+                for url, result in zip(due, results):
+                    if isinstance(result, Exception) and url in self._pending:
+                        self._finish(url, error=result)
+                continue
+            wait = min(entry[1] for entry in self._pending.values()) - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def analyze(self, data: bytes) -> str:
+        """
+        Extracts the text of a document, waiting for a slot under the in-flight limit.
+
+        Args:
+            data (bytes): The content of the document.
+
+        Returns:
+            str: The extracted text of the document.
+        """
+        self._start()
+        async with self._slots:
+            start = time.perf_counter()
+            self.submitted += 1
+            try:
+                url = await self._submit(data)
+                future = asyncio.get_running_loop().create_future()
+                self._pending[url] = [
+                    future,
+                    self._next_poll(),
+                    time.monotonic() + self.timeout,
+                ]
+                self._wakeup.set()
+                content = await future
+            except Exception:
+                self.failed += 1
+                raise
+            self.completed += 1
+            self._latencies.append(time.perf_counter() - start)
+            return content
+
+    async def analyze_path(self, path: str) -> str:
+        """
+        Extracts the text of a file.
+        """
+        with open(path, "rb") as document:
+            data = document.read()
+        return await self.analyze(data)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the dispatcher and the latency of the documents.
+        """
+        latencies = sorted(self._latencies)
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": len(self._pending),
+            "polls": self.polls,
+            "retries": self.retries,
+            "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p95_latency": (
+                latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+                if latencies
+                else 0.0
+            ),
+        }
+
+    async def close(self) -> None:
+        """
+        Stops the poller and closes the HTTP client.
+        """
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,191 @@
+"""
+Local stand-in of the prebuilt-read model of Azure Document Intelligence, to test and benchmark the OCR
+without the service. It implements the same REST calls used by OCRDispatcher and the Azure SDK:
+a POST that starts the analysis and returns its Operation-Location, and a GET that reports the status.
+Each analysis takes a random time, and the stand-in answers 429 when too many analyses are running.
+
+Usage:
+    python ocr_standin.py --port 8765 --latency 3
+    python ocr_standin.py --benchmark 200 --in-flight 16
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: dict = None, headers: dict = None) -> None:
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        standin = self.server.standin
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.split("?")[0].endswith(":analyze"):
+            return self._reply(404, {"error": {"code": "NotFound"}})
+        operation = standin.start(data)
+        if operation is None:
+            return self._reply(
+                429, {"error": {"code": "429", "message": "Rate limit"}}, {"Retry-After": "1"}
+            )
+        host = self.headers.get("Host", f"127.0.0.1:{standin.port}")
+        location = f"http://{host}/formrecognizer/documentModels/prebuilt-read/analyzeResults/{operation}?api-version=2023-07-31"
+        self._reply(202, None, {"Operation-Location": location, "apim-request-id": operation})
+
+    def do_GET(self) -> None:
+        match = re.search(r"/analyzeResults/([^?]+)", self.path)
+        status = self.server.standin.status(match.group(1)) if match else None
+        if status is None:
+            return self._reply(404, {"error": {"code": "NotFound"}})
+        self._reply(200, status, {"Retry-After": "1"} if status["status"] == "running" else None)
+
+
+class OCRStandIn:
+    """
+    HTTP server that behaves like the prebuilt-read model. The text returned is the content of the document
+    decoded as UTF-8 when it's text (e.g. the synthetic CVs of the benchmarks), or a fixed text otherwise.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 3.0,
+        jitter: float = 0.5,
+        max_running: int = 64,
+        fail_rate: float = 0.0,
+    ) -> None:
+        """
+        Initializes the OCRStandIn class and binds the port, the server runs after start is called.
+
+        Args:
+            port (int, optional): Port of the server, 0 picks a free one. Defaults to 0.
+            latency (float, optional): Average seconds of an analysis. Defaults to 3.0.
+            jitter (float, optional): Fraction of random variation of the latency. Defaults to 0.5.
+            max_running (int, optional): Analyses running at the same time before answering 429. Defaults to 64.
+            fail_rate (float, optional): Fraction of the analyses that end with status failed. Defaults to 0.0.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.max_running = max_running
+        self.fail_rate = fail_rate
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+        self.rejected = 0
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.port}/"
+
+    def _running(self, now: float) -> int:
+        return sum(1 for op in self._operations.values() if op["ready"] > now)
+
+    def start(self, data: bytes):
+        now = time.monotonic()
+        with self._lock:
+            if self._running(now) >= self.max_running:
+                self.rejected += 1
+                return None
+            operation = str(uuid.uuid4())
+            try:
+                content = data.decode("utf-8")
+            except UnicodeDecodeError:
+                content = "Texto extraído por el OCR de prueba"
+            self._operations[operation] = {
+                "ready": now + self.latency * random.uniform(1 - self.jitter, 1 + self.jitter),
+                "failed": random.random() < self.fail_rate,
+                "content": content,
+            }
+            return operation
+
+    def status(self, operation: str):
+        with self._lock:
+            op = self._operations.get(operation)
+            if op is None:
+                return None
+            if op["ready"] > time.monotonic():
+                return {"status": "running"}
+            self._operations.pop(operation)
+        if op["failed"]:
+            return {"status": "failed", "error": {"code": "InternalServerError"}}
+        return {
+            "status": "succeeded",
+            "analyzeResult": {"apiVersion": "2023-07-31", "modelId": "prebuilt-read", "content": op["content"]},
+        }
+
+    def start_background(self) -> "OCRStandIn":
+        """
+        Serves in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+async def _benchmark(standin: OCRStandIn, documents: int, in_flight: int, poll_interval: float) -> dict:
+    from ocr_dispatcher import OCRDispatcher
+
+    dispatcher = OCRDispatcher(
+        standin.endpoint, "stand-in", max_in_flight=in_flight, poll_interval=poll_interval
+    )
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[dispatcher.analyze(f"CV {i}".encode()) for i in range(documents)],
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    await dispatcher.close()
+    stats = dispatcher.stats()
+    stats["errors"] = sum(isinstance(r, Exception) for r in results)
+    stats["documents_per_second"] = documents / elapsed
+    stats["rejected_by_standin"] = standin.rejected
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=3.0)
+    parser.add_argument("--max-running", type=int, default=64)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--benchmark", type=int, default=0, help="Number of documents to send with OCRDispatcher")
+    parser.add_argument("--in-flight", type=int, default=16)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    standin = OCRStandIn(args.port, args.latency, max_running=args.max_running, fail_rate=args.fail_rate)
+    if args.benchmark > 0:
+        standin.start_background()
+        stats = asyncio.run(_benchmark(standin, args.benchmark, args.in_flight, args.poll_interval))
+        print(json.dumps(stats, indent=2))
+        standin.close()
+    else:
+        print(f"OCR de prueba escuchando en {standin.endpoint}")
+        try:
+            standin._server.serve_forever()
+        except KeyboardInterrupt:
+            standin.close()
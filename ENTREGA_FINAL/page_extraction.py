@@ -0,0 +1,270 @@
+import io
+import multiprocessing
+import os
+import signal
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from re import sub
+from time import monotonic
+
+from pypdf import PdfReader, PdfWriter
+from unstructured.partition.pdf import partition_pdf
+
+
+def split_pdf(path: str) -> list:
+    """
+    Splits a PDF file into single page PDFs.
+
+    Args:
+        path (str): The path to the PDF file.
+
+    Returns:
+        list: The bytes of each page, in order.
+    """
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append(buffer.getvalue())
+    return pages
+
+
+# Separates the pages of an extracted text, so the TextCompactor can find their headers and footers
+PAGE_BREAK = "\f"
+
+
+def join_pages(elements: list) -> str:
+    """
+    Joins the text of the elements of unstructured, with a PAGE_BREAK where their page number changes.
+
+    Args:
+        elements (list): The elements of a partition.
+
+    Returns:
+        str: The text of the elements.
+    """
+    pages, number = [[]], None
+    for element in elements:
+        page_number = getattr(element.metadata, "page_number", None)
+        if page_number is not None and number is not None and page_number != number:
+            pages.append([])
+        number = page_number if page_number is not None else number
+        pages[-1].append(element.text)
+    return PAGE_BREAK.join("\n".join(texts) for texts in pages)
+
+
+def _partition_page(page: bytes, strategy: str) -> str:
+    """Runs in the page processes, extracts the text of a single page."""
+    elements = partition_pdf(
+        file=io.BytesIO(page),
+        strategy=strategy,
+        languages=["eng", "spa"],
+        pdf_infer_table_structure=strategy == "hi_res",
+    )
+    return "\n".join([element.text for element in elements])
+
+
+@contextmanager
+def _main_hidden():
+    """
+    Hides the __main__ module while the page processes are started. A forkserver child imports the __main__
+    of its parent, and the script of the flow has no __main__ guard, so it would run the whole flow again.
+    The page processes only need this module.
+    """
+    main = sys.modules["__main__"]
+    saved = {key: main.__dict__[key] for key in ["__file__", "__spec__"] if key in main.__dict__}
+    main.__dict__.pop("__file__", None)
+    main.__spec__ = None
+    try:
+        yield
+    finally:
+        main.__dict__.update(saved)
+
+
+class PageParallelExtractor:
+    """
+    Extracts scanned PDFs page by page in a pool of processes, instead of running hi_res on the whole file
+    in one thread. Each page has a time budget, pages that exceed it are left out, and the extraction can stop
+    once the first pages already have enough text. The text is merged in page order.
+    """
+
+    workers: int
+    page_timeout: float
+    min_chars: int
+    strategy: str
+
+    def __init__(
+        self,
+        workers: int = 4,
+        page_timeout: float = 120,
+        min_chars: int = 0,
+        strategy: str = "hi_res",
+    ) -> None:
+        """
+        Initializes the PageParallelExtractor class, the processes are started by start or on the first extraction.
+
+        Args:
+            workers (int, optional): Number of pages extracted at the same time. Defaults to 4.
+            page_timeout (float, optional): Maximum seconds per page, the slower pages are left out. Defaults to 120.
+            min_chars (int, optional): Stop once the first pages have this many characters, 0 extracts every page. Defaults to 0.
+            strategy (str, optional): Strategy of unstructured for each page, "hi_res" or "ocr_only" (tesseract only). Defaults to "hi_res".
+        """
+        if strategy not in ["hi_res", "ocr_only"]:
+            raise Exception(
+                "La estrategia no es válida. Por favor, especifique 'hi_res' o 'ocr_only'"
+            )
+        self.workers = workers
+        self.page_timeout = page_timeout
+        self.min_chars = min_chars
+        self.strategy = strategy
+        self._pool = None
+        self._leftovers = []
+        self.pages = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.stopped_early = 0
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the configuration, used to key the extraction cache since the text depends on it.
+        """
+        return f"pages-{self.strategy}-{self.min_chars}"
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Not forked, the pool is replaced after a page timeout and by then the process that owns it may
+            # run other threads (e.g. the LibreOfficePool), whose locks a fork would copy
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["page_extraction"])
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+
+    def _submit(self, pool: ProcessPoolExecutor, *args):
+        # The processes are started on demand by the submits
+        with _main_hidden():
+            return pool.submit(_partition_page, *args)
+
+    def start(self) -> None:
+        """
+        Starts the forkserver and the processes, otherwise they are started on the first extraction.
+        """
+        pool = self._get_pool()
+        with _main_hidden():
+            futures = [pool.submit(os.getpid) for _ in range(self.workers)]
+        wait(futures)
+
+    def _reset_pool(self) -> None:
+        """Kills the processes, a page over its budget keeps its process busy until it finishes."""
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            try:
+                os.kill(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, TypeError):
+                pass
+
+    def _finish_leftovers(self) -> None:
+        """Waits for the pages left running by an early stop, so they do not use the budget of the next file."""
+        if len(self._leftovers) == 0:
+            return
+        _, running = wait(self._leftovers, timeout=self.page_timeout)
+        if len(running) > 0:
+            self._reset_pool()
+        self._leftovers = []
+
+    def extract(self, path: str) -> str:
+        """
+        Extracts the text of a PDF file page by page. The pages that fail or exceed their budget are left out
+        and counted in errors and timeouts, so the caller can tell the text is incomplete.
+
+        Args:
+            path (str): The path to the PDF file.
+
+        Returns:
+            str: The text of the pages extracted, in page order.
+
+        Raises:
+            TimeoutError: If no page produced text because they failed or exceeded their budget.
+        """
+        pages = split_pdf(path)
+        failures = self.errors + self.timeouts
+        self._finish_leftovers()
+        pool = self._get_pool()
+        texts = [None] * len(pages)
+        todo = deque(range(len(pages)))
+        pending, started = {}, {}
+
+        def submit() -> None:
+            # Only as many pages as processes are submitted, so each budget starts when the page starts
+            while len(todo) > 0 and len(pending) < self.workers:
+                page = todo.popleft()
+                future = self._submit(pool, pages[page], self.strategy)
+                pending[future] = page
+                started[future] = monotonic()
+
+        submit()
+        while len(pending) > 0:
+            deadline = min(started[f] for f in pending) + self.page_timeout
+            finished, _ = wait(
+                pending, timeout=max(deadline - monotonic(), 0), return_when=FIRST_COMPLETED
+            )
+            for future in finished:
+                page = pending.pop(future)
+                try:
+                    texts[page] = future.result()
+                except Exception as e:
+                    print(f"Error while extracting page {page + 1} of {path}: {e}")
+                    texts[page] = ""
+                    self.errors += 1
+                self.pages += 1
+
+            expired = [f for f in pending if monotonic() - started[f] >= self.page_timeout]
+            if len(expired) > 0:
+                for future in expired:
+                    page = pending.pop(future)
+                    print(f"Page {page + 1} of {path} exceeded {self.page_timeout}s, skipping it.")
+                    texts[page] = ""
+                    self.timeouts += 1
+                # The process of the page is still busy, so the pool is replaced
+                # and the pages that were running in it are submitted again
+                self._reset_pool()
+                pool = self._get_pool()
+                todo.extendleft(sorted(pending.values(), reverse=True))
+                pending.clear()
+
+            if self.min_chars > 0 and (len(todo) > 0 or len(pending) > 0):
+                # Text of the first consecutive pages already extracted
+                leading = 0
+                for text in texts:
+                    if text is None:
+                        break
+                    leading += len(text)
+                if leading >= self.min_chars:
+                    self._leftovers = list(pending)
+                    pending.clear()
+                    self.stopped_early += 1
+                    break
+            submit()
+
+        if not any(texts) and self.errors + self.timeouts > failures:
+            raise TimeoutError(f"Ninguna página de {path} se pudo extraer")
+        allText = PAGE_BREAK.join(text for text in texts if text)
+        return sub(r"\n+", "\n", allText)
+
+    def close(self) -> None:
+        """
+        Stops the processes.
+        """
+        self._leftovers = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
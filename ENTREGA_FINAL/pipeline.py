@@ -0,0 +1,741 @@
+import asyncio
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bson
+from colorama import Fore
+
+from cryptography_utils import calculate_md5
+from embedding_batcher import PrefetchedEmbeddings
+from extract_features import (
+    embed_certifications,
+    embed_education,
+    embed_works,
+    extract_resume_features,
+    record_texts,
+)
+from extractClass import Extractor, NeedsOCR
+from extraction_cache import ExtractionCache
+from instrumentation import Metrics
+from libreoffice_pool import LibreOfficePool
+from llm_client import chunk_text, merge_chunks
+from page_extraction import PageParallelExtractor
+from record_parser import RecordStream
+from retry_scheduler import (
+    DEAD,
+    FAILED,
+    PENDING,
+    PERMANENT,
+    SKIPPED,
+    TRANSIENT,
+    RetryPolicy,
+    classify_error,
+    dead_letter,
+)
+from text_compaction import TextCompactor, merge_responses
+
+# Extractor of each process of the extraction pool, created by _init_extract_worker
+_extractor = None
+
+
+def _init_extract_worker(
+    overwrite_env: str,
+    cache_dir: str,
+    cache_max_bytes: int,
+    page_options: dict,
+    office_workers: int,
+):
+    global _extractor
+    cache = ExtractionCache(cache_dir, cache_max_bytes) if cache_dir else None
+    page_extractor = None
+    if page_options:
+        page_extractor = PageParallelExtractor(**page_options)
+        # The page processes are started now instead of during the first scanned PDF
+        page_extractor.start()
+    office_pool = None
+    if office_workers > 0:
+        try:
+            office_pool = LibreOfficePool(office_workers)
+            # The processes of the pool do not run atexit, but they do run the finalizers of multiprocessing
+            multiprocessing.util.Finalize(office_pool, office_pool.close, exitpriority=10)
+        except Exception as e:
+            print(Fore.YELLOW + f"⚠️ {e}, se usará un soffice nuevo por archivo ⚠️")
+    _extractor = Extractor(
+        overwrite_env=overwrite_env,
+        cache=cache,
+        defer_ocr=True,
+        page_extractor=page_extractor,
+        office_pool=office_pool,
+    )
+
+
+def start_extract_pool(
+    workers: int,
+    overwrite_env: str = "prod",
+    cache_dir: str = None,
+    cache_max_bytes: int = 1024**3,
+    page_options: dict = None,
+    office_workers: int = 1,
+) -> ProcessPoolExecutor:
+    """
+    Starts the processes of the extraction stage, each one with its own Extractor.
+    The processes are forked, so this function must be called before the main process starts any
+    thread (MongoDB, torch, the embedding batcher), as a fork only copies the calling thread.
+
+    Args:
+        workers (int): Number of processes.
+        overwrite_env (str, optional): Environment of the extractors. Defaults to "prod".
+        cache_dir (str, optional): Directory of the ExtractionCache, None disables it. Defaults to None.
+        cache_max_bytes (int, optional): Maximum size of the ExtractionCache. Defaults to 1 GiB.
+        page_options (dict, optional): Arguments of a PageParallelExtractor, when given the scanned PDFs are extracted
+            locally page by page instead of with Azure (the Word files without text still use Azure). Defaults to None.
+        office_workers (int, optional): LibreOffice workers of each process, each one keeps a soffice running with its own
+            profile. 0 starts a new soffice for every conversion. Defaults to 1.
+
+    Returns:
+        ProcessPoolExecutor: The pool with all its processes running.
+    """
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_extract_worker,
+        initargs=(overwrite_env, cache_dir, cache_max_bytes, page_options, office_workers),
+    )
+    # With fork, the first job launches all the processes at once
+    pool.submit(os.getpid).result()
+    return pool
+
+
+def _extract_job(path: str, current_hash: str = None) -> dict:
+    """
+    Runs in the extraction processes, parses the file locally and flags it when it needs OCR.
+    The hash is only calculated when it was not already calculated by the tracker setup.
+    The seconds of each step are returned in "timings", as the metrics live in the main process.
+    """
+    timings = {}
+    if current_hash is None:
+        start = time.perf_counter()
+        current_hash = calculate_md5(path)
+        timings["md5"] = time.perf_counter() - start
+    if current_hash is False:
+        raise Exception("Failed to calculate MD5")
+    start = time.perf_counter()
+    try:
+        createdAt, allText = _extractor.extract(
+            path, azure=True, return_created_at=True, file_hash=current_hash
+        )
+        result = {"hash": current_hash, "createdAt": createdAt, "text": allText}
+    except NeedsOCR as e:
+        result = {"hash": current_hash, "createdAt": e.created_at, "text": None}
+    timings["extract"] = time.perf_counter() - start
+    result["timings"] = timings
+    result["bytes"] = os.path.getsize(path)
+    return result
+
+
+class Stage:
+    """
+    A step of the pipeline with its own number of workers and a bounded input queue.
+    The handler is a coroutine that receives an item and returns a tuple with the name of
+    the next stage and the item for it, or None when the item does not continue.
+    """
+
+    name: str
+    workers: int
+    maxsize: int
+
+    def __init__(self, name: str, handler, workers: int = 1, maxsize: int = 0) -> None:
+        """
+        Initializes the Stage class.
+
+        Args:
+            name (str): The name of the stage.
+            handler: Coroutine function that processes an item.
+            workers (int, optional): Number of items processed at the same time. Defaults to 1.
+            maxsize (int, optional): Size of the input queue, when it's full the previous stage waits. Defaults to twice the workers.
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize or 2 * workers
+        self.queue = None
+        self.busy = 0.0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+
+    def stats(self, elapsed: float) -> dict:
+        """
+        Returns the counters of the stage. Utilization is the fraction of the time its workers were processing an item.
+        """
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "active": self.active,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "utilization": (
+                self.busy / (elapsed * self.workers) if elapsed > 0 else 0.0
+            ),
+        }
+
+
+class StagedPipeline:
+    """
+    Runs the items through a list of stages linked by bounded queues, every stage in the same event loop.
+    Blocking work is delegated by the handlers to executors, so each stage can use the kind of worker it needs.
+    """
+
+    def __init__(
+        self, stages: list, on_error=None, monitor_interval: float = 0
+    ) -> None:
+        """
+        Initializes the StagedPipeline class.
+
+        Args:
+            stages (list): The stages in the order the items go through them, the items enter through the first one.
+            on_error (optional): Function called with the name of the stage, the item and the exception when a handler fails. Defaults to None.
+            monitor_interval (float, optional): Seconds between each print of the stats of the stages, 0 disables it. Defaults to 0.
+        """
+        self.stages = stages
+        self.on_error = on_error
+        self.monitor_interval = monitor_interval
+        self._by_name = {stage.name: stage for stage in stages}
+        self._start = None
+        # Items inside the pipeline (queued, being processed or waiting to be requeued)
+        self._in_flight = 0
+        self._feeding = False
+        self._idle = None
+        self._retries = set()
+
+    def _done(self) -> None:
+        self._in_flight -= 1
+        if self._in_flight == 0 and not self._feeding:
+            self._idle.set()
+
+    def requeue(self, stage: str, item, delay: float, on_requeue=None) -> None:
+        """
+        Puts an item back in a stage after some seconds, e.g. to retry it after a transient error.
+        It must be called from the event loop of the pipeline, as on_error is.
+
+        Args:
+            stage (str): The name of the stage.
+            item: The item.
+            delay (float): Seconds to wait before the item is queued.
+            on_requeue (optional): Function called with the item right before it's queued. Defaults to None.
+        """
+        self._in_flight += 1
+        task = asyncio.create_task(self._requeue(stage, item, delay, on_requeue))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _requeue(self, stage: str, item, delay: float, on_requeue) -> None:
+        try:
+            await asyncio.sleep(delay)
+            if on_requeue is not None:
+                on_requeue(item)
+            await self._by_name[stage].queue.put(item)
+        except BaseException:
+            self._done()
+            raise
+
+    async def _worker(self, stage: Stage) -> None:
+        while True:
+            item = await stage.queue.get()
+            start = time.perf_counter()
+            stage.active += 1
+            result = None
+            try:
+                result = await stage.handler(item)
+                stage.processed += 1
+            except Exception as e:
+                stage.failed += 1
+                if self.on_error is not None:
+                    try:
+                        self.on_error(stage.name, item, e)
+                    except Exception as error:
+                        print(Fore.RED + f"❌ Error al registrar la falla: {error} ❌")
+            finally:
+                stage.active -= 1
+                stage.busy += time.perf_counter() - start
+            # If the next queue is full the worker waits here, applying backpressure to this stage
+            if result is not None and result[0] is not None:
+                await self._by_name[result[0]].queue.put(result[1])
+            else:
+                self._done()
+            stage.queue.task_done()
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            print(Fore.CYAN + self.format_stats())
+
+    def stats(self) -> list:
+        """
+        Returns the stats of every stage.
+        """
+        elapsed = time.perf_counter() - self._start if self._start else 0.0
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def format_stats(self) -> str:
+        """
+        Returns the stats of every stage as a human readable text.
+        """
+        return "\n".join(
+            "  {stage:<10} {utilization:>6.1%} de uso | {processed} procesados, {failed} fallidos, {active} activos, {queued} en cola".format(
+                **stats
+            )
+            for stats in self.stats()
+        )
+
+    async def run(self, items) -> list:
+        """
+        Processes all the items and waits until every stage is empty.
+
+        Args:
+            items: Iterable or async iterable with the items for the first stage. An async iterable (e.g. a
+                WorkScheduler) keeps discovering items while the stages process the first ones.
+
+        Returns:
+            list: The stats of every stage.
+        """
+        self._start = time.perf_counter()
+        self._idle = asyncio.Event()
+        self._feeding = True
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(maxsize=stage.maxsize)
+        tasks = [
+            asyncio.create_task(self._worker(stage))
+            for stage in self.stages
+            for _ in range(stage.workers)
+        ]
+        if self.monitor_interval > 0:
+            tasks.append(asyncio.create_task(self._monitor()))
+
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                self._in_flight += 1
+                await self.stages[0].queue.put(item)
+        else:
+            for item in items:
+                self._in_flight += 1
+                await self.stages[0].queue.put(item)
+        self._feeding = False
+        # Items can go back to a previous stage when they are retried, so the pipeline is done when
+        # no item is left inside it rather than when each queue is empty
+        if self._in_flight > 0:
+            await self._idle.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats()
+
+
+class CVPipeline:
+    """
+    Pipeline that processes the CVs in four stages, each with its own kind of worker:
+        - extract: A process pool that parses the files locally (unstructured, LibreOffice).
+        - ocr: Async requests to Azure for the files without enough text, polled by a single OCRDispatcher.
+        - llm: Async requests to the extraction chain, with the text compacted and the long CVs split into
+          chunks of sections requested in parallel, whose records are merged. When streaming, the texts of each record are sent to
+          the embedding batcher as soon as the record is complete, while the rest of the response is generated.
+        - finish: Threads that parse the response, embed it through the shared batcher and store the results.
+    A file that fails with a transient error (rate limit, timeout, network) goes back to the stage that failed after
+    an exponential backoff, and one that fails with a permanent error or too many times goes to the dead letter collection.
+    A file without a recorded response in replay mode is skipped and left as it was in the tracker.
+    """
+
+    def __init__(
+        self,
+        chain,
+        embedder,
+        extract_client: Extractor,
+        extract_pool: ProcessPoolExecutor,
+        collection=None,
+        tracker=None,
+        extract_workers: int = 2,
+        ocr_concurrency: int = 4,
+        llm_concurrency: int = 64,
+        finish_workers: int = 4,
+        verbose_tokens: bool = False,
+        upload_mongo: bool = True,
+        monitor_interval: float = 0,
+        stream: bool = False,
+        compactor: TextCompactor = None,
+        metrics: Metrics = None,
+        retry_policy: RetryPolicy = None,
+        dead_letters=None,
+    ) -> None:
+        """
+        Initializes the CVPipeline class.
+
+        Args:
+            chain: The extraction chain, it must expose ainvoke (and astream to stream the responses).
+            embedder: The embeddings model shared by the finish stage, usually an EmbeddingBatcher.
+            extract_client (Extractor): The extractor used by the OCR stage.
+            extract_pool (ProcessPoolExecutor): The extraction processes, created with start_extract_pool.
+            collection (optional): MongoDB collection for the embedded documents. Defaults to None.
+            tracker (optional): MongoDB collection of the tracker. Defaults to None.
+            extract_workers (int, optional): Number of files sent at the same time to the extraction processes. Defaults to 2.
+            ocr_concurrency (int, optional): Number of OCR requests in flight. Defaults to 4.
+            llm_concurrency (int, optional): Number of LLM requests in flight. Defaults to 64.
+            finish_workers (int, optional): Number of threads of the finish stage. Defaults to 4.
+            verbose_tokens (bool, optional): Flag indicating whether to print the cost of each LLM call. Defaults to False.
+            upload_mongo (bool, optional): Flag indicating whether to insert the results in MongoDB. Defaults to True.
+            monitor_interval (float, optional): Seconds between each print of the stats of the stages, 0 disables it. Defaults to 0.
+            stream (bool, optional): Stream the responses of the LLM and embed each record as it arrives. Defaults to False.
+            compactor (TextCompactor, optional): Normalizes the texts and splits the long ones before the LLM, None sends them as they are. Defaults to None.
+            metrics (Metrics, optional): Where the latency of each step is recorded, exported every monitor_interval. Defaults to a new Metrics.
+            retry_policy (RetryPolicy, optional): Attempts and backoff of the files that fail. Defaults to a new RetryPolicy.
+            dead_letters (optional): MongoDB collection where the files that will not be retried are copied. Defaults to None.
+        """
+        self.chain = chain
+        self.stream = stream
+        self.compactor = compactor
+        self.metrics = metrics or Metrics()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.dead_letters = dead_letters
+        self.embedder = embedder
+        self.extract_client = extract_client
+        self.collection = collection
+        self.tracker = tracker
+        self.verbose_tokens = verbose_tokens
+        self.upload_mongo = upload_mongo
+        self._processes = extract_pool
+        self._threads = ThreadPoolExecutor(max_workers=finish_workers)
+        self.pipeline = StagedPipeline(
+            [
+                Stage("extract", self._extract, extract_workers),
+                Stage("ocr", self._ocr, ocr_concurrency),
+                Stage("llm", self._llm, llm_concurrency),
+                Stage("finish", self._finish, finish_workers),
+            ],
+            on_error=self._on_error,
+            monitor_interval=monitor_interval,
+        )
+
+    async def _extract(self, item: dict):
+        loop = asyncio.get_running_loop()
+        # Seconds of each step of the file, stored with its tracker document
+        item["trace"] = {"started_at": time.time()}
+        with self.metrics.track("extract_job", item["trace"]):
+            item.update(
+                await loop.run_in_executor(
+                    self._processes,
+                    _extract_job,
+                    item["path"] + item["file"],
+                    item.get("hash"),
+                )
+            )
+        for step, seconds in item.pop("timings").items():
+            self.metrics.observe(step, seconds, item["trace"])
+        self.metrics.add("files")
+        self.metrics.add("extract_bytes", item["bytes"])
+        if item["text"] is not None:
+            self.metrics.add("extract_chars", len(item["text"]))
+        return ("ocr" if item["text"] is None else "llm"), item
+
+    async def _ocr(self, item: dict):
+        with self.metrics.track("ocr", item["trace"]):
+            item["createdAt"], item["text"] = await self.extract_client.aextract_ocr(
+                item["path"] + item["file"], item["hash"], item["createdAt"]
+            )
+        self.metrics.add("ocr_files")
+        self.metrics.add("extract_chars", len(item["text"]))
+        return "llm", item
+
+    async def _stream_llm(self, item: dict, text: str):
+        """
+        Streams the response of the LLM, sending the texts of each complete record to the embedding batcher.
+        The finish stage then embeds the CV with item["embeddings"], which already has those vectors requested.
+        """
+        prefetch = hasattr(self.embedder, "submit")
+        if prefetch:
+            item["embeddings"] = PrefetchedEmbeddings(self.embedder)
+        records = RecordStream()
+        chunks = []
+        try:
+            async for chunk in self.chain.astream({"text": text}):
+                chunks.append(chunk)
+                for record in records.feed(chunk_text(chunk)):
+                    if prefetch:
+                        item["embeddings"].prefetch(record_texts(record))
+        except Exception:
+            if len(chunks) == 0:
+                raise
+            # The stream broke after part of the response, so it's requested again without streaming
+            return await self.chain.ainvoke({"text": text})
+        for record in records.close():
+            if prefetch:
+                item["embeddings"].prefetch(record_texts(record))
+        return merge_chunks(chunks)
+
+    async def _llm(self, item: dict):
+        text, chunks = item["text"], None
+        if self.compactor is not None:
+            with self.metrics.track("compact", item["trace"]):
+                text = self.compactor.compact(text)
+                chunks = self.compactor.split(text)
+        with self.metrics.track("llm", item["trace"]):
+            if chunks is not None and len(chunks) > 1:
+                # Each chunk is a separate request, so a long CV does not run out of output tokens
+                output = merge_responses(
+                    await asyncio.gather(
+                        *[self.chain.ainvoke({"text": chunk}) for chunk in chunks]
+                    )
+                )
+            elif self.stream:
+                output = await self._stream_llm(item, text)
+            else:
+                output = await self.chain.ainvoke({"text": text})
+        usage = output.response_metadata.get("usage", {})
+        self.metrics.add("llm_input_tokens", usage.get("input_tokens", 0))
+        self.metrics.add("llm_output_tokens", usage.get("output_tokens", 0))
+        if self.verbose_tokens:
+            tokens = output.response_metadata["usage"]
+            lectura = 0.25 / 1000000 * 17.05 * tokens["input_tokens"]
+            escritura = 1.25 / 1000000 * 17.05 * tokens["output_tokens"]
+            print(
+                "Costo de lectura: ${} ({} tokens) \nCosto de escritura ${} ({} tokens)\nTotal ${}".format(
+                    lectura,
+                    tokens["input_tokens"],
+                    escritura,
+                    tokens["output_tokens"],
+                    lectura + escritura,
+                )
+            )
+        item["output"] = output
+        return "finish", item
+
+    async def _finish(self, item: dict):
+        loop = asyncio.get_running_loop()
+        with self.metrics.track("finish", item["trace"]):
+            await loop.run_in_executor(self._threads, self.finish_cv, item)
+        return None
+
+    def finish_cv(self, item: dict) -> None:
+        """
+        Parses the response of the LLM, embeds the results and stores them in the bsons folder and MongoDB.
+
+        Args:
+            item (dict): The CV, with the keys "path", "file", "hash", "createdAt", "output" and optionally "embeddings".
+        """
+        path, file, current_hash = item["path"], item["file"], item["hash"]
+        embedder = item.get("embeddings", self.embedder)
+        trace = item.get("trace", {})
+        with self.metrics.track("parse", trace):
+            (
+                work,
+                education,
+                certification,
+                expYears,
+                expYearsManagement,
+                avgTimeInJob,
+            ) = extract_resume_features(item["output"].content, item["createdAt"])
+
+        with self.metrics.track("embed", trace):
+            embedded_work = embed_works(work, embedder)
+            embedded_cert = embed_certifications(certification, embedder)
+            embedded_edu = embed_education(education, embedder)
+
+        datos = {
+            "file": f"{file}//{current_hash}",
+            "work": work,
+            "education": education,
+            "certification": certification,
+            "label": path,
+        }
+        # Escribir el BSON a un archivo
+        with self.metrics.track("bson", trace):
+            encoded = bson.encode(datos)
+            with open(f"bsons/{file}.bson", "wb") as archivo:
+                archivo.write(encoded)
+        self.metrics.add("bson_bytes", len(encoded))
+
+        if self.upload_mongo:
+            with self.metrics.track("mongo", trace):
+                self.collection.insert_one(
+                    {
+                        "file": f"{file}//{current_hash}",
+                        "expYears": expYears,
+                        "expYearsManagement": expYearsManagement,
+                        "avgTimeInJob": avgTimeInJob,
+                        "highestEducation": embedded_edu["maxEducationLevel"],
+                        "work": embedded_work,
+                        "certification": embedded_cert,
+                        "bachelor": (
+                            embedded_edu["bachelor"] if "bachelor" in embedded_edu else None
+                        ),
+                        "maxEducation": (
+                            embedded_edu["maxEducation"]
+                            if "maxEducation" in embedded_edu
+                            else None
+                        ),
+                        "label": path,
+                    }
+                )
+            # Skipped if its document was already rejected by MongoDB (see on_write_failure), every attempt
+            # starts as pending
+            self.tracker.update_one(
+                {"hash": current_hash, "status": {"$ne": FAILED}},
+                {"$set": {"status": "processed", "trace": self._trace(trace)}},
+            )
+        print(Fore.GREEN + f"✅ {file} se procesó correctamente. ✅")
+
+    def _on_error(self, stage: str, item: dict, e: Exception) -> None:
+        file = item["file"]
+        if str(e) == "Failed to calculate MD5":
+            print(Fore.YELLOW + f"⚠️ El archivo {file} ya no se encuentra disponible ⚠️")
+            return
+        kind = classify_error(e)
+        attempts = item.get("attempts", 1)
+        self.metrics.add(f"{kind}_errors")
+        if kind == SKIPPED:
+            # Nothing was attempted, so the tracker keeps the file as it was
+            print(Fore.YELLOW + f"⚠️ Se omitió {file} ({stage}): {e} ⚠️")
+            return
+        if self.tracker is None or "hash" not in item:
+            print(Fore.RED + f"❌ Error al procesar {file} ({stage}) ❌")
+            return
+        trace = self._trace(item.get("trace", {}), stage)
+        update = {"error": str(e), "last_error_class": type(e).__name__, "trace": trace}
+        if kind == TRANSIENT and attempts < self.retry_policy.max_attempts:
+            delay = self.retry_policy.delay(attempts)
+            update.update({"status": FAILED, "next_attempt_at": time.time() + delay})
+            self._write(self.tracker.update_one, {"hash": item["hash"]}, {"$set": update})
+            if delay <= self.retry_policy.requeue_max_delay:
+                print(
+                    Fore.YELLOW
+                    + f"⚠️ Error temporal al procesar {file} ({stage}), se reintentará en {delay:.0f}s ⚠️"
+                )
+                self.metrics.add("retries")
+                self.pipeline.requeue(stage, item, delay, self._retry)
+            else:
+                print(
+                    Fore.YELLOW
+                    + f"⚠️ Error temporal al procesar {file} ({stage}), se reintentará en la siguiente ejecución ⚠️"
+                )
+            return
+
+        print(Fore.RED + f"❌ Error al procesar {file} ({stage}), se movió a dead letters ❌")
+        update["status"] = DEAD
+        self._write(self.tracker.update_one, {"hash": item["hash"]}, {"$set": update})
+        if self.dead_letters is not None:
+            self._write(
+                self.dead_letters.insert_one,
+                dead_letter(
+                    {
+                        "hash": item["hash"],
+                        "directory": os.path.basename(item["path"].rstrip("/")),
+                        "filename": file,
+                        "attempts": attempts,
+                        "trace": trace,
+                    },
+                    str(e),
+                    type(e).__name__,
+                    PERMANENT if kind == PERMANENT else "max_attempts",
+                ),
+            )
+
+    def _write(self, operation, *args) -> None:
+        """
+        Runs a write of the tracker or the dead letters in the threads of the finish stage, as it may flush a
+        BulkWriter (a blocking bulk_write) and _on_error and _retry run in the event loop.
+        """
+
+        def write():
+            try:
+                operation(*args)
+            except Exception as e:
+                print(Fore.RED + f"❌ Error al registrar la falla: {e} ❌")
+
+        self._threads.submit(write)
+
+    def on_write_failure(self, failures: list) -> None:
+        """
+        Marks as failed the CVs whose document was rejected by MongoDB, instead of processed. Meant to be the
+        on_failure of the BulkWriter of the documents, with an ordered tracker writer: this update is applied after
+        a processed one already queued, and a processed one queued later does not match a failed file.
+
+        Args:
+            failures (list): The (document, error) of each rejected insertion.
+        """
+        for document, error in failures:
+            if self.tracker is None or "//" not in document.get("file", ""):
+                continue
+            file, current_hash = document["file"].rsplit("//", 1)
+            print(Fore.RED + f"❌ No se pudo guardar {file} en MongoDB, se reintentará ❌")
+            self.metrics.add("mongo_write_failures")
+            self.tracker.update_one(
+                {"hash": current_hash},
+                {
+                    "$set": {
+                        "status": FAILED,
+                        "error": error.get("errmsg", str(error)),
+                        "last_error_class": "BulkWriteError",
+                        "next_attempt_at": time.time() + self.retry_policy.delay(1),
+                    }
+                },
+            )
+
+    def _retry(self, item: dict) -> None:
+        """Records a new attempt of a file right before it goes back to the pipeline."""
+        item["attempts"] = item.get("attempts", 1) + 1
+        self._write(
+            self.tracker.update_one,
+            {"hash": item["hash"]},
+            {"$set": {"status": PENDING}, "$inc": {"attempts": 1}},
+        )
+
+    @staticmethod
+    def _trace(trace: dict, failed_stage: str = None) -> dict:
+        """Returns the trace of a file to store in the tracker, with its total seconds."""
+        trace = dict(trace)
+        if "started_at" in trace:
+            trace["total"] = time.time() - trace["started_at"]
+        if failed_stage is not None:
+            trace["failed_stage"] = failed_stage
+        return trace
+
+    def run(self, items) -> list:
+        """
+        Processes the CVs and shuts down the workers of the pipeline.
+
+        Args:
+            items: Iterable or async iterable of dictionaries with the keys "path" (folder ending with /), "file" and
+                optionally "hash" and "attempts".
+
+        Returns:
+            list: The stats of every stage.
+        """
+        try:
+            with self.metrics.track("pipeline"):
+                return asyncio.run(self._run(items))
+        finally:
+            self._processes.shutdown()
+            self._threads.shutdown()
+            self.metrics.export()
+
+    async def _export_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.pipeline.monitor_interval)
+            try:
+                self.metrics.export()
+            except Exception as e:
+                print(Fore.YELLOW + f"⚠️ No se pudieron exportar las métricas: {e} ⚠️")
+
+    async def _run(self, items) -> list:
+        exporter = None
+        if self.pipeline.monitor_interval > 0:
+            exporter = asyncio.create_task(self._export_metrics())
+        try:
+            return await self.pipeline.run(items)
+        finally:
+            if exporter is not None:
+                exporter.cancel()
+                await asyncio.gather(exporter, return_exceptions=True)
+            await self.extract_client.aclose()
@@ -0,0 +1,177 @@
+from datetime import datetime
+from functools import lru_cache
+from re import compile
+
+from dateutil.parser import parse as dateParse
+
+# Fields of the template of the prompt, in the order the LLM writes them
+FIELDS = [
+    ("Type:", "type"),
+    ("Management:", "management"),
+    ("Title:", "title"),
+    ("Institution:", "institution"),
+    ("Start Date:", "start"),
+    ("End Date:", "end"),
+    ("Brief:", "brief"),
+]
+OPTIONAL_FIELDS = {"management", "end", "brief"}
+
+_LEADING = compile(r"\W*")
+_MONTH_YEAR = compile(r"([A-Za-z]+),?\s+([12]\d{3})")
+_YEAR = compile(r"[12]\d{3}")
+# Month names known by dateutil, the Spanish ones are not, so they can't take the fast path
+_MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [
+            ["jan", "january"],
+            ["feb", "february"],
+            ["mar", "march"],
+            ["apr", "april"],
+            ["may"],
+            ["jun", "june"],
+            ["jul", "july"],
+            ["aug", "august"],
+            ["sep", "sept", "september"],
+            ["oct", "october"],
+            ["nov", "november"],
+            ["dec", "december"],
+        ],
+        start=1,
+    )
+    for name in names
+}
+
+
+def _field_value(line: str, prefix: str):
+    """Returns the value of a line of the template, None if the regex would take it from the next line."""
+    rest = line[len(prefix) :]
+    value = rest[_LEADING.match(rest).end() :]
+    if value == "":
+        return None
+    return value
+
+
+def parse_records(outs: str):
+    """
+    Splits the output of the LLM into the records of the template, reading it line by line.
+
+    It returns the same fields as regexPattern of extract_features, but only for outputs written exactly
+    as the template asks (one field per line, in order). When the output has anything else the regex
+    could read differently (a "Type:" in the middle of a line, a field with an empty value, a record that
+    ends the text without a newline, a missing field...), it returns None and the regex must be used.
+
+    Args:
+        outs (str): The output of the LLM.
+
+    Returns:
+        list: A list of dictionaries with the raw fields of each record, None if the output is not regular.
+    """
+    lines = outs.split("\n")
+    if outs.count("Type:") != sum(line.startswith("Type:") for line in lines):
+        return None
+    records = []
+    i, n = 0, len(lines)
+    while i < n:
+        if not lines[i].startswith("Type:"):
+            i += 1
+            continue
+        record = {}
+        for prefix, name in FIELDS:
+            if i < n and lines[i].startswith(prefix):
+                value = _field_value(lines[i], prefix)
+                if value is None:
+                    return None
+                record[name] = value
+                i += 1
+            elif name in OPTIONAL_FIELDS:
+                record[name] = None
+            else:
+                return None
+            if name == "end" and i == n:
+                # The regex needs a character after the dates
+                return None
+        records.append(record)
+    return records
+
+
+def dateutil_date(text: str) -> tuple:
+    """
+    Parses a date with dateutil, as the fields of the template were always parsed.
+
+    Args:
+        text (str): The date written by the LLM.
+
+    Returns:
+        tuple: The date (with January 1st of year 1 as default) and whether the text mentions "present".
+    """
+    date, tokens = dateParse(
+        text, default=datetime(1, 1, 1), fuzzy=True, fuzzy_with_tokens=True
+    )
+    return date, any("present" in token.lower() for token in tokens)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text: str) -> tuple:
+    """
+    Memoized dateutil_date, with a fast path for the formats the LLM usually writes
+    ("January, 2020", "Jan 2020", "2020"). The rest goes through dateutil.
+
+    Args:
+        text (str): The date written by the LLM.
+
+    Returns:
+        tuple: The date (with January 1st of year 1 as default) and whether the text mentions "present".
+    """
+    stripped = text.strip()
+    match = _MONTH_YEAR.fullmatch(stripped)
+    if match is not None and match.group(1).lower() in _MONTHS:
+        return datetime(int(match.group(2)), _MONTHS[match.group(1).lower()], 1), False
+    if _YEAR.fullmatch(stripped) is not None:
+        return datetime(int(stripped), 1, 1), False
+    return dateutil_date(text)
+
+
+class RecordStream:
+    """
+    Splits the output of the LLM into the text of each record while it's being generated. A record is
+    complete when the next one starts (a line starting with "Type:") or when the output ends.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._record = []
+
+    def feed(self, text: str) -> list:
+        """
+        Adds a piece of the output.
+
+        Args:
+            text (str): The text of the new chunk.
+
+        Returns:
+            list: The text of the records completed by the chunk.
+        """
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        records = []
+        for line in lines:
+            if line.startswith("Type:") and len(self._record) > 0:
+                records.append("\n".join(self._record) + "\n")
+                self._record = []
+            if line.startswith("Type:") or len(self._record) > 0:
+                self._record.append(line)
+        return records
+
+    def close(self) -> list:
+        """
+        Ends the output.
+
+        Returns:
+            list: The text of the records still open.
+        """
+        records = self.feed("\n")
+        if len(self._record) > 0:
+            records.append("\n".join(self._record) + "\n")
+            self._record = []
+        return records
@@ -0,0 +1,186 @@
+import os
+import random
+import subprocess
+import time
+
+import anthropic
+import httpx
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from pymongo.errors import AutoReconnect, NetworkTimeout
+
+from embedding_server import EmbeddingServerError
+from llm_cache import LLMReplayMiss
+from llm_client import RETRYABLE_STATUS
+
+# States of a file in the tracker:
+#   pending   -> scheduled in the current run, or left by a run that crashed
+#   failed    -> the last attempt raised a transient error, retried after next_attempt_at
+#   processed -> stored in MongoDB
+#   dead      -> permanent error or too many attempts, copied to the dead letter collection
+PENDING, FAILED, PROCESSED, DEAD = "pending", "failed", "processed", "dead"
+# Errors of a file: transient ones are retried, permanent ones go to the dead letters and skipped ones
+# (e.g. a response never recorded in replay mode) leave the file as it was
+TRANSIENT, PERMANENT, SKIPPED = "transient", "permanent", "skipped"
+
+# Rate limits, timeouts and network errors of Anthropic, Azure, MongoDB, LibreOffice and the embeddings server
+_TRANSIENT_TYPES = (
+    TimeoutError,
+    ConnectionError,
+    subprocess.TimeoutExpired,
+    anthropic.APIConnectionError,
+    anthropic.APITimeoutError,
+    httpx.TransportError,
+    ServiceRequestError,
+    ServiceResponseError,
+    AutoReconnect,
+    NetworkTimeout,
+    EmbeddingServerError,
+)
+# Extensions converted with LibreOffice before the extraction, the Extractor only handles .pdf, .docx and .doc
+OFFICE_EXTENSIONS = [".doc"]
+
+
+def classify_error(e: Exception) -> str:
+    """
+    Tells whether an error of the flow may go away by trying again later.
+
+    Args:
+        e (Exception): The error raised while processing a file.
+
+    Returns:
+        str: TRANSIENT for rate limits, timeouts and network errors, SKIPPED when the file was not attempted
+            (a replay without its recorded response) and PERMANENT otherwise.
+    """
+    if isinstance(e, LLMReplayMiss):
+        return SKIPPED
+    if isinstance(e, _TRANSIENT_TYPES):
+        return TRANSIENT
+    if getattr(e, "status_code", None) in RETRYABLE_STATUS:
+        return TRANSIENT
+    return PERMANENT
+
+
+class RetryPolicy:
+    """
+    Exponential backoff of the files that failed with a transient error. A retry whose delay is short enough is
+    requeued in the same run, the rest wait in the tracker until a later run finds them eligible.
+    """
+
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+    requeue_max_delay: float
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 30,
+        max_delay: float = 3600,
+        requeue_max_delay: float = 300,
+    ) -> None:
+        """
+        Initializes the RetryPolicy class.
+
+        Args:
+            max_attempts (int, optional): Attempts of a file before it goes to the dead letter collection. Defaults to 5.
+            base_delay (float, optional): Seconds before the first retry, doubled in each attempt. Defaults to 30.
+            max_delay (float, optional): Maximum seconds between two attempts. Defaults to 3600.
+            requeue_max_delay (float, optional): Retries with a longer delay are left for the next run. Defaults to 300.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requeue_max_delay = requeue_max_delay
+
+    def delay(self, attempts: int) -> float:
+        """
+        Returns the seconds to wait after the given number of failed attempts, with jitter so the files that
+        failed together (e.g. by the same rate limit) are not retried together.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def plan(self, document: dict, now: float = None) -> str:
+        """
+        Decides what to do with a file found in the tracker at the start of a run.
+
+        Args:
+            document (dict): The tracker document of the file.
+            now (float, optional): The current time. Defaults to time.time().
+
+        Returns:
+            str: "run" to schedule it, "wait" when its backoff has not finished, "dead" when it used all its
+                attempts (e.g. it was pending in every run that crashed) and "skip" when it's processed or dead.
+        """
+        now = time.time() if now is None else now
+        status = document.get("status")
+        if status not in [PENDING, FAILED]:
+            return "skip"
+        if document.get("attempts", 0) >= self.max_attempts:
+            return "dead"
+        if status == FAILED and document.get("next_attempt_at", 0) > now:
+            return "wait"
+        return "run"
+
+
+def estimated_cost(path: str, document: dict = None) -> int:
+    """
+    Returns a rough rank of the cost of a file: 0 for the .pdf and .docx files, 1 for the .doc files, converted
+    with LibreOffice, and 2 for the files whose last attempt went through the OCR stage. A scanned PDF can't be
+    told apart by its name, so it's only ranked as OCR once a previous attempt found it.
+
+    Args:
+        path (str): The path of the file.
+        document (dict, optional): Its tracker document, if it has one. Defaults to None.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if "ocr" in (document or {}).get("trace", {}):
+        return 2
+    if extension in OFFICE_EXTENSIONS:
+        return 1
+    return 0
+
+
+def schedule_order(items: list) -> list:
+    """
+    Sorts the files of a run: first the ones in their first attempt, then the retries, so a flaky service
+    does not stall the batch. Inside each group the most expensive files go first (OCR, then LibreOffice,
+    then the largest ones), so the slowest files do not start last and leave the workers idle at the end.
+
+    Args:
+        items (list): Dictionaries with the keys "path", "file" and optionally "attempts", "cost" and "size".
+
+    Returns:
+        list: The items in the order they should be processed.
+    """
+    return sorted(
+        items,
+        key=lambda item: (
+            item.get("attempts", 1) > 1,
+            -item.get("cost", 0),
+            -item.get("size", 0),
+        ),
+    )
+
+
+def dead_letter(document: dict, error: str, error_class: str, reason: str) -> dict:
+    """
+    Returns the document stored in the dead letter collection for a file that will not be retried.
+
+    Args:
+        document (dict): The tracker fields of the file (hash, directory, filename, attempts, trace).
+        error (str): The last error.
+        error_class (str): The class of the last error.
+        reason (str): PERMANENT or "max_attempts".
+    """
+    return {
+        "hash": document["hash"],
+        "directory": document.get("directory"),
+        "filename": document.get("filename"),
+        "attempts": document.get("attempts", 0),
+        "error": error,
+        "error_class": error_class,
+        "reason": reason,
+        "trace": document.get("trace", {}),
+        "failed_at": time.time(),
+    }
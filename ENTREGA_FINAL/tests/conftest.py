@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the flow are not a package, they are imported from the folder of the script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+from batch_features import batch_resume_features
+from extract_features import apply_regex_template, extract_resume_features
+
+# Fixed creation date, so "Present" is resolved to the same date
+CREATED_AT = 1700000000.0
+
+
+def job(title: str, start: str, end: str, management: str = "No") -> str:
+    return (
+        f"Type:Work Experience\nManagement:{management}\nTitle:{title}\nInstitution:ACME\n"
+        f"Start Date:{start}\nEnd Date:{end}\nBrief:NA\n"
+    )
+
+
+EDUCATION = "Type:Education\nTitle:Bachelors Degree\nInstitution:UNAM\nStart Date:2010\nEnd Date:2014\nBrief:NA\n"
+
+CVS = {
+    # Jobs without dates are placed at the epoch, skipped until the first dated job
+    "epoch_start": job("Intern", "NA", "NA") + job("Analyst", "March, 2015", "May, 2017") + job("Clerk", "NA", "NA"),
+    "only_epoch": job("Intern", "NA", "NA"),
+    "fictional_only": job("Analyst", "March, 2015", "NA") + job("Developer", "June, 2018", "NA"),
+    "overlapping": job("Analyst", "January, 2015", "December, 2018") + job("Consultant", "June, 2016", "March, 2020"),
+    "touching": job("Analyst", "January, 2015", "June, 2017") + job("Lead", "June, 2017", "Present", "Yes"),
+    "management_only": job("Manager", "January, 2012", "January, 2016", "Yes")
+    + job("Director", "February, 2016", "Present", "Yes"),
+    "mixed_management": job("Developer", "January, 2010", "December, 2013")
+    + job("Manager", "January, 2014", "Present", "Yes")
+    + job("Mentor", "June, 2015", "June, 2016", "Yes"),
+    "start_present": job("Freelance", "Present", "Present") + job("Analyst", "March, 2015", "May, 2017"),
+    "no_jobs": EDUCATION,
+}
+
+
+@pytest.fixture(params=["UTC", "CST+6"])
+def timezone(request):
+    # With UTC-6 the date of the jobs without dates (December 31st 1969 18:00) has timestamp 0
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = request.param
+    time.tzset()
+    yield request.param
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+def reference(outs: str):
+    try:
+        return tuple(extract_resume_features(outs, CREATED_AT)[3:])
+    except Exception:
+        return None
+
+
+def test_batch_matches_extract_resume_features(timezone):
+    names = sorted(CVS)
+    works = [apply_regex_template(CVS[name], CREATED_AT)[0] for name in names]
+    batch = batch_resume_features(works)
+    for i, name in enumerate(names):
+        expected = reference(CVS[name])
+        if expected is None:
+            assert not batch["valid"][i], name
+            continue
+        assert batch["valid"][i], name
+        assert batch["expYears"][i] == expected[0], name
+        assert batch["expYearsManagement"][i] == expected[1], name
+        assert batch["avgTimeInJob"][i] == expected[2], name
+
+
+def test_cases_cover_the_special_paths(timezone):
+    # fictional_only divides by zero and start_present has a date that is not a datetime
+    assert reference(CVS["fictional_only"]) is None
+    assert reference(CVS["start_present"]) is None
+    assert reference(CVS["no_jobs"]) == (0, 0, 0)
+    if timezone == "CST+6":
+        work = apply_regex_template(CVS["epoch_start"], CREATED_AT)[0]
+        assert work[0]["start"].timestamp() == 0
@@ -0,0 +1,31 @@
+import pytest
+
+from embedding_batcher import EmbeddingBatcher, PrefetchedEmbeddings
+
+
+class FlakyEmbeddings:
+    """Fails the first call, then returns the length of each text as its vector."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def embed_documents(self, texts: list) -> list:
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("El servidor de embeddings no respondió")
+        return [[float(len(text))] for text in texts]
+
+
+def test_failed_prefetch_is_submitted_again():
+    model = FlakyEmbeddings()
+    batcher = EmbeddingBatcher(model, max_wait=0)
+    try:
+        embeddings = PrefetchedEmbeddings(batcher)
+        embeddings.prefetch(["python", "sql"])
+        with pytest.raises(ConnectionError):
+            embeddings.embed_documents(["python", "sql"])
+        # The retry of the CV reuses the same PrefetchedEmbeddings
+        assert embeddings.embed_documents(["python", "sql"]) == [[6.0], [3.0]]
+        assert model.calls == 2
+    finally:
+        batcher.close()
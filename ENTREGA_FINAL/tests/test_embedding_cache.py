@@ -0,0 +1,65 @@
+import multiprocessing
+
+from embedding_cache import CachedEmbeddings
+
+
+class FakeEmbeddings:
+    """Embeds each text as its number followed by its length, so a wrong row is easy to spot."""
+
+    model_name = "fake"
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def embed_documents(self, texts: list) -> list:
+        self.calls += 1
+        return [[float(text.split("-")[1]), float(len(text))] for text in texts]
+
+
+def expected(text: str) -> list:
+    return [float(text.split("-")[1]), float(len(text))]
+
+
+def _fill(cache_dir: str, offset: int, queue) -> None:
+    cache = CachedEmbeddings(FakeEmbeddings(), cache_dir=cache_dir, max_disk_items=300)
+    wrong = 0
+    for start in range(0, 400, 20):
+        texts = [f"texto-{(offset + i) % 500}" for i in range(start, start + 20)]
+        vectors = cache.embed_documents(texts)
+        wrong += sum(vector != expected(text) for text, vector in zip(texts, vectors))
+        # Drop the memory tier so the next reads go to disk
+        cache._memory.clear()
+    cache.close()
+    queue.put(wrong)
+
+
+def test_processes_share_the_disk_tier(tmp_path):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    processes = [
+        context.Process(target=_fill, args=(str(tmp_path), offset, queue)) for offset in [0, 100, 250]
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [queue.get(timeout=5) for _ in processes] == [0, 0, 0]
+
+    cache = CachedEmbeddings(FakeEmbeddings(), cache_dir=str(tmp_path), max_disk_items=300)
+    texts = [f"texto-{i}" for i in range(500)]
+    assert cache.embed_documents(texts) == [expected(text) for text in texts]
+    cache.close()
+
+
+def test_memory_hits_keep_texts_on_disk(tmp_path):
+    model = FakeEmbeddings()
+    cache = CachedEmbeddings(model, cache_dir=str(tmp_path), max_disk_items=10, touch_batch=1)
+    cache.embed_documents(["texto-0"])
+    for i in range(1, 30):
+        # "texto-0" is only hit in memory, like "NA" in the flow
+        cache.embed_documents(["texto-0", f"texto-{i}"])
+    cache._memory.clear()
+    calls = model.calls
+    assert cache.embed_documents(["texto-0"]) == [expected("texto-0")]
+    assert model.calls == calls
+    cache.close()
@@ -0,0 +1,85 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from libreoffice_pool import LibreOfficePool
+
+# Stands in for the Python of LibreOffice running unoserver: it serves the same XML-RPC API, copies the file
+# instead of converting it, and crashes or hangs on the files with those names
+SERVER = """#!{python}
+import os, shutil, sys, time
+from xmlrpc.server import SimpleXMLRPCServer
+
+if sys.argv[1] == "-c":
+    sys.exit(0)
+port = int(sys.argv[sys.argv.index("--port") + 1])
+with open(os.path.join(os.path.dirname(sys.argv[0]), "starts"), "a") as f:
+    f.write("x")
+server = SimpleXMLRPCServer(("127.0.0.1", port), allow_none=True, logRequests=False)
+info = {{"api": "3", "unoserver": "3.7", "import_filters": {{}}, "export_filters": {{"MS Word 2007 XML": ""}}}}
+server.register_function(lambda: info, "info")
+
+def convert(inpath, indata, outpath, *args):
+    name = os.path.basename(inpath)
+    if name == "crash.doc":
+        os._exit(1)
+    if name == "hang.doc":
+        time.sleep(60)
+    if name == "broken.doc":
+        raise RuntimeError("could not load the file")
+    shutil.copy(inpath, outpath)
+
+server.register_function(convert, "convert")
+server.serve_forever()
+"""
+
+
+@pytest.fixture
+def pool(tmp_path):
+    python = tmp_path / "python"
+    python.write_text(SERVER.format(python=sys.executable))
+    python.chmod(python.stat().st_mode | stat.S_IEXEC)
+    pool = LibreOfficePool(1, timeout=2, start_timeout=10, binary="true", python=str(python))
+    yield pool
+    pool.close()
+
+
+def starts(tmp_path) -> int:
+    return len((tmp_path / "starts").read_text())
+
+
+def document(tmp_path, name: str) -> str:
+    path = tmp_path / name
+    path.write_text("Juan Pérez")
+    return str(path)
+
+
+def test_conversions_share_one_soffice(pool, tmp_path):
+    for name in ["a.doc", "b.doc", "c.doc"]:
+        output = pool.convert(document(tmp_path, name), "docx:MS Word 2007 XML", str(tmp_path / "out"))
+        assert output == str(tmp_path / "out" / name.replace(".doc", ".docx"))
+        assert os.path.exists(output)
+    assert starts(tmp_path) == 1
+    assert pool.stats()["converted"] == 3
+
+
+def test_broken_file_fails_without_restart(pool, tmp_path):
+    with pytest.raises(Exception):
+        pool.convert(document(tmp_path, "broken.doc"), "pdf", str(tmp_path / "out"))
+    assert pool.convert(document(tmp_path, "a.doc"), "pdf", str(tmp_path / "out"))
+    assert starts(tmp_path) == 1
+    assert pool.stats()["restarts"] == 0
+
+
+@pytest.mark.parametrize("name", ["crash.doc", "hang.doc"])
+def test_dead_or_hung_soffice_is_restarted(pool, tmp_path, name):
+    with pytest.raises(Exception) as error:
+        pool.convert(document(tmp_path, name), "pdf", str(tmp_path / "out"))
+    if name == "hang.doc":
+        assert isinstance(error.value, TimeoutError)
+    # Retried once on a new soffice before failing, the next file gets another one
+    assert pool.convert(document(tmp_path, "a.doc"), "pdf", str(tmp_path / "out"))
+    assert starts(tmp_path) == 3
+    assert pool.stats() == {"converted": 1, "failed": 1, "restarts": 2, "queue_depth": 0}
@@ -0,0 +1,57 @@
+import mongomock
+
+from mongo_writer import BulkWriter
+
+
+def writers():
+    database = mongomock.MongoClient().db
+    database.documents.create_index("file", unique=True)
+    documents = BulkWriter(database.documents, max_batch=2, max_wait=60)
+    tracker = BulkWriter(
+        database.tracker, max_batch=2, max_wait=60, flush_first=documents, ordered=True
+    )
+
+    def on_failure(failures):
+        for document, error in failures:
+            tracker.update_one({"hash": document["file"]}, {"$set": {"status": "failed"}})
+
+    documents.on_failure = on_failure
+    return database, documents, tracker
+
+
+def process(documents, tracker, file: str) -> None:
+    documents.insert_one({"file": file})
+    # Like the finish stage of CVPipeline
+    tracker.update_one({"hash": file, "status": {"$ne": "failed"}}, {"$set": {"status": "processed"}})
+
+
+def test_rejected_document_is_not_left_processed():
+    # With max_batch=2 the rejection of "b" is reported before its tracker update is queued
+    database, documents, tracker = writers()
+    for file in ["a", "b"]:
+        database.tracker.insert_one({"hash": file, "status": "pending"})
+    database.documents.insert_one({"file": "b"})  # A previous document with the same unique key
+
+    process(documents, tracker, "a")
+    process(documents, tracker, "b")
+    tracker.close()
+    documents.close()
+
+    status = {document["hash"]: document["status"] for document in database.tracker.find()}
+    assert status == {"a": "processed", "b": "failed"}
+    assert documents.stats()["errors"] == 1
+    assert documents.stats()["pending"] == 0
+
+
+def test_rejection_after_the_tracker_update_is_queued():
+    database, documents, tracker = writers()
+    documents.max_batch = 10
+    database.tracker.insert_one({"hash": "b", "status": "pending"})
+    database.documents.insert_one({"file": "b"})
+
+    process(documents, tracker, "b")
+    # The tracker flushes the documents first, the failure is written after its processed update
+    tracker.flush()
+    tracker.flush()
+
+    assert database.tracker.find_one({"hash": "b"})["status"] == "failed"
@@ -0,0 +1,43 @@
+import asyncio
+
+import httpx
+import pytest
+
+from ocr_dispatcher import OCRDispatcher, OCRError
+
+OPERATION = "http://ocr.test/operations/1"
+
+
+def transport(result: dict) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            return httpx.Response(202, headers={"Operation-Location": OPERATION})
+        return httpx.Response(200, json=result)
+
+    return httpx.MockTransport(handler)
+
+
+def analyze(dispatcher: OCRDispatcher, result: dict) -> str:
+    async def run() -> str:
+        dispatcher._client = httpx.AsyncClient(transport=transport(result))
+        dispatcher._slots = asyncio.Semaphore(dispatcher.max_in_flight)
+        dispatcher._wakeup = asyncio.Event()
+        try:
+            return await asyncio.wait_for(dispatcher.analyze(b"%PDF"), timeout=5)
+        finally:
+            await dispatcher.close()
+
+    return asyncio.run(run())
+
+
+def test_succeeded_response():
+    dispatcher = OCRDispatcher("http://ocr.test", "key", poll_interval=0.01)
+    result = {"status": "succeeded", "analyzeResult": {"content": "Juan Pérez"}}
+    assert analyze(dispatcher, result) == "Juan Pérez"
+
+
+def test_malformed_response_fails_the_document():
+    dispatcher = OCRDispatcher("http://ocr.test", "key", poll_interval=0.01)
+    with pytest.raises(OCRError):
+        analyze(dispatcher, {"status": "succeeded"})
+    assert dispatcher.failed == 1
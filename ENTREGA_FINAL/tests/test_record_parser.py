@@ -0,0 +1,33 @@
+import json
+import os
+
+import pytest
+
+from extract_features import apply_regex_template
+from record_parser import parse_records
+
+# Fixed creation date, so both parsers resolve "Present" to the same date
+CREATED_AT = 1700000000.0
+
+with open(os.path.join(os.path.dirname(__file__), "data", "llm_outputs.json"), encoding="utf-8") as f:
+    OUTPUTS = json.load(f)
+
+# Outputs that parse_records must leave to the regex
+FALLBACKS = ["empty_field", "missing_end_date_at_end", "type_mid_line"]
+
+
+@pytest.mark.parametrize("name", sorted(OUTPUTS))
+def test_fast_parser_matches_the_regex(name):
+    outs = OUTPUTS[name]
+    assert apply_regex_template(outs, CREATED_AT, fast=True) == apply_regex_template(
+        outs, CREATED_AT, fast=False
+    )
+
+
+@pytest.mark.parametrize("name", sorted(OUTPUTS))
+def test_irregular_outputs_fall_back_to_the_regex(name):
+    records = parse_records(OUTPUTS[name])
+    if name in FALLBACKS:
+        assert records is None
+    else:
+        assert records is not None and len(records) > 0
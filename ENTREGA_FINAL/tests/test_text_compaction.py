@@ -0,0 +1,66 @@
+from text_compaction import TextCompactor
+
+HEADER = "Juan Pérez - Desarrollador Backend"
+FOOTER = "juan.perez@correo.com | +52 55 1234 5678"
+
+
+def page(*lines: str) -> str:
+    return "\n".join([HEADER, *lines, FOOTER])
+
+
+def test_repeated_titles_are_kept():
+    # One page, so nothing is a header or footer even if it's repeated
+    text = "\n".join(
+        [
+            "EXPERIENCIA",
+            "Desarrollador Backend",
+            "Empresa A",
+            "2021 - Present",
+            "Desarrollador Backend",
+            "Empresa B",
+            "2019 - Present",
+            "Desarrollador Backend",
+            "Empresa C",
+            "2017 - 2019",
+            "Present",
+            "Proyecto X",
+            "Present",
+            "Proyecto Y",
+            "Present",
+        ]
+    )
+    compacted = TextCompactor().compact(text).split("\n")
+    assert compacted.count("Desarrollador Backend") == 3
+    assert compacted.count("Present") == 3
+
+
+def test_headers_and_footers_are_dropped_only_at_page_edges():
+    text = "\f".join(
+        [
+            page("EXPERIENCIA", "Desarrollador Backend", "Empresa A", "2021 - 2023"),
+            page("Desarrollador Backend", "Empresa B", "2019 - 2021", "Present"),
+            page("Desarrollador Backend", "Empresa C", "Present", "Página 3 de 3"),
+        ]
+    )
+    compacted = TextCompactor().compact(text).split("\n")
+    assert compacted.count(HEADER) == 1
+    assert compacted.count(FOOTER) == 1
+    assert compacted.count("Desarrollador Backend") == 3
+    assert compacted.count("Present") == 2
+    assert "Página 3 de 3" not in compacted
+
+
+def test_bare_numbers_are_only_dropped_at_page_edges():
+    # Table cells extracted one per line, the date and the count are in the middle of the page
+    text = "\f".join(
+        [
+            "\n".join(["EXPERIENCIA", "Empresa A", "03/21", "Personas a cargo", "12", "Proyectos", "1"]),
+            "\n".join(["2", "EDUCACIÓN", "Universidad", "Página 2 de 2"]),
+        ]
+    )
+    compacted = TextCompactor().compact(text).split("\n")
+    assert "03/21" in compacted
+    assert "12" in compacted
+    assert "1" not in compacted
+    assert "2" not in compacted
+    assert "Página 2 de 2" not in compacted
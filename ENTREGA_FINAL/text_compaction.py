@@ -0,0 +1,222 @@
+from collections import Counter
+from math import ceil
+from re import IGNORECASE, compile
+
+from langchain_core.messages import AIMessage
+
+# Words written with a space between each letter, e.g. "E X P E R I E N C I A"
+_LETTER_SPACED = compile(r"(?<!\S)(?:\w ){3,}\w(?!\S)")
+_SPACES = compile(r"[ \t\u00a0]+")
+_ALPHANUMERIC = compile(r"\w")
+# Separator of the pages of an extracted text, PAGE_BREAK of page_extraction
+_PAGE_BREAK = "\f"
+_PAGE_NUMBER = compile(r"(p[áa]gina|p[áa]g\.?|page)\s*\d+(\s*(de|of|/)\s*\d+)?", IGNORECASE)
+# Bare page numbers ("3", "- 3 -", "3/4"), only dropped at the edges of a page since in the middle of a page
+# they are usually cells of a table (dates such as "03/21", counts)
+_BARE_PAGE_NUMBERS = [
+    compile(r"-?\s*\d{1,3}\s*-?"),
+    compile(r"\d{1,3}\s*/\s*\d{1,3}"),
+]
+_HEADINGS = compile(
+    r"(experiencia|experience|trayectoria|historial|educaci[óo]n|education|formaci[óo]n|estudios|"
+    r"certificaci[óo]n|certificaciones|certifications?|cursos|courses|diplomados|habilidades|skills|"
+    r"competencias|idiomas|languages|logros|achievements|proyectos|projects|perfil|profile|resumen|summary)\b",
+    IGNORECASE,
+)
+
+
+def estimate_tokens(text: str, tokens_per_char: float = 0.3) -> int:
+    """
+    Estimates the input tokens of a text, with the same ratio AsyncExtractionClient starts with.
+
+    Args:
+        text (str): The text.
+        tokens_per_char (float, optional): Tokens per character. Defaults to 0.3.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return ceil(len(text) * tokens_per_char)
+
+
+def merge_responses(outputs: list) -> AIMessage:
+    """
+    Joins the responses of the chunks of a CV into a single response, with the records in the order of the
+    chunks and the usage of every request added up.
+
+    Args:
+        outputs (list): The responses of the LLM (AIMessage) for each chunk, in order.
+
+    Returns:
+        AIMessage: The response of the whole CV.
+    """
+    usage = Counter()
+    for output in outputs:
+        usage.update(
+            {
+                key: value
+                for key, value in output.response_metadata.get("usage", {}).items()
+                if isinstance(value, int)
+            }
+        )
+    return AIMessage(
+        content="\n".join(output.content for output in outputs),
+        response_metadata={"usage": dict(usage), "chunks": len(outputs)},
+    )
+
+
+class TextCompactor:
+    """
+    Normalizes the text of a CV before it's sent to the LLM, so the tokens spent are the ones of the CV and
+    not the ones of the layout: it joins letter-spaced words, collapses whitespace, drops page numbers, lines
+    without letters or digits (OCR noise, table borders) and the headers and footers. A header or footer is a
+    line repeated at the top or bottom of several pages, the pages are separated by form feeds (PAGE_BREAK of
+    page_extraction), so a text without them keeps all its lines. The CVs longer than max_tokens are split into
+    chunks aligned with their sections, so each response fits in the output tokens of the model.
+    """
+
+    max_tokens: int
+    min_repeats: int
+    edge_lines: int
+
+    def __init__(self, max_tokens: int = 4000, min_repeats: int = 3, edge_lines: int = 2) -> None:
+        """
+        Initializes the TextCompactor class.
+
+        Args:
+            max_tokens (int, optional): Estimated input tokens of a chunk, longer texts are split. 0 never splits. Defaults to 4000.
+            min_repeats (int, optional): Pages a line must be at the top or bottom of to be considered a header or footer. Defaults to 3.
+            edge_lines (int, optional): Lines at the top and at the bottom of each page where headers, footers and bare page numbers are looked for. Defaults to 2.
+        """
+        self.max_tokens = max_tokens
+        self.min_repeats = min_repeats
+        self.edge_lines = edge_lines
+        self.texts = 0
+        self.chunked = 0
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def compact(self, text: str) -> str:
+        """
+        Normalizes the text of a CV.
+
+        Args:
+            text (str): The extracted text.
+
+        Returns:
+            str: The text without layout noise.
+        """
+        pages = []
+        for page in text.split(_PAGE_BREAK):
+            lines = []
+            for line in page.split("\n"):
+                line = _LETTER_SPACED.sub(lambda match: match.group(0).replace(" ", ""), line)
+                line = _SPACES.sub(" ", line).strip()
+                if _ALPHANUMERIC.search(line) is None:
+                    continue
+                if _PAGE_NUMBER.fullmatch(line):
+                    continue
+                lines.append(line)
+            edge = self.edge_lines
+            pages.append(
+                [
+                    line
+                    for position, line in enumerate(lines)
+                    if not (
+                        (position < edge or position >= len(lines) - edge)
+                        and any(pattern.fullmatch(line) for pattern in _BARE_PAGE_NUMBERS)
+                    )
+                ]
+            )
+
+        # Pages where each line is at the top or the bottom, a line in the middle of a page is never dropped
+        edges = [set(self._edges(lines)) for lines in pages]
+        counts = Counter(key for keys in edges for key in keys)
+        seen = set()
+        compacted = []
+        for lines, keys in zip(pages, edges):
+            for line in lines:
+                key = line.lower()
+                # Consecutive duplicates are OCR noise, lines at the edge of several pages are headers or footers
+                if len(compacted) > 0 and compacted[-1].lower() == key:
+                    continue
+                if key in keys and counts[key] >= self.min_repeats and key in seen:
+                    continue
+                seen.add(key)
+                compacted.append(line)
+
+        result = "\n".join(compacted)
+        self.texts += 1
+        self.chars_in += len(text)
+        self.chars_out += len(result)
+        return result
+
+    def _edges(self, lines: list) -> list:
+        if self.edge_lines <= 0:
+            return []
+        return [line.lower() for line in lines[: self.edge_lines] + lines[-self.edge_lines :]]
+
+    def sections(self, text: str) -> list:
+        """
+        Splits a text into its sections, each one starting at a heading (a short line that is all caps or
+        starts with a usual name of a section of a CV).
+
+        Args:
+            text (str): The text of the CV.
+
+        Returns:
+            list: The text of each section, in order.
+        """
+        sections = [[]]
+        for line in text.split("\n"):
+            heading = len(line) <= 40 and (
+                (line.isupper() and len(line) > 3) or _HEADINGS.match(line) is not None
+            )
+            if heading and len(sections[-1]) > 0:
+                sections.append([])
+            sections[-1].append(line)
+        return ["\n".join(section) for section in sections if len(section) > 0]
+
+    def split(self, text: str) -> list:
+        """
+        Splits a text longer than max_tokens into chunks of whole sections. A section longer than
+        max_tokens is split between lines.
+
+        Args:
+            text (str): The text of the CV.
+
+        Returns:
+            list: The chunks, a single one when the text is short enough.
+        """
+        if self.max_tokens <= 0 or estimate_tokens(text) <= self.max_tokens:
+            return [text]
+        pieces = []
+        for section in self.sections(text):
+            if estimate_tokens(section) <= self.max_tokens:
+                pieces.append(section)
+            else:
+                pieces.extend(section.split("\n"))
+
+        chunks, current = [], []
+        for piece in pieces:
+            if len(current) > 0 and estimate_tokens("\n".join(current + [piece])) > self.max_tokens:
+                chunks.append("\n".join(current))
+                current = []
+            current.append(piece)
+        if len(current) > 0:
+            chunks.append("\n".join(current))
+        if len(chunks) > 1:
+            self.chunked += 1
+        return chunks
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the compactor and the fraction of characters removed.
+        """
+        return {
+            "texts": self.texts,
+            "chunked": self.chunked,
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+            "reduction": 1 - self.chars_out / self.chars_in if self.chars_in > 0 else 0.0,
+        }
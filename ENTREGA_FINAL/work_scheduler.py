@@ -0,0 +1,223 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import UpdateOne
+
+from file_manifest import FileManifest
+from instrumentation import Metrics
+from mongo_writer import find_known_hashes
+from retry_scheduler import (
+    DEAD,
+    PENDING,
+    RetryPolicy,
+    dead_letter,
+    estimated_cost,
+    schedule_order,
+)
+
+
+def scan_labels(root: str = "resumes"):
+    """
+    Streams the files of every label directory with os.scandir, taking one file of each directory in turn,
+    so the first files found already mix every label.
+
+    Args:
+        root (str, optional): The folder with one directory per label. Defaults to "resumes".
+
+    Yields:
+        tuple: The name of the directory and the os.DirEntry of the file.
+    """
+    with os.scandir(root) as entries:
+        directories = sorted(entry.name for entry in entries if entry.is_dir())
+    scanners = [(directory, os.scandir(os.path.join(root, directory))) for directory in directories]
+    try:
+        while len(scanners) > 0:
+            for scanner in list(scanners):
+                entry = next(scanner[1], None)
+                if entry is None:
+                    scanner[1].close()
+                    scanners.remove(scanner)
+                elif entry.is_file():
+                    yield scanner[0], entry
+    finally:
+        for _, scanner in scanners:
+            scanner.close()
+
+
+class WorkScheduler:
+    """
+    Discovers the files of every label directory while they are being processed, feeding a single queue
+    instead of listing, hashing and looking up every file before the first one starts. The files are taken
+    in windows: each window is hashed (through the manifest), looked up in the tracker with $in queries and
+    planned with the retry policy, and its files are sent most expensive first (see schedule_order). The
+    retries are held until every new file was sent. The windows are prepared in a background thread while
+    the pipeline processes the previous one.
+    """
+
+    root: str
+    window: int
+
+    def __init__(
+        self,
+        manifest: FileManifest,
+        tracker,
+        dead_letters,
+        retry_policy: RetryPolicy = None,
+        root: str = "resumes",
+        window: int = 256,
+        metrics: Metrics = None,
+    ) -> None:
+        """
+        Initializes the WorkScheduler class.
+
+        Args:
+            manifest (FileManifest): The manifest used to hash the files.
+            tracker: The MongoDB collection of the tracker.
+            dead_letters: The MongoDB collection of the files that will not be retried.
+            retry_policy (RetryPolicy, optional): Decides which files of the tracker are scheduled. Defaults to a new RetryPolicy.
+            root (str, optional): The folder with one directory per label. Defaults to "resumes".
+            window (int, optional): Number of files discovered before they are hashed and sent. Defaults to 256.
+            metrics (Metrics, optional): Where the latency of the hashing and the tracker queries is recorded. Defaults to a new Metrics.
+        """
+        self.manifest = manifest
+        self.tracker = tracker
+        self.dead_letters = dead_letters
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.root = root
+        self.window = window
+        self.metrics = metrics or Metrics()
+        # Attempt of each hash scheduled in this run, so a file copied in two directories is counted once
+        self._scheduled = {}
+        self.counts = {}
+
+    def _count(self, directory: str, key: str) -> None:
+        counts = self.counts.setdefault(
+            directory, {"found": 0, "scheduled": 0, "waiting": 0, "dead": 0}
+        )
+        counts[key] += 1
+
+    def _plan(self, entries: list) -> tuple:
+        """
+        Hashes a window of files, registers them in the tracker and returns the new files and the retries.
+        """
+        paths = [os.path.join(self.root, directory, entry.name) for directory, entry in entries]
+        with self.metrics.track("tracker_hash"):
+            hashes = self.manifest.hashes(paths)
+        with self.metrics.track("tracker_lookup"):
+            known = find_known_hashes(
+                self.tracker,
+                [h for h in hashes.values() if h and h not in self._scheduled],
+            )
+
+        new, retries = [], []
+        documents_to_insert, tracker_updates, dead_letters = [], [], []
+        for (directory, entry), path in zip(entries, paths):
+            current_hash = hashes[path]
+            if current_hash is False:
+                continue
+            self._count(directory, "found")
+            existing_document = known.get(current_hash)
+            if current_hash in self._scheduled:
+                attempts = self._scheduled[current_hash]
+            elif existing_document is None:
+                documents_to_insert.append(
+                    {
+                        "hash": current_hash,
+                        "directory": directory,
+                        "filename": entry.name,
+                        "status": PENDING,
+                        "attempts": 1,
+                    }
+                )
+                attempts = 1
+            else:
+                plan = self.retry_policy.plan(existing_document)
+                if plan == "wait":
+                    self._count(directory, "waiting")
+                    continue
+                if plan == "dead":
+                    self._count(directory, "dead")
+                    tracker_updates.append(
+                        UpdateOne({"hash": current_hash}, {"$set": {"status": DEAD}})
+                    )
+                    dead_letters.append(
+                        dead_letter(
+                            existing_document,
+                            existing_document.get(
+                                "error", "El flujo se interrumpió durante su proceso"
+                            ),
+                            existing_document.get("last_error_class"),
+                            "max_attempts",
+                        )
+                    )
+                if plan != "run":
+                    continue
+                tracker_updates.append(
+                    UpdateOne(
+                        {"hash": current_hash},
+                        {"$set": {"status": PENDING}, "$inc": {"attempts": 1}},
+                    )
+                )
+                attempts = existing_document.get("attempts", 0) + 1
+            self._scheduled[current_hash] = attempts
+            self._count(directory, "scheduled")
+            item = {
+                "path": f"{self.root}/{directory}/",
+                "file": entry.name,
+                "hash": current_hash,
+                "attempts": attempts,
+                "cost": estimated_cost(entry.name, existing_document),
+                "size": entry.stat().st_size,
+            }
+            (retries if attempts > 1 else new).append(item)
+
+        if documents_to_insert:
+            with self.metrics.track("tracker_insert"):
+                self.tracker.insert_many(documents_to_insert, ordered=False)
+        if tracker_updates:
+            with self.metrics.track("tracker_update"):
+                self.tracker.bulk_write(tracker_updates, ordered=False)
+        if dead_letters:
+            self.dead_letters.insert_many(dead_letters, ordered=False)
+        return new, retries
+
+    def windows(self):
+        """
+        Yields the files to process in windows, the retries of every window in the last one.
+        """
+        entries, retries = [], []
+        for entry in scan_labels(self.root):
+            entries.append(entry)
+            if len(entries) >= self.window:
+                new, window_retries = self._plan(entries)
+                retries += window_retries
+                entries = []
+                if len(new) > 0:
+                    yield schedule_order(new)
+        if len(entries) > 0:
+            new, window_retries = self._plan(entries)
+            retries += window_retries
+            if len(new) > 0:
+                yield schedule_order(new)
+        if len(retries) > 0:
+            yield schedule_order(retries)
+
+    def __iter__(self):
+        for window in self.windows():
+            yield from window
+
+    async def __aiter__(self):
+        # A single thread, so the manifest and the tracker are used by one window at a time
+        loop = asyncio.get_running_loop()
+        windows = self.windows()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = loop.run_in_executor(executor, next, windows, None)
+            while True:
+                window = await future
+                if window is None:
+                    break
+                # The next window is prepared while the pipeline takes this one
+                future = loop.run_in_executor(executor, next, windows, None)
+                for item in window:
+                    yield item